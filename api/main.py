@@ -1,51 +1,156 @@
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from typing import Dict, Any
+from typing import TYPE_CHECKING, Dict, Any
 
 import os
+import copy
 import json
+import time
 from dotenv import load_dotenv
 
-from langgraph.graph import StateGraph, END
-from langgraph.graph.graph import CompiledGraph
-from langchain_core.runnables import RunnableConfig
-from langchain_openai import ChatOpenAI
-
-from hastd.core.schema_parser import parse_schema_into_tasks
+from hastd.core.schema_parser import compile_schema, parse_schema_into_tasks
 from hastd.core.models import DynamicPydanticFactory
 from hastd.core.confidence import score_all_fields
+from hastd.core.streaming import consume_field_stream
+from hastd.core.governor import Priority, RateLimitExceeded, get_governor, model_name_of
+from hastd.core.document import PreparedDocument, prepare_document
+from hastd.core.local_backend import load_local_extractor_from_env
+from hastd.core.prompts import estimated_usage_record, get_template, summarize_prompt_usage, usage_record
+from hastd.core.assembly import AssemblyPlan, output_columns
+from hastd.core.layout_index import LayoutIndex, load_layout_index_from_env
+from hastd.core.result_store import ResultStore, load_result_store_from_env
+from hastd.core.capture import capture_request, instrument_node, record_llm
+from hastd.core.coalescing import (
+    InFlightCoalescer,
+    fingerprint_document,
+    fingerprint_prompt,
+    fingerprint_schema,
+)
+
+if TYPE_CHECKING:
+    from langchain_core.runnables import RunnableConfig
+    from langgraph.graph.graph import CompiledGraph
 
 # --------------------------
 # 🔐 Load API keys
 # --------------------------
 load_dotenv()
-llm = ChatOpenAI(model="gpt-4o", temperature=0)
+
+
+# LLM clients and the agent graph pull in langchain/langgraph, so they are
+# built on first use (or by the lifespan hook) rather than at import time.
+@lru_cache(maxsize=None)
+def get_llm():
+    from langchain_openai import ChatOpenAI
+
+    # Retries are owned by the governor so backoff is coordinated across nodes.
+    # stream_usage asks for token usage (incl. cached prompt tokens) on streamed calls.
+    # With HASTD_CAPTURE_PATH set, every response is also written to the traffic capture.
+    return record_llm(ChatOpenAI(model="gpt-4o", temperature=0, max_retries=0, stream_usage=True))
+
+
+@lru_cache(maxsize=None)
+def get_extractor_llm():
+    # HASTD_EXTRACTOR_BACKEND=local serves extraction from a batched local SLM.
+    local = load_local_extractor_from_env()
+    return record_llm(local) if local is not None else get_llm()
+
+
+@lru_cache(maxsize=None)
+def get_layout_index() -> LayoutIndex | None:
+    # Set HASTD_LAYOUT_INDEX to a sqlite path to reuse extractions for known templates.
+    return load_layout_index_from_env()
+
+
+@lru_cache(maxsize=None)
+def get_result_store() -> ResultStore | None:
+    # Set HASTD_RESULT_STORE to a sqlite path to persist results and serve repeats from it.
+    return load_result_store_from_env()
+
+
+governor = get_governor()
+# Identical (document, schema) requests share one graph run, and identical
+# LLM prompts issued concurrently by different requests share one call.
+request_coalescer = InFlightCoalescer()
+prompt_coalescer = InFlightCoalescer()
+
+
+def _priority(config: "RunnableConfig | None") -> Priority:
+    return (config or {}).get("configurable", {}).get("priority", Priority.BATCH)
 
 # --------------------------
 # 🧠 LangGraph Setup
 # --------------------------
 class GraphState(dict):
     schema: dict
-    document: str
+    document: PreparedDocument
     tasks: list
     extracted_data: dict
     errors: str | None
     corrected_data: dict | None
     confidence: dict | None
+    stream_stats: dict | None
+    prompt_usage: list
+    prefilled: dict  # Field path -> value extracted from a known template's anchors
+    failed_paths: list  # Field paths named by the last validation error
 
 
-def extractor_agent(state: GraphState) -> GraphState:
-    prompt = (
-        f"Extract the following fields from the document:\n"
-        f"{[task['field_path'] for task in state['tasks']]}\n\n"
-        f"Document:\n{state['document']}"
+def _field_model(name: str, field_schema: dict):
+    return DynamicPydanticFactory.create_model_from_schema(
+        {"properties": {name: field_schema}}, model_name=f"{name}_field"
     )
-    result = llm.invoke(prompt)
-    try:
-        output = json.loads(result.content)
-    except json.JSONDecodeError:
-        output = {"error": "Invalid JSON"}
-    return {**state, "extracted_data": output}
+
+
+def _field_validator(schema: dict):
+    """
+    Builds a per-field validator so streamed values can be committed one by one.
+    """
+    properties = schema.get("properties", {})
+
+    def validate_field(name: str, value) -> str | None:
+        if name not in properties:
+            return None
+        try:
+            _field_model(name, properties[name])(**{name: value})
+        except Exception as e:
+            return str(e)
+        return None
+
+    return validate_field
+
+
+def extractor_agent(state: GraphState, config: "RunnableConfig") -> GraphState:
+    # Only ask the LLM for fields the layout anchors could not fill.
+    prefilled = state.get("prefilled") or {}
+    remaining = [task['field_path'] for task in state['tasks'] if task['field_path'] not in prefilled]
+    prompt = get_template("extract_fields").render(
+        state["document"].text,
+        field_paths=remaining,
+    )
+    # Stream the completion so fields are committed as soon as they close and
+    # generation is cancelled once every top-level field has arrived.
+    # HASTD_STREAM_USAGE=1 reads on to the trailing usage chunk instead, for
+    # exact prompt-cache accounting at the cost of the early cancel.
+    streamed = consume_field_stream(
+        governor.stream(get_extractor_llm(), prompt.messages, priority=_priority(config)),
+        field_names={path.split(".")[0].replace("[]", "") for path in remaining},
+        validate_field=_field_validator(state["schema"]),
+        wait_for_usage=os.getenv("HASTD_STREAM_USAGE", "0") == "1",
+    )
+    output = streamed.fields or {"error": "Invalid JSON"}
+    if prefilled:
+        # Merge by field path: the LLM may return siblings of a prefilled leaf
+        # (author.id next to a prefilled author.email) inside the same object.
+        output = AssemblyPlan(list(prefilled)).assemble(prefilled, target=copy.deepcopy(streamed.fields))
+    # Cancelled streams never see their usage chunk, so their usage is estimated.
+    if getattr(streamed.message, "usage_metadata", None):
+        record = usage_record(prompt, streamed.message)
+    else:
+        record = estimated_usage_record(prompt, streamed.raw_text)
+    usage = state.get("prompt_usage", []) + [record]
+    return {**state, "extracted_data": output, "stream_stats": streamed.to_dict(), "prompt_usage": usage}
 
 
 def validation_agent(state: GraphState) -> GraphState:
@@ -54,24 +159,54 @@ def validation_agent(state: GraphState) -> GraphState:
     try:
         model = DynamicPydanticFactory.create_model_from_schema(schema)
         model(**data)
-        return {**state, "errors": None}
+        return {**state, "errors": None, "failed_paths": []}
     except Exception as e:
-        return {**state, "errors": str(e)}
+        return {**state, "errors": str(e), "failed_paths": _error_paths(e)}
+
 
+def _error_paths(error: Exception) -> list:
+    """
+    The dotted field paths a pydantic ValidationError points at, cut at the
+    first list index.
+    """
+    paths = []
+    details = error.errors() if callable(getattr(error, "errors", None)) else []
+    for detail in details:
+        keys = []
+        for key in detail.get("loc", ()):
+            if not isinstance(key, str):
+                break
+            keys.append(key)
+        path = ".".join(keys)
+        if path and path not in paths:
+            paths.append(path)
+    return paths
 
-def correction_agent(state: GraphState) -> GraphState:
-    prompt = (
-        f"Correct the following extracted data based on errors and original text.\n\n"
-        f"Document:\n{state['document']}\n\n"
-        f"Extracted:\n{json.dumps(state['extracted_data'], indent=2)}\n\n"
-        f"Errors:\n{state['errors']}"
+
+def correction_agent(state: GraphState, config: "RunnableConfig") -> GraphState:
+    # Template-filled documents only send the failing fields back, so anchored
+    # values that validated are neither re-sent nor overwritten.
+    failed = state.get("failed_paths") if state.get("prefilled") else None
+    plan = AssemblyPlan(failed) if failed else None
+    extracted = plan.assemble(plan.collect(state['extracted_data'])) if plan else state['extracted_data']
+    prompt = get_template("correct_fields").render(
+        state["document"].text,
+        extracted=json.dumps(extracted, indent=2),
+        errors=state['errors'],
+    )
+    llm = get_llm()
+    result = prompt_coalescer.run(
+        fingerprint_prompt(model_name_of(llm), prompt.messages),
+        lambda: governor.invoke(llm, prompt.messages, priority=_priority(config)),
     )
-    result = llm.invoke(prompt)
     try:
         corrected = json.loads(result.content)
     except json.JSONDecodeError:
         corrected = {}
-    return {**state, "extracted_data": corrected, "corrected_data": corrected}
+    if plan:
+        corrected = plan.assemble(plan.collect(corrected), target=copy.deepcopy(state['extracted_data']))
+    usage = state.get("prompt_usage", []) + [usage_record(prompt, result)]
+    return {**state, "extracted_data": corrected, "corrected_data": corrected, "prompt_usage": usage}
 
 
 def confidence_agent(state: GraphState) -> GraphState:
@@ -82,15 +217,30 @@ def has_errors(state: GraphState):
     return "correct" if state.get("errors") else "no_errors"
 
 
-def build_agent_graph() -> CompiledGraph:
+def route_entry(state: GraphState):
+    # Documents fully covered by template anchors skip the extractor; fields
+    # that then fail validation go to the correction LLM.
+    prefilled = state.get("prefilled") or {}
+    if prefilled and all(task['field_path'] in prefilled for task in state['tasks']):
+        return "validate"
+    return "extract"
+
+
+def build_agent_graph() -> "CompiledGraph":
+    from langgraph.graph import StateGraph, END
+
     builder = StateGraph(GraphState)
 
-    builder.add_node("extract", extractor_agent)
-    builder.add_node("validate", validation_agent)
-    builder.add_node("correct", correction_agent)
-    builder.add_node("score", confidence_agent)
+    # Instrumented nodes attribute LLM calls to their stage and report stage latency.
+    builder.add_node("extract", instrument_node("extract", extractor_agent))
+    builder.add_node("validate", instrument_node("validate", validation_agent))
+    builder.add_node("correct", instrument_node("correct", correction_agent))
+    builder.add_node("score", instrument_node("score", confidence_agent))
 
-    builder.set_entry_point("extract")
+    builder.set_conditional_entry_point(route_entry, {
+        "extract": "extract",
+        "validate": "validate",
+    })
     builder.add_edge("extract", "validate")
     builder.add_conditional_edges("validate", has_errors, {
         "correct": "correct",
@@ -102,12 +252,43 @@ def build_agent_graph() -> CompiledGraph:
     return builder.compile()
 
 
-agent_graph = build_agent_graph()
+@lru_cache(maxsize=None)
+def get_agent_graph() -> "CompiledGraph":
+    return build_agent_graph()
+
+
+def warmup_schemas(paths: str | None) -> int:
+    """
+    Precompiles the schemas at the given os.pathsep-separated JSON paths:
+    task lists and every validation model the agents will ask for.
+    """
+    count = 0
+    for path in filter(None, (paths or "").split(os.pathsep)):
+        with open(path, "r") as f:
+            schema = json.load(f)
+        compile_schema(schema)
+        DynamicPydanticFactory.create_model_from_schema(schema)
+        for name, field_schema in schema.get("properties", {}).items():
+            _field_model(name, field_schema)
+        count += 1
+    return count
+
 
 # --------------------------
 # 🚀 FastAPI App
 # --------------------------
-app = FastAPI(title="HASTD Agentic Extraction API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build clients and the graph before serving traffic, unless the worker
+    # should come up as fast as possible and pay that cost on the first request.
+    if os.getenv("HASTD_LAZY_STARTUP", "0") != "1":
+        get_extractor_llm()
+        get_agent_graph()
+        warmup_schemas(os.getenv("HASTD_WARMUP_SCHEMAS"))
+    yield
+
+
+app = FastAPI(title="HASTD Agentic Extraction API", lifespan=lifespan)
 
 
 class ExtractionRequest(BaseModel):
@@ -115,24 +296,77 @@ class ExtractionRequest(BaseModel):
     json_schema: Dict[str, Any]
 
 
+def run_extraction(document_text: str, json_schema: Dict[str, Any]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    task_list = parse_schema_into_tasks(json_schema)
+    document = prepare_document(document_text)
+    inputs = {
+        "schema": json_schema,
+        "document": document,
+        "tasks": task_list,
+    }
+
+    # Near-duplicates of a known template are filled from learned anchors.
+    layout_index = get_layout_index()
+    schema_hash = fingerprint_schema(json_schema)
+    plan = AssemblyPlan([task.field_path for task in task_list if "[]" not in task.field_path])
+    if layout_index is not None:
+        signature = layout_index.signature(document)
+        prefilled = layout_index.prefill(document, schema_hash, task_list, signature)
+        inputs.update(prefilled=prefilled, extracted_data=plan.assemble(prefilled))
+
+    final_state = get_agent_graph().invoke(
+        inputs, config={"configurable": {"priority": Priority.INTERACTIVE}}
+    )
+
+    if layout_index is not None and not final_state.get("errors"):
+        layout_index.update(
+            document, schema_hash, plan.collect(final_state["extracted_data"]), inputs["prefilled"], signature
+        )
+
+    response = {
+        "extracted_data": final_state["extracted_data"],
+        "corrected_data": final_state.get("corrected_data"),
+        "confidence_scores": final_state.get("confidence"),
+        "errors": final_state.get("errors"),
+        "stream_stats": final_state.get("stream_stats"),
+        "prompt_cache": summarize_prompt_usage(final_state.get("prompt_usage", [])),
+        "template_fields": sorted(final_state.get("prefilled") or {}),
+    }
+
+    result_store = get_result_store()
+    if result_store is not None:
+        columns = output_columns(task_list)
+        result_store.put(
+            document.doc_id,
+            schema_hash,
+            columns,
+            AssemblyPlan(list(columns)).collect(final_state["extracted_data"]),
+            response,
+            errors=final_state.get("errors"),
+            # LLM calls are not attributable to single fields here, so only the
+            # request-level count is stored.
+            attempts=len(final_state.get("prompt_usage", [])),
+            timings={"total": time.perf_counter() - started},
+        )
+    return response
+
+
 @app.post("/extract")
 def extract_data(req: ExtractionRequest):
     try:
-        task_list = parse_schema_into_tasks(req.json_schema)
-        inputs = {
-            "schema": req.json_schema,
-            "document": req.document_text,
-            "tasks": task_list,
-        }
-
-        final_state = agent_graph.invoke(inputs, config=RunnableConfig())
-
-        return {
-            "extracted_data": final_state["extracted_data"],
-            "corrected_data": final_state.get("corrected_data"),
-            "confidence_scores": final_state.get("confidence"),
-            "errors": final_state.get("errors"),
-        }
+        key = (fingerprint_document(req.document_text), fingerprint_schema(req.json_schema))
+        with capture_request(req.document_text, req.json_schema, *key):
+            result_store = get_result_store()
+            stored = result_store.get(*key) if result_store is not None else None
+            if stored is not None and not stored["errors"]:
+                return {**stored["response"], "from_store": True}
+            return request_coalescer.run(
+                key, lambda: run_extraction(req.document_text, req.json_schema)
+            )
 
+    except RateLimitExceeded as e:
+        headers = {"Retry-After": str(int(e.retry_after or 1))}
+        raise HTTPException(status_code=429, detail=str(e), headers=headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
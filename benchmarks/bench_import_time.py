@@ -0,0 +1,72 @@
+"""
+Tracks cold-start latency: how long a fresh interpreter takes to import the
+API, the POC script and the hastd.core modules.
+
+Each target is imported in a new subprocess (so nothing is cached in
+sys.modules) and the best of N runs is reported, minus the cost of starting
+a bare interpreter. Use --json to append results to a file and compare builds.
+
+Usage:
+    python benchmarks/bench_import_time.py [--runs 5] [--json results.jsonl] [module ...]
+    python -X importtime -c "import api.main"   # per-module breakdown
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+DEFAULT_TARGETS = [
+    "hastd.core.schema_parser",
+    "hastd.core.document",
+    "hastd.core.governor",
+    "hastd.core.models",
+    "api.main",
+    "run_poc",
+]
+
+
+def _import_seconds(statement: str, runs: int) -> float:
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(ROOT), str(ROOT / "src")])}
+    best = float("inf")
+    for _ in range(runs):
+        started = time.perf_counter()
+        completed = subprocess.run([sys.executable, "-c", statement], cwd=ROOT, env=env, capture_output=True)
+        elapsed = time.perf_counter() - started
+        if completed.returncode != 0:
+            raise RuntimeError(completed.stderr.decode(errors="replace").strip().splitlines()[-1])
+        best = min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=DEFAULT_TARGETS)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", dest="json_path", help="Append results as a JSON line to this file.")
+    args = parser.parse_args()
+
+    baseline = _import_seconds("pass", args.runs)
+    results = {"timestamp": time.time(), "python": sys.version.split()[0], "baseline_ms": baseline * 1000}
+    print(f"{'module':<30} {'import (ms)':>12}")
+    print(f"{'<interpreter start>':<30} {baseline * 1000:12.1f}")
+    for module in args.modules:
+        try:
+            elapsed = (_import_seconds(f"import {module}", args.runs) - baseline) * 1000
+            results[module] = round(elapsed, 1)
+            print(f"{module:<30} {elapsed:12.1f}")
+        except RuntimeError as e:
+            results[module] = None
+            print(f"{module:<30} {'failed':>12}  ({e})")
+
+    if args.json_path:
+        with open(args.json_path, "a") as f:
+            f.write(json.dumps(results) + "\n")
+
+
+if __name__ == "__main__":
+    main()
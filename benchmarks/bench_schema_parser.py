@@ -0,0 +1,112 @@
+"""
+Benchmarks schema compilation on large, reference-heavy schemas.
+
+Compares compiling a schema with native $ref resolution against the old
+workflow of pre-expanding every $ref inline and parsing the result.
+
+Usage:
+    python benchmarks/bench_schema_parser.py                 # synthetic schemas
+    python benchmarks/bench_schema_parser.py schema.json ... # real-world schemas
+"""
+import json
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(ROOT), str(ROOT / "src")]
+
+from hastd.core.schema_parser import SchemaCompiler, parse_json_schema  # noqa: E402
+
+
+def synthetic_schema(levels: int, width: int, scalars: int, fan_out: int) -> dict:
+    """
+    A FHIR/OpenAPI-shaped schema: `levels` layers of `width` definitions. Every
+    definition has `scalars` leaf fields, references `fan_out` definitions of
+    the next layer, and has a recursive `extension` list of itself.
+    """
+    defs = {}
+    for level in range(levels):
+        for i in range(width):
+            properties = {f"field_{j}": {"type": "string", "description": f"Field {j}"} for j in range(scalars)}
+            if level + 1 < levels:
+                for k in range(fan_out):
+                    properties[f"ref_{k}"] = {"$ref": f"#/$defs/L{level + 1}D{(i + k) % width}"}
+            properties["extension"] = {"type": "array", "items": {"$ref": f"#/$defs/L{level}D{i}"}}
+            defs[f"L{level}D{i}"] = {
+                "allOf": [{"type": "object", "properties": properties}, {"required": ["field_0"]}]
+            }
+    return {
+        "$defs": defs,
+        "type": "object",
+        "properties": {f"root_{i}": {"$ref": f"#/$defs/L0D{i}"} for i in range(width)},
+    }
+
+
+def pre_expand(schema: dict, node=None, stack=()) -> dict:
+    """
+    The old workaround: inline every $ref (cutting direct recursion).
+    """
+    node = schema if node is None else node
+    if isinstance(node, dict):
+        if "$ref" in node:
+            ref = node["$ref"]
+            if ref in stack:
+                return {"type": "object"}
+            target = schema
+            for part in ref[2:].split("/"):
+                target = target[part]
+            return pre_expand(schema, target, stack + (ref,))
+        return {k: pre_expand(schema, v, stack) for k, v in node.items() if k != "$defs"}
+    if isinstance(node, list):
+        return [pre_expand(schema, v, stack) for v in node]
+    return node
+
+
+def count_nodes(node) -> int:
+    if isinstance(node, dict):
+        return 1 + sum(count_nodes(v) for v in node.values())
+    if isinstance(node, list):
+        return sum(count_nodes(v) for v in node)
+    return 0
+
+
+def timed(fn, repeat: int = 3):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def bench(name: str, schema: dict):
+    compile_time, compiler = timed(lambda: _compile(schema))
+    tasks = compiler.compile()
+    print(f"\n{name}: {count_nodes(schema):,} schema nodes, {len(tasks):,} tasks")
+    print(f"  native $ref compilation : {compile_time * 1000:9.1f} ms  {compiler.stats}")
+
+    try:
+        sys.setrecursionlimit(100_000)
+        expand_time, expanded = timed(lambda: pre_expand(schema), repeat=1)
+        parse_time, _ = timed(lambda: parse_json_schema(expanded), repeat=1)
+        print(f"  pre-expanded ({count_nodes(expanded):,} nodes): {(expand_time + parse_time) * 1000:9.1f} ms")
+    except (RecursionError, MemoryError) as e:
+        print(f"  pre-expanded            : failed ({type(e).__name__})")
+
+
+def _compile(schema: dict) -> SchemaCompiler:
+    compiler = SchemaCompiler(schema)
+    compiler.compile()
+    return compiler
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        for path in sys.argv[1:]:
+            with open(path, "r") as f:
+                bench(Path(path).name, json.load(f))
+    else:
+        for levels, width, scalars, fan_out in [(3, 10, 10, 3), (4, 20, 10, 3), (5, 30, 8, 3)]:
+            bench(f"synthetic levels={levels} width={width} scalars={scalars} fan_out={fan_out}",
+                  synthetic_schema(levels, width, scalars, fan_out))
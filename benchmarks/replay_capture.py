@@ -0,0 +1,160 @@
+"""
+Replays a traffic capture against the extraction pipeline, offline.
+
+Captures are written by the API when HASTD_CAPTURE_PATH is set. Every
+captured request is re-driven through `api.main.extract_data` with the
+recorded LLM responses served locally, so slowdowns can be reproduced and
+builds compared without calling a provider. The result store and the layout
+index are bypassed so every request runs the full graph.
+
+By default requests are sent with their original inter-arrival gaps and LLM
+responses take their recorded latency, including the time each call spent
+queued in the rate-limit governor; --max-speed drops all of it. The report
+has request latency, per-stage (graph node) latency and replay hit rates.
+Options:
+    --tracemalloc   also report per-stage memory deltas, peak traced
+                    memory and the top allocation sites
+    --cprofile      write cProfile stats for the replayed requests
+    --json          append the report as a JSON line to a file
+
+Usage:
+    python benchmarks/replay_capture.py capture.jsonl [--max-speed] [--concurrency 8]
+        [--tracemalloc] [--cprofile replay.prof] [--json results.jsonl]
+"""
+import argparse
+import cProfile
+import json
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(ROOT), str(ROOT / "src")]
+
+from hastd.core.capture import (  # noqa: E402
+    ReplayLLM,
+    StageProfile,
+    configure_recorder,
+    latency_summary,
+    load_capture,
+    set_stage_profile,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", help="JSONL capture written with HASTD_CAPTURE_PATH.")
+    parser.add_argument("--max-speed", action="store_true", help="Ignore arrival gaps and recorded LLM latency.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum requests in flight.")
+    parser.add_argument("--tracemalloc", action="store_true", help="Trace memory allocations.")
+    parser.add_argument("--cprofile", dest="cprofile_path", help="Write cProfile stats to this file.")
+    parser.add_argument("--json", dest="json_path", help="Append the report as a JSON line to this file.")
+    args = parser.parse_args()
+
+    capture = load_capture(args.capture)
+    requests = capture["request"]
+    if not requests:
+        raise SystemExit(f"No requests in {args.capture}.")
+
+    import api.main as api
+
+    # Serve recorded responses, don't re-capture, and always run the graph.
+    configure_recorder(None)
+    replay_llm = ReplayLLM(capture["llm"], realtime=not args.max_speed)
+    api.get_llm = api.get_extractor_llm = lambda: replay_llm
+    api.get_result_store = api.get_layout_index = lambda: None
+    api.get_agent_graph()
+
+    stages = StageProfile()
+    set_stage_profile(stages)
+    if args.tracemalloc:
+        tracemalloc.start(25)
+
+    latencies, failures, profiles = [], {}, []
+    lock = threading.Lock()
+
+    def replay_one(record):
+        profile = cProfile.Profile() if args.cprofile_path else None
+        started = time.perf_counter()
+        status = "ok"
+        if profile:
+            profile.enable()
+        try:
+            api.extract_data(api.ExtractionRequest(
+                document_text=record["document_text"], json_schema=record["json_schema"]
+            ))
+        except Exception as e:
+            status = getattr(e, "detail", None) or type(e).__name__
+        finally:
+            if profile:
+                profile.disable()
+        with lock:
+            latencies.append(time.perf_counter() - started)
+            if status != "ok":
+                failures[str(status)] = failures.get(str(status), 0) + 1
+            if profile:
+                profiles.append(profile)
+
+    first_arrival = requests[0]["received_at"]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for record in requests:
+            if not args.max_speed:
+                delay = (record["received_at"] - first_arrival) - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(replay_one, record)
+    wall = time.perf_counter() - started
+    set_stage_profile(None)
+
+    report = {
+        "timestamp": time.time(),
+        "capture": args.capture,
+        "mode": "max-speed" if args.max_speed else "original-timing",
+        "requests": len(requests),
+        "failures": failures,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(requests) / wall, 2) if wall else None,
+        "latency": latency_summary(latencies),
+        "stages": stages.summary(),
+        "replay": replay_llm.stats,
+    }
+
+    print(f"🔁 Replayed {len(requests)} requests in {wall:.2f}s ({report['mode']})")
+    print(f"{'stage':<12} {'count':>6} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for name, row in [("<request>", report["latency"]), *report["stages"].items()]:
+        print(f"{name:<12} {row['count']:>6} {row['mean_ms']:>9} {row['p50_ms']:>9} {row['p95_ms']:>9} {row['max_ms']:>9}")
+    print(f"LLM replay: {replay_llm.stats}   failures: {failures or 'none'}")
+
+    if args.tracemalloc:
+        current, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics("lineno")[:15]
+        tracemalloc.stop()
+        report["memory"] = {
+            "current_kb": round(current / 1024, 1),
+            "peak_kb": round(peak / 1024, 1),
+            "top": [{"site": str(stat.traceback), "size_kb": round(stat.size / 1024, 1)} for stat in top],
+        }
+        print(f"\n🧠 Traced memory: current {current / 1024:.0f} KiB, peak {peak / 1024:.0f} KiB")
+        for stat in top:
+            print(f"  {stat}")
+
+    if profiles:
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(args.cprofile_path)
+        print(f"\n⏱️  cProfile stats written to {args.cprofile_path} (top functions by cumulative time):")
+        stats.sort_stats("cumulative").print_stats(20)
+
+    if args.json_path:
+        with open(args.json_path, "a") as f:
+            f.write(json.dumps(report) + "\n")
+
+
+if __name__ == "__main__":
+    main()
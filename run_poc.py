@@ -1,67 +1,108 @@
 import os
 import json
-from typing import Literal, Optional, TypedDict, Dict, Any, List
-import dpath.util
+import operator
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import TYPE_CHECKING, Annotated, Literal, Optional, TypedDict, Dict, Any, List, Tuple
 
 from dotenv import load_dotenv
-from pydantic import ValidationError
-from langchain_core.messages import HumanMessage
-from langgraph.graph import StateGraph, END
-from langchain_openai import ChatOpenAI
 
 # Correctly named imports from your project files
 from hastd.core.schema_parser import parse_schema_into_tasks
 from hastd.core.models import DynamicPydanticFactory
 from hastd.core.task_dag import TaskDAGBuilder
+from hastd.core.governor import Priority, get_governor
+from hastd.core.document import PreparedDocument, prepare_document
+from hastd.core.local_backend import load_local_extractor_from_env
+from hastd.core.prompts import get_template, summarize_prompt_usage, usage_record
+from hastd.core.assembly import (
+    ArrayGroup,
+    AssemblyPlan,
+    batched,
+    group_array_tasks,
+    locate_item_spans,
+    output_columns,
+)
+from hastd.core.coalescing import fingerprint_schema
+from hastd.core.layout_index import load_layout_index_from_env
+from hastd.core.result_store import load_result_store_from_env
+
+if TYPE_CHECKING:
+    from langchain_core.runnables import RunnableConfig
 
 # -----------------------------
 # 🔐 Load API keys from .env
 # -----------------------------
 load_dotenv()
-# Note: Using a cheaper/faster model like "gpt-4o-mini" or "claude-3-haiku-20240307" is ideal for development
-llm = ChatOpenAI(model="gpt-4o", temperature=0)
+
+
+# Clients are built on first use so importing this module stays cheap.
+@lru_cache(maxsize=None)
+def get_llm():
+    from langchain_openai import ChatOpenAI
+
+    # Note: Using a cheaper/faster model like "gpt-4o-mini" or "claude-3-haiku-20240307" is ideal for development
+    # Retries are owned by the governor so backoff is coordinated across nodes.
+    return ChatOpenAI(model="gpt-4o", temperature=0, max_retries=0)
+
+
+@lru_cache(maxsize=None)
+def get_extractor_llm():
+    # Set HASTD_EXTRACTOR_BACKEND=local to serve extraction from a local (fine-tuned) SLM
+    # that batches concurrent field tasks; corrections stay on the frontier model.
+    return load_local_extractor_from_env() or get_llm()
+
+
+# Shared rate-limit/concurrency governor; the POC runs as a batch job.
+governor = get_governor()
 
 
 # -----------------------------
 # 🧠 Define LangGraph State for a SINGLE task
 # -----------------------------
 class AgentState(TypedDict):
-    document: str
+    document: PreparedDocument  # Shared by reference across all field tasks
     task: Dict[str, Any]
     final_json: Dict[str, Any]  # The master JSON being built
     extracted_data: Optional[Dict[str, Any]]
     errors: Optional[str]
     max_attempts: int
     current_attempt: int
+    source: Optional[str]  # "template" when extracted_data came from learned layout anchors
+    prompt_usage: Annotated[List[Dict[str, Any]], operator.add]  # Token/cache usage per LLM call
 
 
 # -----------------------------
 # 🤖 Agent: Extractor (focused on a single task)
 # -----------------------------
-def extractor_agent(state: AgentState) -> Dict[str, Any]:
+def extractor_agent(state: AgentState, config: "RunnableConfig") -> Dict[str, Any]:
     print(f"---  extractor_agent: Extracting '{state['task']['field_path']}' ---")
     task = state['task']
     field_name = task['field_path'].split('.')[-1].replace('[]', '')
 
-    prompt = f"""
-    From the following document, extract the single field '{task['field_path']}'.
-    Pay close attention to the field description: "{task['description']}".
-
-    DOCUMENT:
-    ---
-    {state['document']}
-    ---
-
-    Return ONLY a single JSON object with the key "{field_name}". Do not include any other text or explanations.
-    """
-
-    result = llm.invoke([HumanMessage(content=prompt)])
+    # Document-first layout: all field tasks share a byte-identical prompt prefix
+    # that provider prompt caches (and the local backend) can reuse.
+    prompt = get_template("extract_field").render(
+        state['document'].text,
+        field_path=task['field_path'],
+        description=task['description'],
+        field_name=field_name,
+    )
+
+    priority = config.get("configurable", {}).get("priority", Priority.BATCH)
+    result = governor.invoke(get_extractor_llm(), prompt.messages, priority=priority)
     try:
         parsed_output = json.loads(result.content)
     except json.JSONDecodeError:
         parsed_output = {"error": "LLM returned malformed JSON."}
 
-    return {"extracted_data": parsed_output, "current_attempt": state["current_attempt"] + 1}
+    return {
+        "extracted_data": parsed_output,
+        "source": "llm",
+        "current_attempt": state["current_attempt"] + 1,
+        "prompt_usage": [usage_record(prompt, result)],
+    }
 
 
 # -----------------------------
@@ -77,7 +118,8 @@ def validation_agent(state: AgentState) -> Dict[str, Any]:
     single_field_schema = {
         "properties": {
             field_name: {
-                "type": task["field_type"],
+                # Scalar arrays such as "tags[]" are extracted as a whole list
+                "type": "array" if task['field_path'].endswith('[]') else task["field_type"],
                 "description": task["description"]
             }
         }
@@ -89,7 +131,7 @@ def validation_agent(state: AgentState) -> Dict[str, Any]:
         model(**data)
         print("✅ Validation PASSED")
         return {"errors": None}
-    except ValidationError as e:
+    except ValueError as e:  # pydantic.ValidationError is a ValueError
         print(f"❌ Validation FAILED: {str(e)}")
         return {"errors": str(e)}
 
@@ -97,43 +139,41 @@ def validation_agent(state: AgentState) -> Dict[str, Any]:
 # -----------------------------
 # 🔁 Agent: Correction (focused on a single task)
 # -----------------------------
-def correction_agent(state: AgentState) -> Dict[str, Any]:
+def correction_agent(state: AgentState, config: "RunnableConfig") -> Dict[str, Any]:
     print("--- correction_agent: Attempting to correct ---")
     task = state['task']
     field_name = task['field_path'].split('.')[-1].replace('[]', '')
 
-    prompt = f"""
-    A previous attempt to extract a field from a document failed. Please correct it.
-
-    DOCUMENT:
-    ---
-    {state['document']}
-    ---
-    FIELD TO EXTRACT: {task['field_path']}
-    DESCRIPTION: {task['description']}
-
-    PREVIOUS (INCORRECT) OUTPUT:
-    {json.dumps(state['extracted_data'], indent=2)}
-
-    VALIDATION ERRORS:
-    {state['errors']}
-
-    Return ONLY a corrected JSON object with the key "{field_name}".
-    """
-
-    result = llm.invoke([HumanMessage(content=prompt)])
+    prompt = get_template("correct_field").render(
+        state['document'].text,
+        field_path=task['field_path'],
+        description=task['description'],
+        previous_output=json.dumps(state['extracted_data'], indent=2),
+        errors=state['errors'],
+        field_name=field_name,
+    )
+
+    priority = config.get("configurable", {}).get("priority", Priority.BATCH)
+    result = governor.invoke(get_llm(), prompt.messages, priority=priority)
     try:
         corrected = json.loads(result.content)
     except json.JSONDecodeError:
         corrected = {"error": "Corrector LLM returned malformed JSON."}
 
-    return {"extracted_data": corrected}
+    return {"extracted_data": corrected, "prompt_usage": [usage_record(prompt, result)]}
 
 
 # -----------------------------
-# 🔀 Condition: Should correct or give up?
+# 🔀 Conditions: Where to start, and should correct or give up?
 # -----------------------------
-def should_correct(state: AgentState) -> Literal["correct", "__end__"]:
+def route_entry(state: AgentState) -> Literal["extract", "validate"]:
+    # Values prefilled from a known template's anchors only need validating.
+    return "validate" if state.get("extracted_data") else "extract"
+
+
+def should_correct(state: AgentState) -> Literal["extract", "correct", "__end__"]:
+    if state.get("errors") and state.get("source") == "template":
+        return "extract"  # Fall back to the LLM for this field
     if state.get("errors") and state["current_attempt"] < state["max_attempts"]:
         return "correct"
     return "__end__"
@@ -142,26 +182,162 @@ def should_correct(state: AgentState) -> Literal["correct", "__end__"]:
 # -----------------------------
 # 🧠 Build LangGraph
 # -----------------------------
-builder = StateGraph(AgentState)
+def build_agentic_loop():
+    from langgraph.graph import StateGraph, END
+
+    builder = StateGraph(AgentState)
+
+    builder.add_node("extract", extractor_agent)
+    builder.add_node("validate", validation_agent)
+    builder.add_node("correct", correction_agent)
+
+    builder.set_conditional_entry_point(route_entry, {
+        "extract": "extract",
+        "validate": "validate",
+    })
+    builder.add_edge("extract", "validate")
+    builder.add_conditional_edges("validate", should_correct, {
+        "extract": "extract",
+        "correct": "correct",
+        "__end__": END
+    })
+    builder.add_edge("correct", "extract")  # Loop back to extractor for a fresh attempt
+
+    return builder.compile()
+
+
+# -----------------------------
+# 📚 Arrays of objects: enumerate items, then extract them in batches
+# -----------------------------
+ITEM_BATCH_SIZE = int(os.getenv("HASTD_ITEM_BATCH_SIZE", "10"))
 
-builder.add_node("extract", extractor_agent)
-builder.add_node("validate", validation_agent)
-builder.add_node("correct", correction_agent)
 
-builder.set_entry_point("extract")
-builder.add_edge("extract", "validate")
-builder.add_conditional_edges("validate", should_correct, {
-    "correct": "correct",
-    "__end__": END
-})
-builder.add_edge("correct", "extract")  # Loop back to extractor for a fresh attempt
+def _parse_items(content: str) -> List[Any]:
+    try:
+        items = json.loads(content).get("items", [])
+    except (json.JSONDecodeError, AttributeError):
+        return []
+    return items if isinstance(items, list) else []
+
+
+def enumerate_items(
+    document: PreparedDocument, group: ArrayGroup, priority: Priority
+) -> Tuple[List[Tuple[int, int]], Dict[str, Any]]:
+    """
+    Asks for the opening words of every item and turns them into item spans.
+    """
+    print(f"--- enumerate_items: Finding items of '{group.path}[]' ---")
+    prompt = get_template("enumerate_items").render(
+        document.text,
+        array_path=group.path,
+        description="each with " + ", ".join(group.item_fields),
+    )
+    result = governor.invoke(get_extractor_llm(), prompt.messages, priority=priority)
+    anchors = [anchor for anchor in _parse_items(result.content) if isinstance(anchor, str)]
+    return locate_item_spans(document.text, anchors), usage_record(prompt, result)
+
+
+def extract_item_batch(
+    document: PreparedDocument,
+    group: ArrayGroup,
+    excerpts: List[str],
+    priority: Priority,
+    previous: Optional[List[Tuple[Any, str]]] = None,
+) -> Tuple[List[Any], Dict[str, Any]]:
+    """
+    Extracts one item per excerpt. With `previous` (the failed output and
+    validation error for each excerpt) the items are sent for correction.
+    """
+    item_fields = "\n".join(
+        f"- {field}: {task['description'] or ''}" for field, task in zip(group.item_fields, group.item_tasks)
+    )
+    if previous is None:
+        prompt = get_template("extract_items").render(
+            document.text,
+            array_path=group.path,
+            item_fields=item_fields,
+            excerpts="\n\n".join(f"[{number}] {excerpt}" for number, excerpt in enumerate(excerpts, 1)),
+        )
+    else:
+        prompt = get_template("correct_items").render(
+            document.text,
+            array_path=group.path,
+            item_fields=item_fields,
+            excerpts="\n\n".join(
+                f"[{number}] {excerpt}\nPREVIOUS OUTPUT: {json.dumps(item)}\nVALIDATION ERRORS: {error}"
+                for number, (excerpt, (item, error)) in enumerate(zip(excerpts, previous), 1)
+            ),
+        )
+    result = governor.invoke(get_extractor_llm(), prompt.messages, priority=priority)
+    items = _parse_items(result.content)
+    # Keep alignment with the excerpts even if the model dropped or added items.
+    items = (items + [None] * len(excerpts))[:len(excerpts)]
+    return items, usage_record(prompt, result)
+
+
+def extract_array_group(
+    document: PreparedDocument,
+    group: ArrayGroup,
+    max_attempts: int = 3,
+    priority: Priority = Priority.BATCH,
+    max_workers: int = 8,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Extracts an array of objects item by item, so the fields of one item stay
+    together. Items that fail validation are sent back in later rounds with
+    their previous output and validation error. Returns the items in document
+    order and the prompt usage records.
+    """
+    spans, record = enumerate_items(document, group, priority)
+    usage = [record]
+    excerpts = [document.text[start:end] for start, end in spans]
+    item_model = DynamicPydanticFactory.create_model_from_schema(group.item_schema, "ArrayItemModel")
+
+    items: List[Optional[Dict[str, Any]]] = [None] * len(excerpts)
+    pending = list(range(len(excerpts)))
+    failures: Dict[int, Tuple[Any, str]] = {}  # Item index -> (previous output, validation error)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for attempt in range(max_attempts):
+            if not pending:
+                break
+            batches = batched(pending, ITEM_BATCH_SIZE)
+            results = pool.map(
+                lambda batch: extract_item_batch(
+                    document,
+                    group,
+                    [excerpts[i] for i in batch],
+                    priority,
+                    previous=[failures[i] for i in batch] if attempt else None,
+                ),
+                batches,
+            )
+            failed = []
+            for batch, (batch_items, record) in zip(batches, results):
+                usage.append(record)
+                for index, item in zip(batch, batch_items):
+                    if not isinstance(item, dict):
+                        failures[index] = (item, "Missing or not a JSON object.")
+                        failed.append(index)
+                        continue
+                    try:
+                        item_model(**item)
+                        items[index] = item
+                    except ValueError as e:  # pydantic.ValidationError
+                        failures[index] = (item, str(e))
+                        failed.append(index)
+            pending = failed
+
+    print(f"✅ Extracted {len(excerpts) - len(pending)}/{len(excerpts)} items of '{group.path}[]'")
+    return [item for item in items if item is not None], usage
 
-agentic_loop = builder.compile()
 
 # -----------------------------
 # 🚀 Main Orchestration Logic
 # -----------------------------
 if __name__ == "__main__":
+    started = time.perf_counter()
+    agentic_loop = build_agentic_loop()
+
     # 1. Load sample document and schema
     with open("data/samples/document_1.txt", "r") as f:
         document_text = f.read()
@@ -169,53 +345,130 @@ if __name__ == "__main__":
     with open("data/samples/schema_1.json", "r") as f:
         json_schema = json.load(f)
 
-    # 2. Use Schema Parser and DAG Builder to get execution order
+    # Preprocess the document once; every field task shares this object.
+    # Set HASTD_DOCUMENT_CACHE to reuse prepared documents across runs.
+    document = prepare_document(document_text, cache_dir=os.getenv("HASTD_DOCUMENT_CACHE"))
+    schema_hash = fingerprint_schema(json_schema)
+
+    # Serve a previous successful run of this document and schema from the
+    # result store (HASTD_RESULT_STORE), if there is one.
+    result_store = load_result_store_from_env()
+    stored = result_store.get(document.doc_id, schema_hash) if result_store else None
+    if stored is not None and not stored["errors"]:
+        print("📦 FINAL JSON OUTPUT (from the result store)\n" + "=" * 40)
+        print(json.dumps(stored["response"]["final_json"], indent=2))
+        raise SystemExit(0)
+
+    # 2. Use Schema Parser and DAG Builder to get execution order.
+    #    Fields inside arrays of objects (e.g. "references[].title") are
+    #    extracted per item instead of as independent tasks.
     tasks = parse_schema_into_tasks(json_schema)
-    dag_builder = TaskDAGBuilder(tasks)
+    field_tasks, array_groups = group_array_tasks(tasks)
+    dag_builder = TaskDAGBuilder(field_tasks)
+    dag_builder.build()
     execution_order = dag_builder.get_execution_order()
 
     # Create a quick lookup for task details
-    tasks_by_path = {task.field_path: task.to_dict() for task in tasks}
+    tasks_by_path = {task.field_path: task.to_dict() for task in field_tasks}
+
+    # Documents matching a known template (HASTD_LAYOUT_INDEX) start from
+    # values read off learned anchors instead of an LLM call per field.
+    layout_index = load_layout_index_from_env()
+    prefilled = layout_index.prefill(document, schema_hash, field_tasks) if layout_index else {}
 
-    # 3. Iterate through the DAG and run the agentic loop for each task
+    # 3. Run the agentic loop for every task concurrently so the governor and
+    #    the extractor backend can batch and pipeline the LLM calls.
     final_json_output = {}
+    max_concurrency = int(os.getenv("HASTD_MAX_CONCURRENCY", "8"))
 
     print("🚀 STARTING HASTD ORCHESTRATION\n" + "=" * 40)
 
-    for field_path in execution_order:
-        if field_path not in tasks_by_path:
-            # This is a parent object path, not an extraction task itself
-            continue
-
-        current_task = tasks_by_path[field_path]
-
-        initial_state = {
-            "document": document_text,
+    # Parent object paths in the DAG are not extraction tasks themselves.
+    ordered_tasks = [tasks_by_path[path] for path in execution_order if path in tasks_by_path]
+    initial_states = [
+        {
+            "document": document,
             "task": current_task,
-            "final_json": final_json_output,  # Provide context of what's already extracted
+            "final_json": final_json_output,
             "max_attempts": 3,
             "current_attempt": 0,
+            "prompt_usage": [],
+            **(
+                {
+                    "extracted_data": {
+                        current_task['field_path'].split('.')[-1].replace('[]', ''):
+                            prefilled[current_task['field_path']]
+                    },
+                    "source": "template",
+                }
+                if current_task['field_path'] in prefilled else {}
+            ),
         }
-
-        # Invoke the agentic loop for this single task
-        final_task_state = agentic_loop.invoke(initial_state)
-
-        # 4. Merge the successful result into the final JSON
+        for current_task in ordered_tasks
+    ]
+    print(f"📐 {len(prefilled)}/{len(ordered_tasks)} fields prefilled from a known template")
+    # Every extraction prompt starts with the same system text and document
+    # block; a local SLM computes its key/value states once, before fan-out.
+    extractor = get_extractor_llm()
+    if hasattr(extractor, "warm_prefix"):
+        extractor.warm_prefix(get_template("extract_field").render_prefix(document.text).messages)
+    with ThreadPoolExecutor(max_workers=max(1, len(array_groups))) as pool:
+        array_futures = [
+            pool.submit(extract_array_group, document, group, 3, Priority.BATCH, max_concurrency)
+            for group in array_groups
+        ]
+        final_task_states = agentic_loop.batch(
+            initial_states,
+            config={"configurable": {"priority": Priority.BATCH}, "max_concurrency": max_concurrency},
+        )
+        array_results = [future.result() for future in array_futures]
+
+    # 4. Merge the successful results into the final JSON. The plan splits
+    #    every output path once; assembling is then a walk per value.
+    plan = AssemblyPlan([task['field_path'] for task in ordered_tasks] + [group.path for group in array_groups])
+    values = {}
+    for current_task, final_task_state in zip(ordered_tasks, final_task_states):
         if not final_task_state.get("errors") and final_task_state.get("extracted_data"):
-            # Use dpath to safely set nested dictionary values
-            # e.g., for path "author.name", this creates {'author': {'name': ...}}
-            try:
-                # The LLM returns a dict like {'name': 'Jane'}, we need the value
-                value_to_set = list(final_task_state["extracted_data"].values())[0]
-                dpath.util.new(final_json_output, current_task['field_path'], value_to_set)
-                print(f"✅ Successfully extracted and merged '{current_task['field_path']}'")
-            except Exception as e:
-                print(f"🔥 Error merging data for '{current_task['field_path']}': {e}")
+            # The LLM returns a dict like {'name': 'Jane'}, we need the value
+            values[current_task['field_path']] = list(final_task_state["extracted_data"].values())[0]
+            print(f"✅ Successfully extracted '{current_task['field_path']}'")
         else:
             print(
                 f"❌ Failed to extract '{current_task['field_path']}' after {final_task_state['current_attempt']} attempts.")
         print("-" * 40)
+    for group, (items, _) in zip(array_groups, array_results):
+        values[group.path] = items
+    plan.assemble(values, final_json_output)
+
+    # Learn (or refine) this layout's anchors from the validated values.
+    if layout_index is not None:
+        field_values = {path: value for path, value in values.items() if path in tasks_by_path}
+        layout_index.update(document, schema_hash, field_values, prefilled)
 
     # 5. Print the final combined result
     print("\n\n✅ FINAL COMBINED JSON OUTPUT\n" + "=" * 40)
-    print(json.dumps(final_json_output, indent=2))
\ No newline at end of file
+    print(json.dumps(final_json_output, indent=2))
+
+    # 6. Report how much of the billed input was served from the prompt cache
+    usage = summarize_prompt_usage(
+        [record for state in final_task_states for record in state.get("prompt_usage", [])]
+        + [record for _, records in array_results for record in records]
+    )
+    print("\n📊 PROMPT CACHE USAGE\n" + "=" * 40)
+    print(json.dumps(usage, indent=2))
+
+    # 7. Persist the result for lookups and columnar exports
+    if result_store is not None:
+        failed = [task['field_path'] for task in ordered_tasks if task['field_path'] not in values]
+        attempts = {task['field_path']: state['current_attempt'] for task, state in zip(ordered_tasks, final_task_states)}
+        attempts.update((group.path, len(records)) for group, (_, records) in zip(array_groups, array_results))
+        result_store.put(
+            document.doc_id,
+            schema_hash,
+            output_columns(tasks),
+            values,
+            {"final_json": final_json_output, "prompt_cache": usage},
+            errors=f"Failed to extract: {', '.join(failed)}" if failed else None,
+            attempts=attempts,
+            timings={"total": time.perf_counter() - started},
+        )
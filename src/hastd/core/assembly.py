@@ -0,0 +1,182 @@
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+class ArrayGroup:
+    """
+    All extraction tasks that live inside one array of objects, e.g.
+    `references[].title` and `references[].year` under `references`.
+    The items of such an array are extracted as whole objects.
+    """
+
+    def __init__(self, path: str, item_tasks: List[Any]):
+        self.path = path
+        self.item_tasks = item_tasks
+
+    @property
+    def item_fields(self) -> List[str]:
+        """
+        Field paths relative to one item, e.g. ["title", "authors[].name"].
+        """
+        prefix = self.path + "[]."
+        return [task["field_path"][len(prefix):] for task in self.item_tasks]
+
+    @property
+    def item_schema(self) -> Dict[str, Any]:
+        return tasks_to_schema(self.item_tasks, self.path + "[].")
+
+    def __repr__(self):
+        return f"<ArrayGroup: {self.path}[] ({len(self.item_tasks)} fields)>"
+
+
+def group_array_tasks(tasks: Iterable[Any]) -> Tuple[List[Any], List[ArrayGroup]]:
+    """
+    Splits tasks into standalone field tasks and arrays of objects.
+
+    A task belongs to an array group when its path continues past a `[]`
+    (e.g. `references[].title`); the group is keyed by the path before the
+    first `[]`. Arrays of scalars such as `tags[]` stay standalone tasks.
+    """
+    standalone = []
+    groups: Dict[str, ArrayGroup] = {}
+    for task in tasks:
+        path = task["field_path"]
+        marker = path.find("[].")
+        if marker < 0:
+            standalone.append(task)
+            continue
+        group_path = path[:marker]
+        groups.setdefault(group_path, ArrayGroup(group_path, [])).item_tasks.append(task)
+    return standalone, list(groups.values())
+
+
+def output_columns(tasks: Iterable[Any]) -> Dict[str, str]:
+    """
+    The flat columns of an extraction result and their JSON types: one per
+    standalone field, plus one list-valued column per array of objects.
+    """
+    standalone, groups = group_array_tasks(tasks)
+    columns = {
+        task["field_path"]: "array" if task["field_path"].endswith("[]") else task["field_type"]
+        for task in standalone
+    }
+    columns.update((group.path, "array") for group in groups)
+    return columns
+
+
+def tasks_to_schema(tasks: Iterable[Any], strip_prefix: str = "") -> Dict[str, Any]:
+    """
+    Rebuilds a JSON schema from leaf tasks (optionally relative to a prefix),
+    e.g. to validate whole array items.
+    """
+    root: Dict[str, Any] = {"type": "object", "properties": {}, "required": []}
+    for task in tasks:
+        path = task["field_path"][len(strip_prefix):]
+        node = root
+        segments = path.split(".")
+        for position, segment in enumerate(segments):
+            is_leaf = position == len(segments) - 1
+            name, is_array = segment[:-2] if segment.endswith("[]") else segment, segment.endswith("[]")
+            properties = node.setdefault("properties", {})
+            if is_leaf:
+                leaf = {"type": task["field_type"], "description": task["description"] or ""}
+                if task["enum"]:
+                    leaf["enum"] = task["enum"]
+                properties[name] = {"type": "array", "items": leaf} if is_array else leaf
+                if task["required"]:
+                    node.setdefault("required", []).append(name)
+                break
+            child = properties.setdefault(name, {"type": "object", "properties": {}})
+            if is_array:
+                child = properties[name] = (
+                    child if child.get("type") == "array"
+                    else {"type": "array", "items": {"type": "object", "properties": {}}}
+                )
+                child = child["items"]
+            node = child
+    return root
+
+
+class AssemblyPlan:
+    """
+    A precomputed plan for assembling extracted values into the final nested
+    JSON. Each output path is split into its container keys once, so writing
+    a value is a short dictionary walk instead of a path parse per field.
+
+    Paths ending in `[]` (scalar arrays) and array-group paths receive lists.
+    """
+
+    def __init__(self, paths: Sequence[str]):
+        self.setters: Dict[str, Tuple[Tuple[str, ...], str]] = {}
+        for path in paths:
+            keys = tuple(segment.replace("[]", "") for segment in path.split("."))
+            self.setters[path] = (keys[:-1], keys[-1])
+
+    def set(self, target: Dict[str, Any], path: str, value: Any):
+        parents, leaf = self.setters[path]
+        node = target
+        for key in parents:
+            child = node.get(key)
+            if not isinstance(child, dict):
+                child = node[key] = {}
+            node = child
+        node[leaf] = value
+
+    def assemble(self, values: Dict[str, Any], target: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        target = {} if target is None else target
+        for path in self.setters:
+            if path in values:
+                self.set(target, path, values[path])
+        return target
+
+    def collect(self, source: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        The inverse of `assemble`: reads the value at every planned path that
+        is present in a nested output.
+        """
+        values = {}
+        for path, (parents, leaf) in self.setters.items():
+            node = source
+            for key in parents:
+                node = node.get(key) if isinstance(node, dict) else None
+            if isinstance(node, dict) and leaf in node:
+                values[path] = node[leaf]
+        return values
+
+
+def _anchor_pattern(anchor: str) -> Optional["re.Pattern"]:
+    words = anchor.split()
+    if not words:
+        return None
+    # Models normalize whitespace and sometimes case when quoting.
+    return re.compile(r"\s+".join(re.escape(word) for word in words), re.IGNORECASE)
+
+
+def locate_item_spans(text: str, anchors: Sequence[str]) -> List[Tuple[int, int]]:
+    """
+    Turns the opening words of each item (in document order) into character
+    spans: each item runs until the next item starts. The last item gets the
+    length of the longest earlier item (with some slack), or the rest of the
+    text when it is the only one. Anchors that cannot be found are skipped.
+    """
+    starts = []
+    cursor = 0
+    for anchor in anchors:
+        pattern = _anchor_pattern(anchor)
+        match = pattern.search(text, cursor) if pattern else None
+        if match is None:
+            continue
+        starts.append(match.start())
+        cursor = match.end()
+
+    spans = []
+    for start, next_start in zip(starts, starts[1:]):
+        spans.append((start, next_start))
+    if starts:
+        longest = max((end - start for start, end in spans), default=len(text))
+        spans.append((starts[-1], min(len(text), starts[-1] + int(longest * 1.5))))
+    return spans
+
+
+def batched(items: Sequence[Any], size: int) -> List[Sequence[Any]]:
+    return [items[i:i + size] for i in range(0, len(items), max(1, size))]
@@ -0,0 +1,430 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from hastd.core.coalescing import fingerprint_prompt
+from hastd.core.governor import model_name_of, take_governor_wait
+
+
+class CaptureContext:
+    """
+    Per-request capture state, shared by every node of one graph run.
+    """
+
+    def __init__(self, request_id: str, doc_hash: str, schema_hash: str):
+        self.request_id = request_id
+        self.doc_hash = doc_hash
+        self.schema_hash = schema_hash
+        self.stages: List[Dict[str, Any]] = []
+        self._ordinals: Dict[Optional[str], int] = {}
+        self._lock = threading.Lock()
+
+    def next_ordinal(self, node: Optional[str]) -> int:
+        """
+        Numbers the LLM calls a node makes within this request: 0, 1, ...
+        """
+        with self._lock:
+            ordinal = self._ordinals.get(node, 0)
+            self._ordinals[node] = ordinal + 1
+            return ordinal
+
+
+_request: ContextVar[Optional[CaptureContext]] = ContextVar("hastd_capture_request", default=None)
+_node: ContextVar[Optional[str]] = ContextVar("hastd_capture_node", default=None)
+
+
+def current_request() -> Optional[CaptureContext]:
+    return _request.get()
+
+
+class TrafficRecorder:
+    """
+    Appends request, LLM call and response (with stage timing) records to a JSONL capture.
+
+    Captures contain full document texts and LLM outputs, so recording is
+    opt-in (HASTD_CAPTURE_PATH) and the files should be handled like the
+    documents themselves.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, record: Dict[str, Any]):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+_recorder: Optional[TrafficRecorder] = None
+_recorder_configured = False
+_recorder_lock = threading.Lock()
+
+
+def get_recorder() -> Optional[TrafficRecorder]:
+    """
+    Returns the process-wide recorder, opened from HASTD_CAPTURE_PATH on first use.
+    """
+    global _recorder, _recorder_configured
+    with _recorder_lock:
+        if not _recorder_configured:
+            path = os.getenv("HASTD_CAPTURE_PATH")
+            _recorder = TrafficRecorder(path) if path else None
+            _recorder_configured = True
+        return _recorder
+
+
+def configure_recorder(path: Optional[Union[str, Path]]) -> Optional[TrafficRecorder]:
+    """
+    Replaces the process-wide recorder; `None` turns capturing off.
+    """
+    global _recorder, _recorder_configured
+    with _recorder_lock:
+        if _recorder is not None:
+            _recorder.close()
+        _recorder = TrafficRecorder(path) if path else None
+        _recorder_configured = True
+        return _recorder
+
+
+@contextmanager
+def capture_request(
+    document_text: str, json_schema: Dict[str, Any], doc_hash: str, schema_hash: str
+) -> Iterator[CaptureContext]:
+    """
+    Scopes one incoming request: LLM calls and node timings made inside are
+    attributed to it and, when recording, written to the capture.
+    """
+    recorder = get_recorder()
+    context = CaptureContext(uuid.uuid4().hex, doc_hash, schema_hash)
+    if recorder is not None:
+        recorder.write({
+            "type": "request",
+            "request_id": context.request_id,
+            "received_at": time.time(),
+            "doc_hash": doc_hash,
+            "schema_hash": schema_hash,
+            "document_text": document_text,
+            "json_schema": json_schema,
+        })
+    token = _request.set(context)
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield context
+    except BaseException as e:
+        status = type(e).__name__
+        raise
+    finally:
+        _request.reset(token)
+        if recorder is not None:
+            recorder.write({
+                "type": "response",
+                "request_id": context.request_id,
+                "status": status,
+                "elapsed_s": time.perf_counter() - started,
+                "stages": context.stages,
+            })
+
+
+# -----------------------------
+# Per-stage profiling
+# -----------------------------
+class StageProfile:
+    """
+    Collects node latencies (and, while tracemalloc is tracing, the change in
+    traced memory) across requests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = {}
+        self.memory: Dict[str, List[int]] = {}
+
+    def add(self, node: str, elapsed: float, memory_delta: Optional[int] = None):
+        with self._lock:
+            self.samples.setdefault(node, []).append(elapsed)
+            if memory_delta is not None:
+                self.memory.setdefault(node, []).append(memory_delta)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            report = {}
+            for node, samples in self.samples.items():
+                report[node] = latency_summary(samples)
+                if self.memory.get(node):
+                    report[node]["mem_delta_kb_mean"] = round(
+                        sum(self.memory[node]) / len(self.memory[node]) / 1024, 1
+                    )
+            return report
+
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0}
+
+    def percentile(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "total_s": round(sum(ordered), 4),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+        "p50_ms": round(percentile(0.50) * 1000, 2),
+        "p95_ms": round(percentile(0.95) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+_stage_profile: Optional[StageProfile] = None
+
+
+def set_stage_profile(profile: Optional[StageProfile]):
+    """
+    Starts (or, with None, stops) collecting node timings for this process.
+    """
+    global _stage_profile
+    _stage_profile = profile
+
+
+def instrument_node(name: str, fn: Callable) -> Callable:
+    """
+    Wraps a graph node so LLM calls are attributed to it and its latency is
+    recorded in the request's stages and the active StageProfile. The
+    wrapper keeps the node's signature, so LangGraph still passes `config`.
+    """
+
+    @wraps(fn)
+    def node(*args, **kwargs):
+        token = _node.set(name)
+        tracing = tracemalloc.is_tracing()
+        memory_before = tracemalloc.get_traced_memory()[0] if tracing else None
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            _node.reset(token)
+            memory_delta = (
+                tracemalloc.get_traced_memory()[0] - memory_before if memory_before is not None else None
+            )
+            context = _request.get()
+            if context is not None:
+                context.stages.append({"node": name, "elapsed_s": elapsed})
+            profile = _stage_profile
+            if profile is not None:
+                profile.add(name, elapsed, memory_delta)
+
+    return node
+
+
+# -----------------------------
+# Recording and replaying LLM calls
+# -----------------------------
+def prompt_hash(prompt: Any) -> str:
+    # Model-independent, so replays still match when a build swaps models.
+    return fingerprint_prompt("", prompt)
+
+
+class RecordingLLM:
+    """
+    A transparent proxy that writes every completed `invoke` / `stream`
+    call of the wrapped chat model to the capture, along with the time the
+    call spent queued in the governor before it was sent.
+    """
+
+    def __init__(self, llm: Any, recorder: TrafficRecorder):
+        self._llm = llm
+        self._recorder = recorder
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._llm, name)
+
+    def _record(
+        self,
+        prompt: Any,
+        chunks: List[str],
+        message: Any,
+        elapsed: float,
+        queued: Optional[float] = None,
+        first_chunk: Optional[float] = None,
+        closed_early: bool = False,
+    ):
+        context = _request.get()
+        node = _node.get()
+        self._recorder.write({
+            "type": "llm",
+            "request_id": context.request_id if context else None,
+            "doc_hash": context.doc_hash if context else None,
+            "schema_hash": context.schema_hash if context else None,
+            "node": node,
+            "ordinal": context.next_ordinal(node) if context else 0,
+            "model": model_name_of(self._llm),
+            "prompt_hash": prompt_hash(prompt),
+            "chunks": chunks,
+            "usage_metadata": getattr(message, "usage_metadata", None),
+            "response_metadata": getattr(message, "response_metadata", None),
+            "queued_s": queued,
+            "first_chunk_s": first_chunk,
+            "elapsed_s": elapsed,
+            "closed_early": closed_early,
+        })
+
+    def invoke(self, prompt: Any, **kwargs) -> Any:
+        queued = take_governor_wait()
+        started = time.perf_counter()
+        message = self._llm.invoke(prompt, **kwargs)
+        self._record(prompt, [getattr(message, "content", message)], message, time.perf_counter() - started, queued)
+        return message
+
+    def stream(self, prompt: Any, **kwargs) -> Iterator[Any]:
+        queued = take_governor_wait()
+        started = time.perf_counter()
+        chunks, message, first_chunk = [], None, None
+        try:
+            for chunk in self._llm.stream(prompt, **kwargs):
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - started
+                chunks.append(getattr(chunk, "content", chunk))
+                if hasattr(chunk, "content"):
+                    message = chunk if message is None else message + chunk
+                yield chunk
+        except GeneratorExit:
+            # The consumer cancelled generation early; replay stops at the same point.
+            self._record(
+                prompt, chunks, message, time.perf_counter() - started, queued, first_chunk, closed_early=True
+            )
+            raise
+        self._record(prompt, chunks, message, time.perf_counter() - started, queued, first_chunk)
+
+
+def record_llm(llm: Any) -> Any:
+    """
+    Wraps a chat model for capturing when HASTD_CAPTURE_PATH is set.
+    """
+    recorder = get_recorder()
+    return RecordingLLM(llm, recorder) if recorder is not None else llm
+
+
+class ReplayMessage:
+    """
+    A minimal chat message / chunk carrying a recorded response.
+    """
+
+    def __init__(self, content: str, usage_metadata: Optional[Dict] = None, response_metadata: Optional[Dict] = None):
+        self.content = content
+        self.usage_metadata = usage_metadata
+        self.response_metadata = response_metadata or {}
+
+    def __add__(self, other: "ReplayMessage") -> "ReplayMessage":
+        return ReplayMessage(
+            self.content + other.content,
+            other.usage_metadata or self.usage_metadata,
+            {**self.response_metadata, **other.response_metadata},
+        )
+
+
+class ReplayMiss(KeyError):
+    """
+    Raised when a replayed pipeline makes an LLM call the capture has no response for.
+    """
+
+
+class ReplayLLM:
+    """
+    Serves recorded LLM responses instead of calling a provider.
+
+    Calls are matched by prompt content first. When a build changed the
+    prompts, they fall back to the call's position: (document, schema,
+    node, n-th call of that node in the request). With `realtime`, the
+    recorded governor queueing (rate limits, retry backoff), time to first
+    chunk and total latency are reproduced; replayed calls bypass the
+    governor, since their queueing is already part of the capture.
+    """
+
+    rate_limited = False
+    model_name = "replay"
+
+    def __init__(self, records: List[Dict[str, Any]], realtime: bool = False, sleep: Callable[[float], None] = time.sleep):
+        self.realtime = realtime
+        self.sleep = sleep
+        self.by_prompt: Dict[str, deque] = {}
+        self.by_position: Dict[Tuple, Dict[str, Any]] = {}
+        for record in records:
+            self.by_prompt.setdefault(record["prompt_hash"], deque()).append(record)
+            position = (record["doc_hash"], record["schema_hash"], record["node"], record["ordinal"])
+            self.by_position.setdefault(position, record)
+        self._lock = threading.Lock()
+        self.stats = {"prompt_hits": 0, "position_hits": 0, "misses": 0}
+
+    def _lookup(self, prompt: Any) -> Dict[str, Any]:
+        context = _request.get()
+        node = _node.get()
+        ordinal = context.next_ordinal(node) if context else 0
+        with self._lock:
+            queue = self.by_prompt.get(prompt_hash(prompt))
+            if queue:
+                self.stats["prompt_hits"] += 1
+                # Identical prompts are served in recorded order; the last one repeats.
+                return queue.popleft() if len(queue) > 1 else queue[0]
+            record = (
+                self.by_position.get((context.doc_hash, context.schema_hash, node, ordinal)) if context else None
+            )
+            if record is not None:
+                self.stats["position_hits"] += 1
+                return record
+            self.stats["misses"] += 1
+        raise ReplayMiss(f"No recorded LLM response for node '{node}' (call {ordinal}).")
+
+    def invoke(self, prompt: Any, **kwargs) -> ReplayMessage:
+        record = self._lookup(prompt)
+        if self.realtime:
+            self.sleep((record.get("queued_s") or 0.0) + record["elapsed_s"])
+        return ReplayMessage("".join(record["chunks"]), record["usage_metadata"], record["response_metadata"])
+
+    def stream(self, prompt: Any, **kwargs) -> Iterator[ReplayMessage]:
+        record = self._lookup(prompt)
+        chunks = record["chunks"]
+        first_chunk = record.get("first_chunk_s") or 0.0
+        between = (record["elapsed_s"] - first_chunk) / max(1, len(chunks) - 1)
+        for index, content in enumerate(chunks):
+            if self.realtime:
+                self.sleep((record.get("queued_s") or 0.0) + first_chunk if index == 0 else between)
+            last = index == len(chunks) - 1
+            yield ReplayMessage(
+                content,
+                record["usage_metadata"] if last else None,
+                record["response_metadata"] if last else None,
+            )
+
+
+def load_capture(path: Union[str, Path]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Reads a capture and groups its records by type ("request", "llm",
+    "response"). Requests are sorted by arrival time.
+    """
+    records: Dict[str, List[Dict[str, Any]]] = {"request": [], "llm": [], "response": []}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                records.setdefault(record["type"], []).append(record)
+    records["request"].sort(key=lambda record: record["received_at"])
+    return records
@@ -1,6 +1,5 @@
 import re
 from typing import List
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 
 class TextChunker:
@@ -15,12 +14,22 @@ class TextChunker:
         """
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self._splitter = None
 
-        self.splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""],
-        )
+    @property
+    def splitter(self):
+        """
+        The underlying text splitter, imported and built on first use.
+        """
+        if self._splitter is None:
+            from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+            self._splitter = RecursiveCharacterTextSplitter(
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap,
+                separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""],
+            )
+        return self._splitter
 
     def clean_text(self, text: str) -> str:
         """
@@ -31,6 +40,16 @@ class TextChunker:
         text = text.strip()
         return text
 
+    def clean_lines(self, text: str) -> str:
+        """
+        Like `clean_text`, but keeps line breaks: spaces, tabs and non-breaking
+        spaces are collapsed within each line and runs of blank lines are
+        reduced to one.
+        """
+        lines = [re.sub(r"[^\S\n]+", " ", line).strip() for line in text.splitlines()]
+        text = re.sub(r"\n{3,}", "\n\n", "\n".join(lines))
+        return text.strip()
+
     def chunk_text(self, text: str) -> List[str]:
         """
         Split the input text into semantically aware chunks.
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable
+
+
+def fingerprint_document(text: str) -> str:
+    """
+    A stable content hash for a document's text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def fingerprint_schema(schema: Dict[str, Any]) -> str:
+    """
+    A stable hash for a JSON schema, independent of key order and whitespace.
+    """
+    canonical = json.dumps(schema, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def fingerprint_prompt(model: str, prompt: Any) -> str:
+    """
+    A hash identifying an LLM call by model and prompt content.
+    """
+    if isinstance(prompt, (list, tuple)):
+        prompt = [getattr(message, "content", message) for message in prompt]
+    payload = json.dumps([model, prompt], sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class InFlightCoalescer:
+    """
+    Deduplicates concurrent identical work.
+
+    The first caller for a key becomes the leader and runs the work; callers
+    arriving with the same key while it is in flight wait for and share the
+    leader's result (or exception). Nothing is cached once the work finishes.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def run(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._in_flight[key] = future
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._in_flight)
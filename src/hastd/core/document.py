@@ -0,0 +1,200 @@
+import json
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import cached_property
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from hastd.core.chunker import TextChunker
+from hastd.core.coalescing import fingerprint_document
+from hastd.core.tokens import estimate_tokens
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+_TERM_RE = re.compile(r"\w+")
+
+
+@dataclass(frozen=True)
+class DocumentChunk:
+    """
+    A chunk of the cleaned document text with its character offsets.
+    """
+    index: int
+    start: int
+    end: int
+    text: str
+    sha: str
+    token_count: int
+
+
+@dataclass(frozen=True)
+class PreparedDocument:
+    """
+    An immutable, preprocessed view of a document, built once and shared by
+    reference across every field task that extracts from it.
+
+    Offsets in `chunks` and `sentences` refer to `text` (the cleaned text).
+    Retrieval indexes are built lazily on first use and are not serialized.
+    """
+    doc_id: str
+    raw_text: str
+    text: str
+    chunks: Tuple[DocumentChunk, ...]
+    sentences: Tuple[Tuple[int, int], ...]
+    token_count: int
+    chunk_size: int
+    chunk_overlap: int
+    metadata: Dict[str, Any] = field(default_factory=dict, compare=False)
+
+    def sentence_texts(self) -> List[str]:
+        return [self.text[start:end] for start, end in self.sentences]
+
+    @cached_property
+    def term_index(self) -> Dict[str, Dict[int, int]]:
+        """
+        Inverted index of lower-cased terms to {chunk index: term frequency}.
+        """
+        index: Dict[str, Dict[int, int]] = {}
+        for chunk in self.chunks:
+            for term, count in Counter(_TERM_RE.findall(chunk.text.lower())).items():
+                index.setdefault(term, {})[chunk.index] = count
+        return index
+
+    def search(self, query: str, k: int = 3) -> List[DocumentChunk]:
+        """
+        Returns the `k` chunks most relevant to `query` using BM25 scoring.
+        """
+        if not self.chunks:
+            return []
+        index = self.term_index
+        n = len(self.chunks)
+        avg_len = sum(c.token_count for c in self.chunks) / n or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(_TERM_RE.findall(query.lower())):
+            postings = index.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_index, tf in postings.items():
+                length = self.chunks[chunk_index].token_count or 1
+                norm = tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * length / avg_len))
+                scores[chunk_index] = scores.get(chunk_index, 0.0) + idf * norm
+        ranked = sorted(scores, key=lambda i: (-scores[i], i))[:k]
+        return [self.chunks[i] for i in ranked]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "doc_id": self.doc_id,
+            "raw_text": self.raw_text,
+            "text": self.text,
+            "chunks": [chunk.__dict__ for chunk in self.chunks],
+            "sentences": [list(span) for span in self.sentences],
+            "token_count": self.token_count,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "metadata": self.metadata,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "PreparedDocument":
+        return cls(
+            doc_id=data["doc_id"],
+            raw_text=data["raw_text"],
+            text=data["text"],
+            chunks=tuple(DocumentChunk(**chunk) for chunk in data["chunks"]),
+            sentences=tuple(tuple(span) for span in data["sentences"]),
+            token_count=data["token_count"],
+            chunk_size=data["chunk_size"],
+            chunk_overlap=data["chunk_overlap"],
+            metadata=data.get("metadata", {}),
+        )
+
+    def save(self, path: Union[str, Path]):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "PreparedDocument":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+def _sentence_spans(text: str) -> Tuple[Tuple[int, int], ...]:
+    spans = []
+    start = 0
+    for match in _SENTENCE_END_RE.finditer(text):
+        spans.append((start, match.start()))
+        start = match.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    return tuple(spans)
+
+
+def _locate_chunks(text: str, pieces: List[str]) -> Tuple[DocumentChunk, ...]:
+    chunks = []
+    cursor = 0
+    for index, piece in enumerate(pieces):
+        start = text.find(piece, cursor)
+        if start < 0:
+            raise ValueError(f"Chunk {index} does not occur in the text after offset {cursor}.")
+        end = start + len(piece)
+        chunks.append(
+            DocumentChunk(
+                index=index,
+                start=start,
+                end=end,
+                text=piece,
+                sha=fingerprint_document(piece),
+                token_count=estimate_tokens(piece),
+            )
+        )
+        # Chunks overlap, so the next one may begin before this one ends.
+        cursor = start + 1
+    return tuple(chunks)
+
+
+def prepare_document(
+    text: str,
+    chunker: Optional[TextChunker] = None,
+    cache_dir: Optional[Union[str, Path]] = None,
+) -> PreparedDocument:
+    """
+    Runs the one-time preprocessing stage for a document.
+
+    Args:
+        text: The raw document text.
+        chunker: The chunker to use; a default TextChunker if omitted.
+        cache_dir: Optional directory where prepared documents are cached as
+            JSON, keyed by content hash and chunking parameters.
+
+    Returns:
+        A PreparedDocument ready to be shared across field tasks.
+    """
+    chunker = chunker or TextChunker()
+    doc_id = fingerprint_document(text)
+
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = Path(cache_dir) / f"{doc_id}-{chunker.chunk_size}-{chunker.chunk_overlap}.json"
+        if cache_path.exists():
+            return PreparedDocument.load(cache_path)
+
+    # Line breaks carry layout (tables, addresses, headers), so only spacing
+    # within lines is normalized.
+    cleaned = chunker.clean_lines(text)
+    document = PreparedDocument(
+        doc_id=doc_id,
+        raw_text=text,
+        text=cleaned,
+        chunks=_locate_chunks(cleaned, chunker.splitter.split_text(cleaned)),
+        sentences=_sentence_spans(cleaned),
+        token_count=estimate_tokens(cleaned),
+        chunk_size=chunker.chunk_size,
+        chunk_overlap=chunker.chunk_overlap,
+    )
+
+    if cache_path is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        document.save(cache_path)
+    return document
@@ -0,0 +1,423 @@
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from hastd.core.tokens import estimate_tokens
+
+
+class Priority(IntEnum):
+    """
+    Scheduling classes for LLM calls. Lower values are served first.
+    """
+    INTERACTIVE = 0
+    BATCH = 1
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised when a provider keeps rate limiting a call after all retries.
+    """
+
+    def __init__(self, model: str, attempts: int, retry_after: Optional[float] = None):
+        super().__init__(f"Rate limit for model '{model}' still exceeded after {attempts} attempts.")
+        self.model = model
+        self.attempts = attempts
+        self.retry_after = retry_after
+
+
+class ModelLimits:
+    """
+    Provider limits and concurrency bounds for a single model.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = 500,
+        tokens_per_minute: int = 30_000,
+        max_concurrency: int = 8,
+        min_concurrency: int = 1,
+        latency_spike_factor: float = 3.0,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.latency_spike_factor = latency_spike_factor
+
+
+class TokenBucket:
+    """
+    A classic token bucket refilled continuously at `rate_per_minute`.
+    """
+
+    def __init__(self, rate_per_minute: float, clock: Callable[[], float] = time.monotonic):
+        self.capacity = float(rate_per_minute)
+        self.refill_per_second = rate_per_minute / 60.0
+        self.clock = clock
+        self.level = self.capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Seconds until `amount` can be taken (0.0 if it can be taken now).
+        Requests larger than the bucket only need a full bucket.
+        """
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.refill_per_second
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        """
+        Return over-reserved capacity (or charge more when `amount` is negative).
+        """
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD concurrency limit: grows by one slot per window of successful calls,
+    halves on rate-limit errors and shrinks on latency spikes.
+    """
+
+    WARMUP_SAMPLES = 5
+
+    def __init__(self, limits: ModelLimits):
+        self.limits = limits
+        self.limit = float(limits.max_concurrency)
+        self.latency_ewma: Optional[float] = None
+        self.samples = 0
+
+    @property
+    def slots(self) -> int:
+        return max(self.limits.min_concurrency, int(self.limit))
+
+    def on_success(self, latency: float):
+        spiked = (
+            self.samples >= self.WARMUP_SAMPLES
+            and latency > self.limits.latency_spike_factor * self.latency_ewma
+        )
+        self.samples += 1
+        self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+        if spiked:
+            self.limit = max(self.limits.min_concurrency, self.limit * 0.75)
+        else:
+            self.limit = min(self.limits.max_concurrency, self.limit + 1.0 / self.limit)
+
+    def on_rate_limited(self):
+        self.limit = max(self.limits.min_concurrency, self.limit / 2)
+
+
+class _ModelState:
+    def __init__(self, limits: ModelLimits, clock: Callable[[], float]):
+        self.limits = limits
+        self.requests = TokenBucket(limits.requests_per_minute, clock)
+        self.tokens = TokenBucket(limits.tokens_per_minute, clock)
+        self.concurrency = AdaptiveConcurrency(limits)
+        self.in_flight = 0
+        self.waiters = []
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or "RateLimit" in type(error).__name__
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    if is_rate_limit_error(error):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return isinstance(status, int) and status >= 500
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    value = headers.get("retry-after") if hasattr(headers, "get") else None
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+# Seconds the call being sent waited in the governor (queueing, rate limits
+# and retry backoff) before this attempt; set per attempt, cleared on read.
+_governor_wait: ContextVar[Optional[float]] = ContextVar("hastd_governor_wait", default=None)
+
+
+def take_governor_wait() -> Optional[float]:
+    """
+    Returns how long the call about to be sent waited in the governor, or
+    None for calls that did not go through it. Clears the value.
+    """
+    wait = _governor_wait.get()
+    _governor_wait.set(None)
+    return wait
+
+
+def model_name_of(llm: Any) -> str:
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or "default"
+
+
+class LLMGovernor:
+    """
+    A process-wide gatekeeper for LLM calls.
+
+    Every call waits for a request token, enough tokens-per-minute budget and a
+    free concurrency slot for its model. Waiters are served by priority class
+    (interactive before batch) and then FIFO. Rate-limit errors and 5xx responses
+    are retried with full-jitter exponential backoff, and each 429 halves the
+    model's concurrency limit.
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, ModelLimits]] = None,
+        default_limits: Optional[ModelLimits] = None,
+        max_retries: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        rng: Callable[[], float] = random.random,
+    ):
+        self.limits = dict(limits or {})
+        self.default_limits = default_limits or ModelLimits()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng
+        self._models: Dict[str, _ModelState] = {}
+        self._condition = threading.Condition()
+        self._sequence = itertools.count()
+
+    def _state(self, model: str) -> _ModelState:
+        if model not in self._models:
+            self._models[model] = _ModelState(self.limits.get(model, self.default_limits), self.clock)
+        return self._models[model]
+
+    def concurrency_limit(self, model: str) -> int:
+        with self._condition:
+            return self._state(model).concurrency.slots
+
+    def acquire(self, model: str, priority: Priority = Priority.BATCH, tokens: int = 0):
+        """
+        Blocks until the call may be sent to the provider.
+        """
+        with self._condition:
+            state = self._state(model)
+            ticket = (int(priority), next(self._sequence))
+            heapq.heappush(state.waiters, ticket)
+            try:
+                while True:
+                    timeout = None
+                    if state.waiters[0] == ticket and state.in_flight < state.concurrency.slots:
+                        timeout = max(state.requests.wait_time(1), state.tokens.wait_time(tokens))
+                        if timeout == 0.0:
+                            state.requests.take(1)
+                            state.tokens.take(tokens)
+                            state.in_flight += 1
+                            return
+                    self._condition.wait(timeout)
+            finally:
+                state.waiters.remove(ticket)
+                heapq.heapify(state.waiters)
+                self._condition.notify_all()
+
+    def release(
+        self,
+        model: str,
+        latency: Optional[float] = None,
+        rate_limited: bool = False,
+        token_correction: int = 0,
+    ):
+        with self._condition:
+            state = self._state(model)
+            state.in_flight -= 1
+            if rate_limited:
+                state.concurrency.on_rate_limited()
+            elif latency is not None:
+                state.concurrency.on_success(latency)
+            if token_correction:
+                state.tokens.give_back(token_correction)
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, model: str, priority: Priority = Priority.BATCH, tokens: int = 0) -> Iterator[None]:
+        self.acquire(model, priority, tokens)
+        started = self.clock()
+        try:
+            yield
+        except BaseException as e:
+            self.release(model, rate_limited=is_rate_limit_error(e))
+            raise
+        else:
+            self.release(model, latency=self.clock() - started)
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        delay = self.rng() * min(self.max_delay, self.base_delay * (2 ** attempt))
+        return max(delay, retry_after or 0.0)
+
+    def call(
+        self,
+        model: str,
+        fn: Callable[[], Any],
+        priority: Priority = Priority.BATCH,
+        tokens: int = 0,
+    ) -> Any:
+        """
+        Runs `fn` under the model's limits, retrying rate-limit and server errors.
+        """
+        requested = self.clock()
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.slot(model, priority, tokens):
+                    _governor_wait.set(self.clock() - requested)
+                    return fn()
+            except Exception as e:
+                if not is_retryable_error(e):
+                    raise
+                retry_after = retry_after_seconds(e)
+                if attempt == self.max_retries:
+                    if is_rate_limit_error(e):
+                        raise RateLimitExceeded(model, attempt + 1, retry_after) from e
+                    raise
+                self.sleep(self.backoff_delay(attempt, retry_after))
+
+    def invoke(self, llm: Any, prompt: Any, priority: Priority = Priority.BATCH, **kwargs) -> Any:
+        """
+        Governed drop-in for `llm.invoke(prompt)`.
+        """
+        if not getattr(llm, "rate_limited", True):
+            return llm.invoke(prompt, **kwargs)
+        model = model_name_of(llm)
+        estimate = estimate_tokens(prompt)
+        result = self.call(model, lambda: llm.invoke(prompt, **kwargs), priority, estimate)
+
+        usage = getattr(result, "usage_metadata", None) or {}
+        if usage.get("total_tokens"):
+            with self._condition:
+                self._state(model).tokens.give_back(estimate - usage["total_tokens"])
+        return result
+
+    def stream(self, llm: Any, prompt: Any, priority: Priority = Priority.BATCH, **kwargs) -> Iterator[Any]:
+        """
+        Governed drop-in for `llm.stream(prompt)`. The slot is held until the
+        stream is exhausted or closed; failures are only retried before the
+        first chunk has been yielded.
+        """
+        if not getattr(llm, "rate_limited", True):
+            yield from llm.stream(prompt, **kwargs)
+            return
+        model = model_name_of(llm)
+        estimate = estimate_tokens(prompt)
+
+        requested = self.clock()
+        for attempt in range(self.max_retries + 1):
+            yielded = False
+            used = 0
+            self.acquire(model, priority, estimate)
+            started = self.clock()
+            _governor_wait.set(started - requested)
+            try:
+                for chunk in llm.stream(prompt, **kwargs):
+                    yielded = True
+                    # Providers report usage on the final chunk; correct the estimate with it.
+                    used += (getattr(chunk, "usage_metadata", None) or {}).get("total_tokens", 0)
+                    yield chunk
+            except Exception as e:
+                self.release(model, rate_limited=is_rate_limit_error(e))
+                if yielded or not is_retryable_error(e):
+                    raise
+                if attempt == self.max_retries:
+                    if is_rate_limit_error(e):
+                        raise RateLimitExceeded(model, attempt + 1, retry_after_seconds(e)) from e
+                    raise
+                self.sleep(self.backoff_delay(attempt, retry_after_seconds(e)))
+            except BaseException:
+                # GeneratorExit: the consumer stopped early, which is a success.
+                self.release(model, latency=self.clock() - started, token_correction=estimate - used if used else 0)
+                raise
+            else:
+                self.release(model, latency=self.clock() - started, token_correction=estimate - used if used else 0)
+                return
+
+
+_default_governor: Optional[LLMGovernor] = None
+_default_lock = threading.Lock()
+
+
+def load_model_limits_from_env() -> Tuple[Dict[str, ModelLimits], Optional[ModelLimits]]:
+    """
+    Reads per-model provider limits from `HASTD_MODEL_LIMITS`, either inline
+    JSON or a path to a JSON file, mapping model names to ModelLimits fields:
+
+        {"gpt-4o": {"requests_per_minute": 5000, "tokens_per_minute": 800000},
+         "default": {"requests_per_minute": 500, "tokens_per_minute": 30000}}
+
+    The optional "default" entry applies to models that are not listed.
+
+    Returns:
+        The per-model limits and the default limits (None when not set).
+    """
+    raw = os.getenv("HASTD_MODEL_LIMITS", "").strip()
+    if not raw:
+        return {}, None
+    if not raw.startswith("{"):
+        with open(raw, "r") as f:
+            raw = f.read()
+    try:
+        config = {model: ModelLimits(**values) for model, values in json.loads(raw).items()}
+    except (TypeError, ValueError, AttributeError) as e:
+        raise ValueError(f"Invalid HASTD_MODEL_LIMITS: {e}") from e
+    return config, config.pop("default", None)
+
+
+def get_governor() -> LLMGovernor:
+    """
+    Returns the shared governor used by all agent nodes in this process,
+    built with the limits from `HASTD_MODEL_LIMITS` on first use.
+    """
+    global _default_governor
+    with _default_lock:
+        if _default_governor is None:
+            limits, default_limits = load_model_limits_from_env()
+            _default_governor = LLMGovernor(limits=limits, default_limits=default_limits)
+        return _default_governor
+
+
+def configure_governor(
+    limits: Optional[Dict[str, ModelLimits]] = None,
+    **kwargs,
+) -> LLMGovernor:
+    """
+    Replaces the shared governor, e.g. to set per-model limits at startup.
+    """
+    global _default_governor
+    with _default_lock:
+        _default_governor = LLMGovernor(limits=limits, **kwargs)
+        return _default_governor
@@ -0,0 +1,414 @@
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from hastd.core.document import PreparedDocument
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_WORD_RE = re.compile(r"\w+")
+
+
+def shingles(text: str, size: int = 5) -> set:
+    """
+    Hashed word n-grams of a text (lower-cased, punctuation ignored).
+    """
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < size:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))} if words else set()
+    return {
+        zlib.crc32(" ".join(words[i:i + size]).encode("utf-8"))
+        for i in range(len(words) - size + 1)
+    }
+
+
+def document_shingles(document: PreparedDocument, size: int = 5) -> set:
+    """
+    Shingles over the document's chunks (the same view the extractors see).
+    """
+    result = set()
+    for chunk in document.chunks or ():
+        result |= shingles(chunk.text, size)
+    return result or shingles(document.text, size)
+
+
+class MinHasher:
+    """
+    MinHash signatures with `num_perm` universal hash functions. The same seed
+    always yields the same functions, so signatures can be persisted.
+    """
+
+    # Shingles hashed per numpy pass; bounds the temporaries to num_perm x BLOCK_SIZE.
+    BLOCK_SIZE = 4096
+
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.permutations = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)
+        ]
+
+    def signature(self, hashes: Iterable[int]) -> Tuple[int, ...]:
+        import numpy as np
+
+        values = np.fromiter(hashes, dtype=np.uint64)
+        if not values.size:
+            return tuple([_MAX_HASH] * self.num_perm)
+        a = np.array([a for a, _ in self.permutations], dtype=np.uint64)[:, None]
+        b = np.array([b for _, b in self.permutations], dtype=np.uint64)[:, None]
+        # (a * h + b) mod 2**61 - 1 without overflowing 64 bits: split `a` into
+        # 32-bit halves and fold with 2**61 = 1 (mod p). Shingle hashes fit in
+        # 32 bits, so every partial product fits in a uint64.
+        prime = np.uint64(_MERSENNE_PRIME)
+        a_high, a_low = a >> np.uint64(32), a & np.uint64(_MAX_HASH)
+        minimum = np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        for start in range(0, values.size, self.BLOCK_SIZE):
+            h = values[start:start + self.BLOCK_SIZE][None, :]
+            high = a_high * h  # < 2**61, to be shifted left by 32
+            low = a_low * h
+            total = (
+                (high >> np.uint64(29))
+                + ((high & np.uint64((1 << 29) - 1)) << np.uint64(32))
+                + (low & prime) + (low >> np.uint64(61))
+                + b
+            )
+            total = (total & prime) + (total >> np.uint64(61))
+            total = np.where(total >= prime, total - prime, total)
+            np.minimum(minimum, (total & np.uint64(_MAX_HASH)).min(axis=1), out=minimum)
+        return tuple(int(value) for value in minimum)
+
+    @staticmethod
+    def similarity(first: Sequence[int], second: Sequence[int]) -> float:
+        """
+        Estimated Jaccard similarity of the two underlying shingle sets.
+        """
+        return sum(1 for a, b in zip(first, second) if a == b) / len(first)
+
+
+def _unique_occurrence(text: str, literal: str) -> int:
+    """
+    The offset of `literal` in `text` when it occurs exactly once as a whole
+    token (so "4" does not match inside "2024" or "4.5"), else -1. Values that
+    occur several times cannot be tied to a single anchor.
+    """
+    pattern = re.compile(r"(?<!\w)(?<!\d\.)" + re.escape(literal) + r"(?!\w)(?!\.\d)")
+    matches = pattern.finditer(text)
+    first = next(matches, None)
+    if first is None or next(matches, None) is not None:
+        return -1
+    return first.start()
+
+
+class LayoutMatch:
+    def __init__(self, layout_id: str, similarity: float):
+        self.layout_id = layout_id
+        self.similarity = similarity
+
+    def __repr__(self):
+        return f"<LayoutMatch: {self.layout_id} ({self.similarity:.2f})>"
+
+
+def _common_suffix(first: str, second: str) -> str:
+    size = 0
+    while size < min(len(first), len(second)) and first[-1 - size] == second[-1 - size]:
+        size += 1
+    return first[len(first) - size:]
+
+
+def _common_prefix(first: str, second: str) -> str:
+    size = 0
+    while size < min(len(first), len(second)) and first[size] == second[size]:
+        size += 1
+    return first[:size]
+
+
+def coerce_value(raw: str, field_type: str) -> Any:
+    """
+    Converts an anchored string to the field's JSON type; returns the string
+    unchanged when it does not parse, so validation reports the mismatch.
+    """
+    try:
+        if field_type == "integer":
+            return int(raw.replace(",", ""))
+        if field_type == "number":
+            return float(raw.replace(",", ""))
+    except ValueError:
+        return raw
+    if field_type == "boolean" and raw.lower() in ("true", "false", "yes", "no"):
+        return raw.lower() in ("true", "yes")
+    return raw
+
+
+class LayoutIndex:
+    """
+    A local index of known document layouts (templates) and their field anchors.
+
+    Documents are matched by MinHash signatures over their chunk shingles,
+    bucketed with LSH banding so a lookup only compares a few candidates.
+    For each (layout, schema) the index keeps anchors: the text right before
+    and after a field's value in previously extracted documents. Anchors are
+    generalized to the context shared by every document they were learned
+    from, and are only applied once seen in `min_support` documents.
+    """
+
+    PREFIX_CHARS = 40
+    SUFFIX_CHARS = 12
+    MIN_PREFIX_CHARS = 4
+    MAX_VALUE_CHARS = 200
+
+    def __init__(
+        self,
+        path: Union[str, Path] = ":memory:",
+        num_perm: int = 128,
+        bands: int = 32,
+        threshold: float = 0.7,
+        shingle_size: int = 5,
+        min_support: int = 2,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands.")
+        if str(path) != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.min_support = min_support
+        self._lock = threading.Lock()
+        self._patterns: Dict[Tuple[str, str], "re.Pattern"] = {}
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS layouts (
+                layout_id TEXT PRIMARY KEY,
+                signature BLOB NOT NULL,
+                documents INTEGER NOT NULL,
+                created REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS lsh_buckets (
+                band INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                layout_id TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS lsh_buckets_lookup ON lsh_buckets (band, bucket);
+            CREATE TABLE IF NOT EXISTS anchors (
+                layout_id TEXT NOT NULL,
+                schema_hash TEXT NOT NULL,
+                field_path TEXT NOT NULL,
+                prefix TEXT NOT NULL,
+                suffix TEXT NOT NULL,
+                support INTEGER NOT NULL,
+                misses INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (layout_id, schema_hash, field_path)
+            );
+            """
+        )
+
+    def close(self):
+        self._db.close()
+
+    # -- Layout matching -------------------------------------------------
+    def signature(self, document: PreparedDocument) -> Tuple[int, ...]:
+        return self.hasher.signature(document_shingles(document, self.shingle_size))
+
+    def _buckets(self, signature: Sequence[int]) -> List[Tuple[int, str]]:
+        buckets = []
+        for band in range(self.bands):
+            rows = signature[band * self.rows:(band + 1) * self.rows]
+            key = hashlib.blake2b(array("Q", rows).tobytes(), digest_size=8).hexdigest()
+            buckets.append((band, key))
+        return buckets
+
+    def match(self, document: PreparedDocument, signature: Optional[Sequence[int]] = None) -> Optional[LayoutMatch]:
+        """
+        Returns the most similar known layout at or above the threshold.
+        """
+        signature = signature or self.signature(document)
+        with self._lock:
+            candidates = set()
+            for band, bucket in self._buckets(signature):
+                rows = self._db.execute(
+                    "SELECT layout_id FROM lsh_buckets WHERE band = ? AND bucket = ?", (band, bucket)
+                )
+                candidates.update(layout_id for (layout_id,) in rows)
+
+            best = None
+            for layout_id in candidates:
+                (blob,) = self._db.execute(
+                    "SELECT signature FROM layouts WHERE layout_id = ?", (layout_id,)
+                ).fetchone()
+                similarity = MinHasher.similarity(signature, array("Q", blob))
+                if similarity >= self.threshold and (best is None or similarity > best.similarity):
+                    best = LayoutMatch(layout_id, similarity)
+        return best
+
+    def register(self, document: PreparedDocument, signature: Optional[Sequence[int]] = None) -> str:
+        """
+        Returns the layout of the document, adding it as a new layout if unknown.
+        """
+        signature = signature or self.signature(document)
+        found = self.match(document, signature)
+        with self._lock, self._db:
+            if found is not None:
+                self._db.execute(
+                    "UPDATE layouts SET documents = documents + 1 WHERE layout_id = ?", (found.layout_id,)
+                )
+                return found.layout_id
+            layout_id = document.doc_id[:16]
+            self._db.execute(
+                "INSERT OR IGNORE INTO layouts VALUES (?, ?, 1, ?)",
+                (layout_id, array("Q", signature).tobytes(), time.time()),
+            )
+            self._db.executemany(
+                "INSERT INTO lsh_buckets VALUES (?, ?, ?)",
+                [(band, bucket, layout_id) for band, bucket in self._buckets(signature)],
+            )
+            return layout_id
+
+    # -- Field anchors ---------------------------------------------------
+    def _context(self, text: str, start: int, end: int) -> Tuple[str, str]:
+        prefix_start = max(0, start - self.PREFIX_CHARS)
+        prefix = text[prefix_start:start]
+        boundary = re.search(r"\s", prefix) if prefix_start > 0 else None
+        if boundary:
+            # Don't start the anchor in the middle of a word.
+            prefix = prefix[boundary.end():]
+        return prefix, text[end:end + self.SUFFIX_CHARS]
+
+    def learn(self, layout_id: str, schema_hash: str, document: PreparedDocument, values: Dict[str, Any]):
+        """
+        Learns or refines anchors from validated scalar values of a document.
+        """
+        text = document.text
+        with self._lock, self._db:
+            for field_path, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                    continue
+                literal = str(value).strip()
+                position = _unique_occurrence(text, literal) if literal else -1
+                if position < 0:
+                    continue
+                prefix, suffix = self._context(text, position, position + len(literal))
+
+                row = self._db.execute(
+                    "SELECT prefix, suffix FROM anchors WHERE layout_id = ? AND schema_hash = ? AND field_path = ?",
+                    (layout_id, schema_hash, field_path),
+                ).fetchone()
+                if row is not None:
+                    # Keep only the context every document agrees on.
+                    prefix, suffix = _common_suffix(row[0], prefix), _common_prefix(row[1], suffix)
+                if len(prefix.strip()) < self.MIN_PREFIX_CHARS:
+                    self._db.execute(
+                        "DELETE FROM anchors WHERE layout_id = ? AND schema_hash = ? AND field_path = ?",
+                        (layout_id, schema_hash, field_path),
+                    )
+                elif row is None:
+                    self._db.execute(
+                        "INSERT INTO anchors VALUES (?, ?, ?, ?, ?, 1, 0)",
+                        (layout_id, schema_hash, field_path, prefix, suffix),
+                    )
+                else:
+                    self._db.execute(
+                        "UPDATE anchors SET prefix = ?, suffix = ?, support = support + 1 "
+                        "WHERE layout_id = ? AND schema_hash = ? AND field_path = ?",
+                        (prefix, suffix, layout_id, schema_hash, field_path),
+                    )
+                self._patterns.pop((prefix, suffix), None)
+
+    def _pattern(self, prefix: str, suffix: str) -> "re.Pattern":
+        pattern = self._patterns.get((prefix, suffix))
+        if pattern is None:
+            value = rf"(.{{1,{self.MAX_VALUE_CHARS}}}?)" if suffix else r"(\S+)"
+            pattern = re.compile(re.escape(prefix) + value + re.escape(suffix), re.DOTALL)
+            self._patterns[(prefix, suffix)] = pattern
+        return pattern
+
+    def apply(self, layout_id: str, schema_hash: str, document: PreparedDocument) -> Dict[str, str]:
+        """
+        Extracts raw string values for every trusted anchor that matches.
+        """
+        with self._lock:
+            anchors = self._db.execute(
+                "SELECT field_path, prefix, suffix FROM anchors "
+                "WHERE layout_id = ? AND schema_hash = ? AND support >= ? AND misses <= support",
+                (layout_id, schema_hash, self.min_support),
+            ).fetchall()
+
+        values = {}
+        for field_path, prefix, suffix in anchors:
+            found = self._pattern(prefix, suffix).search(document.text)
+            if found and found.group(1).strip():
+                values[field_path] = found.group(1).strip()
+        return values
+
+    def record_miss(self, layout_id: str, schema_hash: str, field_paths: Iterable[str]):
+        """
+        Counts anchored values that failed validation or were corrected.
+        """
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE anchors SET misses = misses + 1 "
+                "WHERE layout_id = ? AND schema_hash = ? AND field_path = ?",
+                [(layout_id, schema_hash, field_path) for field_path in field_paths],
+            )
+
+    # -- Extraction workflow ---------------------------------------------
+    def prefill(
+        self,
+        document: PreparedDocument,
+        schema_hash: str,
+        tasks: Sequence[Any],
+        signature: Optional[Sequence[int]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Deterministically extracts the fields of a known layout, converted to
+        each task's type. Returns {} for documents of an unknown layout.
+        """
+        found = self.match(document, signature)
+        if found is None:
+            return {}
+        types = {task["field_path"]: task["field_type"] for task in tasks}
+        raw = self.apply(found.layout_id, schema_hash, document)
+        return {path: coerce_value(value, types[path]) for path, value in raw.items() if path in types}
+
+    def update(
+        self,
+        document: PreparedDocument,
+        schema_hash: str,
+        values: Dict[str, Any],
+        prefilled: Optional[Dict[str, Any]] = None,
+        signature: Optional[Sequence[int]] = None,
+    ) -> str:
+        """
+        Feeds the validated result of an extraction back into the index:
+        registers the layout, counts prefilled values that were replaced and
+        learns anchors from the final values.
+        """
+        layout_id = self.register(document, signature)
+        rejected = [path for path, value in (prefilled or {}).items() if values.get(path) != value]
+        self.record_miss(layout_id, schema_hash, rejected)
+        self.learn(layout_id, schema_hash, document, values)
+        return layout_id
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            (layouts,) = self._db.execute("SELECT COUNT(*) FROM layouts").fetchone()
+            (anchors,) = self._db.execute("SELECT COUNT(*) FROM anchors").fetchone()
+        return {"layouts": layouts, "anchors": anchors}
+
+
+def load_layout_index_from_env() -> Optional[LayoutIndex]:
+    """
+    Opens the layout index at HASTD_LAYOUT_INDEX, if template reuse is enabled.
+    """
+    path = os.getenv("HASTD_LAYOUT_INDEX")
+    return LayoutIndex(path) if path else None
@@ -0,0 +1,349 @@
+import copy
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from langchain_core.messages import AIMessage, AIMessageChunk
+
+
+_ROLES = {"system": "system", "human": "user", "user": "user", "ai": "assistant", "assistant": "assistant"}
+
+# Appended to the last message of a prefix, to find where the prefix ends in a
+# rendered chat template.
+_PREFIX_END = "\u2063<prefix-end>\u2063"
+
+
+def _to_messages(prompt: Any) -> List[Dict[str, str]]:
+    """
+    Normalizes a string, a LangChain message or a list of either into chat
+    messages ({"role", "content"} dicts).
+    """
+    if isinstance(prompt, (list, tuple)):
+        return [message for part in prompt for message in _to_messages(part)]
+    if isinstance(prompt, str):
+        return [{"role": "user", "content": prompt}]
+    if isinstance(prompt, dict):
+        return [prompt]
+    role = _ROLES.get(getattr(prompt, "type", "human"), "user")
+    return [{"role": role, "content": str(getattr(prompt, "content", prompt))}]
+
+
+def _common_prefix_length(sequences: Sequence[Sequence[int]]) -> int:
+    shortest = min(len(s) for s in sequences)
+    for i in range(shortest):
+        token = sequences[0][i]
+        if any(s[i] != token for s in sequences[1:]):
+            return i
+    return shortest
+
+
+class _Request:
+    def __init__(self, prompt: str, max_new_tokens: int):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.future: Future = Future()
+
+
+class PrefixKVCache:
+    """
+    An LRU cache of attention key/value states for token prefixes
+    (typically the shared document block of a prompt).
+    """
+
+    def __init__(self, max_entries: int = 4):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[int, ...], Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def longest_match(self, sequences: Sequence[Sequence[int]]) -> Optional[Tuple[int, ...]]:
+        """
+        The longest cached prefix shared by every sequence, if any.
+        """
+        best = None
+        for key in self._entries:
+            if best is not None and len(key) <= len(best):
+                continue
+            if all(len(s) > len(key) and tuple(s[:len(key)]) == key for s in sequences):
+                best = key
+        return best
+
+    def get(self, key: Tuple[int, ...]) -> Any:
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key: Tuple[int, ...], value: Any):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __contains__(self, key: Tuple[int, ...]) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class LocalSLMExtractor:
+    """
+    A CPU-capable local small-language-model backend that can stand in for
+    the chat model used by `extractor_agent`.
+
+    Concurrent `invoke` calls are queued and served by one worker thread that
+    groups up to `max_batch_size` prompts (waiting at most `max_wait_ms` for
+    the batch to fill) into a single `generate` call. When the prompts in a
+    batch share a long token prefix (e.g. the same document block), the
+    prefix's key/value states are computed once, cached, and reused.
+    """
+
+    # The governor's provider rate limits do not apply to local inference.
+    rate_limited = False
+
+    def __init__(
+        self,
+        model_name_or_path: str,
+        adapter_path: Optional[str] = None,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 20.0,
+        max_new_tokens: int = 256,
+        prefix_cache_size: int = 4,
+        min_prefix_tokens: int = 32,
+        device: str = "cpu",
+        tokenizer: Any = None,
+        model: Any = None,
+    ):
+        import torch
+
+        self._torch = torch
+        self.model_name = model_name_or_path
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_new_tokens = max_new_tokens
+        self.min_prefix_tokens = min_prefix_tokens
+        self.device = device
+
+        # An already loaded tokenizer and model may be passed in instead.
+        if tokenizer is None:
+            from transformers import AutoTokenizer
+
+            tokenizer = AutoTokenizer.from_pretrained(model_name_or_path)
+        if model is None:
+            from transformers import AutoModelForCausalLM
+
+            model = AutoModelForCausalLM.from_pretrained(model_name_or_path, torch_dtype=torch.float32)
+        self.tokenizer = tokenizer
+        if self.tokenizer.pad_token_id is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        # Chat-tuned models get prompts in the format they were trained on.
+        self.chat_template = bool(getattr(self.tokenizer, "chat_template", None))
+        self.model = model
+        if adapter_path:
+            from peft import PeftModel
+
+            # Merge the fine-tuned LoRA weights so inference runs on a plain model.
+            self.model = PeftModel.from_pretrained(self.model, adapter_path).merge_and_unload()
+        self.model.to(device).eval()
+
+        self.prefix_cache = PrefixKVCache(prefix_cache_size)
+        self._model_lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._worker = threading.Thread(target=self._serve, name="local-slm-batcher", daemon=True)
+        self._worker.start()
+
+    # ---- LangChain-style interface -------------------------------------
+
+    def invoke(self, prompt: Any, max_new_tokens: Optional[int] = None, **kwargs) -> "AIMessage":
+        request = _Request(self.render(prompt), max_new_tokens or self.max_new_tokens)
+        self._queue.put(request)
+        return request.future.result()
+
+    def batch(self, prompts: List[Any], **kwargs) -> List["AIMessage"]:
+        requests = [_Request(self.render(p), self.max_new_tokens) for p in prompts]
+        for request in requests:
+            self._queue.put(request)
+        return [request.future.result() for request in requests]
+
+    def stream(self, prompt: Any, **kwargs) -> Iterator["AIMessageChunk"]:
+        from langchain_core.messages import AIMessageChunk
+
+        message = self.invoke(prompt, **kwargs)
+        yield AIMessageChunk(content=message.content, usage_metadata=message.usage_metadata)
+
+    def render(self, prompt: Any) -> str:
+        """
+        The prompt text the model sees: the tokenizer's chat template when it
+        has one, otherwise the message contents joined by blank lines.
+        """
+        messages = _to_messages(prompt)
+        if self.chat_template:
+            return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        return "\n\n".join(message["content"] for message in messages)
+
+    def encode(self, text: str) -> List[int]:
+        # A rendered chat template already contains the special tokens.
+        return self.tokenizer(text, add_special_tokens=not self.chat_template)["input_ids"]
+
+    def warm_prefix(self, prefix: Any):
+        """
+        Precomputes and caches the key/value states for a known shared prefix,
+        e.g. a document block before its field tasks are fanned out. `prefix`
+        holds the leading messages of those prompts, the last one cut where
+        the per-task text would begin.
+        """
+        messages = _to_messages(prefix)
+        messages[-1] = {**messages[-1], "content": messages[-1]["content"] + _PREFIX_END}
+        text = self.render(messages)
+        ids = self.encode(text[:text.index(_PREFIX_END)])
+        # Drop the last token: it may merge differently with the text that follows.
+        key = tuple(ids[:-1])
+        with self._model_lock:
+            if len(key) >= self.min_prefix_tokens and key not in self.prefix_cache:
+                self.prefix_cache.put(key, self._compute_prefix(key))
+
+    def close(self):
+        self._queue.put(None)
+        self._worker.join()
+
+    # ---- Dynamic batching ----------------------------------------------
+
+    def _serve(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if request is None:
+                    self._queue.put(None)
+                    break
+                batch.append(request)
+
+            try:
+                with self._model_lock:
+                    results = self._generate(batch)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+            else:
+                for request, result in zip(batch, results):
+                    request.future.set_result(result)
+
+    def _compute_prefix(self, prefix_ids: Tuple[int, ...]) -> Any:
+        torch = self._torch
+        with torch.no_grad():
+            output = self.model(
+                input_ids=torch.tensor([list(prefix_ids)], device=self.device),
+                use_cache=True,
+            )
+        cache = output.past_key_values
+        if not hasattr(cache, "batch_repeat_interleave"):
+            # Older models return the legacy tuple-of-tuples format.
+            from transformers import DynamicCache
+
+            cache = DynamicCache.from_legacy_cache(cache)
+        return cache
+
+    def _shared_prefix(self, sequences: List[List[int]]) -> Tuple[Tuple[int, ...], Any]:
+        cached = self.prefix_cache.longest_match(sequences)
+        if len(sequences) > 1:
+            # Leave at least one uncached token per prompt for the forward pass.
+            length = min(_common_prefix_length(sequences), min(len(s) for s in sequences) - 1)
+            if length >= self.min_prefix_tokens and (cached is None or length > len(cached)):
+                key = tuple(sequences[0][:length])
+                self.prefix_cache.misses += 1
+                self.prefix_cache.put(key, self._compute_prefix(key))
+                return key, self.prefix_cache.get(key)
+        if cached is None:
+            return (), None
+        self.prefix_cache.hits += 1
+        return cached, self.prefix_cache.get(cached)
+
+    def _generate(self, batch: List[_Request]) -> List["AIMessage"]:
+        from langchain_core.messages import AIMessage
+
+        torch = self._torch
+        sequences = [self.encode(r.prompt) for r in batch]
+        prefix, prefix_cache = self._shared_prefix(sequences)
+        suffixes = [s[len(prefix):] for s in sequences]
+        width = max(len(s) for s in suffixes)
+        pad_id = self.tokenizer.pad_token_id
+
+        # Layout: [shared prefix][left padding][suffix]; padding is masked out.
+        input_ids, attention_mask = [], []
+        for suffix in suffixes:
+            padding = width - len(suffix)
+            input_ids.append(list(prefix) + [pad_id] * padding + suffix)
+            attention_mask.append([1] * len(prefix) + [0] * padding + [1] * len(suffix))
+
+        generate_kwargs = {}
+        if prefix_cache is not None:
+            past = copy.deepcopy(prefix_cache)
+            past.batch_repeat_interleave(len(batch))
+            generate_kwargs["past_key_values"] = past
+
+        with torch.no_grad():
+            output = self.model.generate(
+                input_ids=torch.tensor(input_ids, device=self.device),
+                attention_mask=torch.tensor(attention_mask, device=self.device),
+                max_new_tokens=max(r.max_new_tokens for r in batch),
+                do_sample=False,
+                pad_token_id=pad_id,
+                **generate_kwargs,
+            )
+
+        prompt_width = len(input_ids[0])
+        messages = []
+        for request, sequence, row in zip(batch, sequences, output):
+            new_tokens = row[prompt_width:prompt_width + request.max_new_tokens]
+            text = self.tokenizer.decode(new_tokens, skip_special_tokens=True).strip()
+            output_tokens = int((new_tokens != pad_id).sum())
+            messages.append(
+                AIMessage(
+                    content=text,
+                    usage_metadata={
+                        "input_tokens": len(sequence),
+                        "output_tokens": output_tokens,
+                        "total_tokens": len(sequence) + output_tokens,
+                        "input_token_details": {"cache_read": len(prefix)},
+                    },
+                    response_metadata={"model_name": self.model_name, "batch_size": len(batch)},
+                )
+            )
+        return messages
+
+
+def load_local_extractor_from_env() -> Optional[LocalSLMExtractor]:
+    """
+    Builds the local extractor backend when `HASTD_EXTRACTOR_BACKEND=local`.
+
+    Environment:
+        HASTD_LOCAL_MODEL: Hugging Face model id or local path (required).
+        HASTD_LOCAL_ADAPTER: Optional PEFT/LoRA adapter path.
+        HASTD_LOCAL_MAX_BATCH: Maximum prompts per forward pass (default 8).
+        HASTD_LOCAL_MAX_WAIT_MS: Batching window in milliseconds (default 20).
+    """
+    if os.getenv("HASTD_EXTRACTOR_BACKEND", "openai").lower() != "local":
+        return None
+    model = os.getenv("HASTD_LOCAL_MODEL")
+    if not model:
+        raise ValueError("HASTD_EXTRACTOR_BACKEND=local requires HASTD_LOCAL_MODEL to be set.")
+    return LocalSLMExtractor(
+        model,
+        adapter_path=os.getenv("HASTD_LOCAL_ADAPTER"),
+        max_batch_size=int(os.getenv("HASTD_LOCAL_MAX_BATCH", "8")),
+        max_wait_ms=float(os.getenv("HASTD_LOCAL_MAX_WAIT_MS", "20")),
+    )
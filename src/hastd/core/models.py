@@ -1,5 +1,10 @@
-from typing import Dict, Any
-from pydantic import create_model, BaseModel, EmailStr
+import threading
+from typing import TYPE_CHECKING, Dict, Any, Tuple, Type
+
+from hastd.core.coalescing import fingerprint_schema
+
+if TYPE_CHECKING:
+    from pydantic import BaseModel
 
 # A mapping from JSON schema types to Python/Pydantic types
 TYPE_MAPPING = {
@@ -16,14 +21,22 @@ class DynamicPydanticFactory:
     A factory for creating Pydantic models on-the-fly from a JSON schema.
     This is the core of the dynamic validation system, making a static
     model registry unnecessary.
+
+    Generated models are cached by schema content and name, so validating the
+    same (sub-)schema repeatedly only builds its model once.
     """
-    @staticmethod
+    MAX_CACHED_MODELS = 1024
+    _cache: Dict[Tuple[str, str], Type["BaseModel"]] = {}
+    _lock = threading.Lock()
+
+    @classmethod
     def create_model_from_schema(
+        cls,
         schema: Dict[str, Any], 
         model_name: str = "DynamicValidationModel"
-    ) -> BaseModel:
+    ) -> Type["BaseModel"]:
         """
-        Dynamically creates a Pydantic model from a JSON schema's properties.
+        Dynamically creates (or reuses) a Pydantic model from a JSON schema's properties.
 
         Args:
             schema: The JSON schema dictionary (or a sub-schema).
@@ -32,11 +45,27 @@ class DynamicPydanticFactory:
         Returns:
             A Pydantic BaseModel class generated from the schema.
         """
+        key = (fingerprint_schema(schema), model_name)
+        model = cls._cache.get(key)
+        if model is None:
+            model = cls._build_model(schema, model_name)
+            with cls._lock:
+                model = cls._cache.setdefault(key, model)
+                while len(cls._cache) > cls.MAX_CACHED_MODELS:
+                    cls._cache.pop(next(iter(cls._cache)))
+        return model
+
+    @staticmethod
+    def _build_model(schema: Dict[str, Any], model_name: str) -> Type["BaseModel"]:
+        from pydantic import create_model, EmailStr
+
         fields = {}
         properties = schema.get("properties", {})
         required_fields = schema.get("required", [])
         
         for name, props in properties.items():
+            # Boolean sub-schemas (`"x": true`) accept any value.
+            props = props if isinstance(props, dict) else {}
             field_type = TYPE_MAPPING.get(props.get("type"), Any)
             
             # For specific string formats like email, use Pydantic's special types
@@ -0,0 +1,267 @@
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from hastd.core.tokens import estimate_tokens
+
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage
+
+
+class RenderedPrompt:
+    """
+    A prompt split into a cacheable prefix and a per-call suffix.
+
+    `prefix` (system instructions + document) is byte-identical for every
+    field task on the same document; only `suffix` varies.
+    """
+
+    def __init__(self, template_id: str, system: str, prefix: str, suffix: str):
+        self.template_id = template_id
+        self.system = system
+        self.prefix = prefix
+        self.suffix = suffix
+
+    @property
+    def messages(self) -> List["BaseMessage"]:
+        from langchain_core.messages import HumanMessage, SystemMessage
+
+        return [SystemMessage(content=self.system), HumanMessage(content=self.prefix + self.suffix)]
+
+    @property
+    def text(self) -> str:
+        return f"{self.system}\n\n{self.prefix}{self.suffix}"
+
+
+class PromptTemplate:
+    """
+    A versioned prompt layout designed for provider-side prefix caching.
+
+    The system text and the prefix may only depend on the document, so all
+    calls for one document share the same leading tokens. Everything
+    field-specific belongs in the suffix.
+    """
+
+    def __init__(self, name: str, version: int, system: str, prefix: str, suffix: str):
+        self.name = name
+        self.version = version
+        self.system = system.strip()
+        self.prefix = prefix
+        self.suffix = suffix
+
+    @property
+    def template_id(self) -> str:
+        return f"{self.name}@v{self.version}"
+
+    def render(self, document: str, **fields: Any) -> RenderedPrompt:
+        return RenderedPrompt(
+            template_id=self.template_id,
+            system=self.system,
+            prefix=self.prefix.format(document=document),
+            suffix=self.suffix.format(**fields),
+        )
+
+    def render_prefix(self, document: str) -> RenderedPrompt:
+        """
+        Renders only the part shared by every call for `document`.
+        """
+        return RenderedPrompt(self.template_id, self.system, self.prefix.format(document=document), "")
+
+
+_REGISTRY: Dict[Tuple[str, int], PromptTemplate] = {}
+
+
+def register_template(template: PromptTemplate) -> PromptTemplate:
+    key = (template.name, template.version)
+    if key in _REGISTRY:
+        raise ValueError(f"Prompt template '{template.template_id}' is already registered.")
+    _REGISTRY[key] = template
+    return template
+
+
+def get_template(name: str, version: Optional[int] = None) -> PromptTemplate:
+    """
+    Returns a registered template, defaulting to its latest version.
+    """
+    if version is None:
+        versions = [v for (n, v) in _REGISTRY if n == name]
+        if not versions:
+            raise KeyError(f"No prompt template named '{name}'.")
+        version = max(versions)
+    return _REGISTRY[(name, version)]
+
+
+# -----------------------------
+# Built-in templates
+# -----------------------------
+_EXTRACTION_SYSTEM = """
+You are a precise data extraction agent. You read a document and return the
+requested values as JSON. Only use information present in the document.
+Return ONLY a JSON object, with no other text or explanations.
+"""
+
+_DOCUMENT_PREFIX = "DOCUMENT:\n---\n{document}\n---\n\n"
+
+register_template(PromptTemplate(
+    name="extract_field",
+    version=1,
+    system=_EXTRACTION_SYSTEM,
+    prefix=_DOCUMENT_PREFIX,
+    suffix=(
+        "Extract the single field '{field_path}'.\n"
+        "Pay close attention to the field description: \"{description}\".\n\n"
+        "Return ONLY a single JSON object with the key \"{field_name}\"."
+    ),
+))
+
+register_template(PromptTemplate(
+    name="correct_field",
+    version=1,
+    system=_EXTRACTION_SYSTEM,
+    prefix=_DOCUMENT_PREFIX,
+    suffix=(
+        "A previous attempt to extract a field from the document failed. Please correct it.\n\n"
+        "FIELD TO EXTRACT: {field_path}\n"
+        "DESCRIPTION: {description}\n\n"
+        "PREVIOUS (INCORRECT) OUTPUT:\n{previous_output}\n\n"
+        "VALIDATION ERRORS:\n{errors}\n\n"
+        "Return ONLY a corrected JSON object with the key \"{field_name}\"."
+    ),
+))
+
+register_template(PromptTemplate(
+    name="extract_fields",
+    version=1,
+    system=_EXTRACTION_SYSTEM,
+    prefix=_DOCUMENT_PREFIX,
+    suffix="Extract the following fields from the document:\n{field_paths}",
+))
+
+register_template(PromptTemplate(
+    name="correct_fields",
+    version=1,
+    system=_EXTRACTION_SYSTEM,
+    prefix=_DOCUMENT_PREFIX,
+    suffix=(
+        "Correct the following extracted data based on errors and the document.\n\n"
+        "Extracted:\n{extracted}\n\n"
+        "Errors:\n{errors}"
+    ),
+))
+
+register_template(PromptTemplate(
+    name="enumerate_items",
+    version=1,
+    system=_EXTRACTION_SYSTEM,
+    prefix=_DOCUMENT_PREFIX,
+    suffix=(
+        "List every item of the array '{array_path}' ({description}) in document order.\n"
+        "For each item, quote the first 6 to 12 words of its text exactly as they appear in the document.\n\n"
+        "Return ONLY a JSON object of the form {{\"items\": [\"<opening words>\", ...]}}."
+    ),
+))
+
+register_template(PromptTemplate(
+    name="extract_items",
+    version=1,
+    system=_EXTRACTION_SYSTEM,
+    prefix=_DOCUMENT_PREFIX,
+    suffix=(
+        "Extract one '{array_path}' object from each of the numbered excerpts below.\n"
+        "Each object has the fields:\n{item_fields}\n\n"
+        "EXCERPTS:\n{excerpts}\n\n"
+        "Return ONLY a JSON object of the form {{\"items\": [...]}} with exactly one object per excerpt, in order."
+    ),
+))
+
+register_template(PromptTemplate(
+    name="correct_items",
+    version=1,
+    system=_EXTRACTION_SYSTEM,
+    prefix=_DOCUMENT_PREFIX,
+    suffix=(
+        "A previous attempt to extract '{array_path}' objects from the numbered excerpts below failed "
+        "validation. Please correct them.\n"
+        "Each object has the fields:\n{item_fields}\n\n"
+        "EXCERPTS WITH THEIR PREVIOUS (INCORRECT) OUTPUT AND VALIDATION ERRORS:\n{excerpts}\n\n"
+        "Return ONLY a JSON object of the form {{\"items\": [...]}} with exactly one corrected object per "
+        "excerpt, in order."
+    ),
+))
+
+
+# -----------------------------
+# Provider cache accounting
+# -----------------------------
+def read_prompt_usage(message: Any) -> Dict[str, int]:
+    """
+    Reads input, cached-input and output token counts from a chat model
+    response, covering LangChain's normalized `usage_metadata` as well as
+    raw OpenAI and Anthropic usage payloads.
+    """
+    usage = getattr(message, "usage_metadata", None) or {}
+    input_tokens = usage.get("input_tokens", 0)
+    output_tokens = usage.get("output_tokens", 0)
+    cached_tokens = (usage.get("input_token_details") or {}).get("cache_read", 0)
+
+    if not usage:
+        metadata = getattr(message, "response_metadata", None) or {}
+        raw = metadata.get("token_usage") or metadata.get("usage") or {}
+        input_tokens = raw.get("prompt_tokens", raw.get("input_tokens", 0))
+        output_tokens = raw.get("completion_tokens", raw.get("output_tokens", 0))
+        cached_tokens = (raw.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+        cached_tokens = cached_tokens or raw.get("cache_read_input_tokens", 0)
+
+    return {
+        "input_tokens": input_tokens or 0,
+        "cached_tokens": cached_tokens or 0,
+        "output_tokens": output_tokens or 0,
+    }
+
+
+def usage_record(prompt: RenderedPrompt, message: Any) -> Dict[str, Any]:
+    return {"template": prompt.template_id, **read_prompt_usage(message)}
+
+
+def estimated_usage_record(prompt: RenderedPrompt, completion: str = "") -> Dict[str, Any]:
+    """
+    A usage record for a call whose provider usage never arrived, e.g. a
+    stream cancelled before its trailing usage chunk. Token counts are local
+    estimates and the cached-token count is unknown (None).
+    """
+    return {
+        "template": prompt.template_id,
+        "input_tokens": estimate_tokens(prompt.text),
+        "cached_tokens": None,
+        "output_tokens": estimate_tokens(completion),
+        "estimated": True,
+    }
+
+
+def summarize_prompt_usage(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Aggregates usage records into a per-request cached-token report.
+
+    Estimated records count towards the token totals and `estimated_calls`,
+    but not towards `cached_ratio`, since their cache hits are unknown.
+    """
+    def empty():
+        return {"calls": 0, "estimated_calls": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0,
+                "_reported_input": 0}
+
+    by_template: Dict[str, Dict[str, Any]] = {}
+    totals = empty()
+    for record in records:
+        bucket = by_template.setdefault(record["template"], empty())
+        for target in (bucket, totals):
+            target["calls"] += 1
+            target["input_tokens"] += record.get("input_tokens", 0)
+            target["cached_tokens"] += record.get("cached_tokens") or 0
+            target["output_tokens"] += record.get("output_tokens", 0)
+            if record.get("estimated"):
+                target["estimated_calls"] += 1
+            else:
+                target["_reported_input"] += record.get("input_tokens", 0)
+
+    for target in [totals, *by_template.values()]:
+        reported = target.pop("_reported_input")
+        target["cached_ratio"] = round(target["cached_tokens"] / reported, 4) if reported else 0.0
+    return {**totals, "by_template": by_template}
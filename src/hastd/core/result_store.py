@@ -0,0 +1,315 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from hastd.core.confidence import score_all_fields
+
+# JSON field types and the Arrow types their columns are exported as.
+# Arrays, objects and untyped fields are exported as JSON-encoded strings.
+_ARROW_TYPES = {
+    "string": "string",
+    "integer": "int64",
+    "number": "float64",
+    "boolean": "bool_",
+}
+
+
+def _column_value(value: Any, field_type: str) -> Any:
+    """
+    Converts a stored value to the scalar its column holds.
+    """
+    if value is None:
+        return None
+    try:
+        if field_type == "string":
+            return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+        if field_type == "integer":
+            return int(value)
+        if field_type == "number":
+            return float(value)
+        if field_type == "boolean":
+            return value if isinstance(value, bool) else None
+    except (TypeError, ValueError):
+        return None
+    return json.dumps(value, ensure_ascii=False)
+
+
+class ResultStore:
+    """
+    A local store of extraction results keyed by (document hash, schema hash).
+
+    Each result keeps the response payload for point lookups, plus one row
+    per output field (value, type, confidence, attempts) so results can be
+    exported as flat tables with one column per `field_path`.
+    """
+
+    def __init__(self, path: Union[str, Path] = ":memory:"):
+        if str(path) != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS results (
+                doc_hash TEXT NOT NULL,
+                schema_hash TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                errors TEXT,
+                attempts INTEGER,
+                elapsed_s REAL,
+                timings TEXT NOT NULL,
+                response TEXT NOT NULL,
+                PRIMARY KEY (doc_hash, schema_hash)
+            );
+            CREATE TABLE IF NOT EXISTS field_values (
+                doc_hash TEXT NOT NULL,
+                schema_hash TEXT NOT NULL,
+                field_path TEXT NOT NULL,
+                field_type TEXT NOT NULL,
+                value TEXT,
+                confidence REAL,
+                attempts INTEGER,
+                PRIMARY KEY (doc_hash, schema_hash, field_path)
+            );
+            """
+        )
+
+    def close(self):
+        self._db.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def put(
+        self,
+        doc_hash: str,
+        schema_hash: str,
+        columns: Dict[str, str],
+        values: Dict[str, Any],
+        response: Dict[str, Any],
+        errors: Optional[str] = None,
+        attempts: Optional[Union[int, Dict[str, int]]] = None,
+        timings: Optional[Dict[str, float]] = None,
+        confidence: Optional[Dict[str, float]] = None,
+    ):
+        """
+        Stores (or replaces) the result for a document and schema.
+
+        Args:
+            doc_hash: Content hash of the document.
+            schema_hash: Hash of the compiled schema.
+            columns: Output field paths and their JSON types.
+            values: Extracted values by field path.
+            response: The payload to serve for repeated requests.
+            errors: Validation errors the extraction ended with, if any.
+            attempts: LLM attempts per field path, or an int for the whole
+                result only; per-field attempts are then left null.
+            timings: Stage timings in seconds; `total` is kept as `elapsed_s`.
+            confidence: Scores by field path; computed with `score_all_fields`
+                over the flat values when omitted.
+        """
+        if confidence is None:
+            confidence = score_all_fields({path: values[path] for path in columns if path in values})
+        per_field = attempts if isinstance(attempts, dict) else {}
+        total_attempts = sum(per_field.values()) if isinstance(attempts, dict) else attempts
+        timings = timings or {}
+
+        rows = [
+            (
+                doc_hash,
+                schema_hash,
+                path,
+                field_type,
+                json.dumps(values[path], ensure_ascii=False) if path in values else None,
+                confidence.get(path),
+                per_field.get(path),
+            )
+            for path, field_type in columns.items()
+        ]
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    doc_hash,
+                    schema_hash,
+                    time.time(),
+                    errors,
+                    total_attempts,
+                    timings.get("total"),
+                    json.dumps(timings),
+                    json.dumps(response, ensure_ascii=False, default=str),
+                ),
+            )
+            self._db.execute(
+                "DELETE FROM field_values WHERE doc_hash = ? AND schema_hash = ?", (doc_hash, schema_hash)
+            )
+            self._db.executemany("INSERT INTO field_values VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def get(self, doc_hash: str, schema_hash: str) -> Optional[Dict[str, Any]]:
+        """
+        Point lookup of a stored result, or None.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT created_at, errors, attempts, timings, response FROM results "
+                "WHERE doc_hash = ? AND schema_hash = ?",
+                (doc_hash, schema_hash),
+            ).fetchone()
+            if row is None:
+                return None
+            fields = self._db.execute(
+                "SELECT field_path, value, confidence FROM field_values WHERE doc_hash = ? AND schema_hash = ?",
+                (doc_hash, schema_hash),
+            ).fetchall()
+
+        created_at, errors, attempts, timings, response = row
+        return {
+            "doc_hash": doc_hash,
+            "schema_hash": schema_hash,
+            "created_at": created_at,
+            "errors": errors,
+            "attempts": attempts,
+            "timings": json.loads(timings),
+            "response": json.loads(response),
+            "values": {path: json.loads(value) for path, value, _ in fields if value is not None},
+            "confidence": {path: score for path, _, score in fields if score is not None},
+        }
+
+    # -- Columnar export -------------------------------------------------
+    def columns(self, schema_hash: Optional[str] = None) -> Dict[str, str]:
+        """
+        All field path columns (and their types) present in the store.
+        """
+        query = "SELECT DISTINCT field_path, field_type FROM field_values"
+        params: Tuple[Any, ...] = ()
+        if schema_hash is not None:
+            query += " WHERE schema_hash = ?"
+            params = (schema_hash,)
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY field_path", params).fetchall()
+        return dict(rows)
+
+    def iter_batches(
+        self, schema_hash: Optional[str] = None, batch_size: int = 10_000
+    ) -> Iterator[Tuple[Dict[str, str], Dict[str, List[Any]]]]:
+        """
+        Yields the stored results as column batches: one entry per result
+        with `doc_hash`, `schema_hash`, `created_at`, `attempts`, `elapsed_s`,
+        `errors`, then every field path and `<field_path>#confidence`.
+        """
+        columns = self.columns(schema_hash)
+        names = ["doc_hash", "schema_hash", "created_at", "attempts", "elapsed_s", "errors"]
+        names += [name for path in columns for name in (path, f"{path}#confidence")]
+
+        schema_filter = " AND schema_hash = ?" if schema_hash is not None else ""
+        extra: Tuple[Any, ...] = (schema_hash,) if schema_hash is not None else ()
+
+        last_rowid = 0
+        while True:
+            # Page by rowid so the lock is only held for one batch at a time.
+            with self._lock:
+                results = self._db.execute(
+                    "SELECT rowid, doc_hash, schema_hash, created_at, attempts, elapsed_s, errors FROM results "
+                    f"WHERE rowid > ?{schema_filter} ORDER BY rowid LIMIT ?",
+                    (last_rowid, *extra, batch_size),
+                ).fetchall()
+                if not results:
+                    return
+                fields = self._db.execute(
+                    "SELECT f.doc_hash, f.schema_hash, f.field_path, f.value, f.confidence "
+                    "FROM field_values f JOIN results r "
+                    "ON f.doc_hash = r.doc_hash AND f.schema_hash = r.schema_hash "
+                    f"WHERE r.rowid > ? AND r.rowid <= ?{schema_filter.replace('schema_hash', 'r.schema_hash')}",
+                    (last_rowid, results[-1][0], *extra),
+                ).fetchall()
+
+            batch: Dict[str, List[Any]] = {name: [None] * len(results) for name in names}
+            positions = {}
+            for position, (_, *meta) in enumerate(results):
+                positions[(meta[0], meta[1])] = position
+                for name, item in zip(names, meta):
+                    batch[name][position] = item
+            for doc_hash, result_schema, path, value, score in fields:
+                position = positions[(doc_hash, result_schema)]
+                batch[path][position] = _column_value(json.loads(value) if value is not None else None, columns[path])
+                batch[f"{path}#confidence"][position] = score
+
+            yield columns, batch
+            last_rowid = results[-1][0]
+
+    def export_jsonl(self, path: Union[str, Path], schema_hash: Optional[str] = None) -> int:
+        """
+        Writes one flat JSON object per result, keyed by column. Returns the row count.
+        """
+        count = 0
+        with open(path, "w", encoding="utf-8") as f:
+            for _, batch in self.iter_batches(schema_hash):
+                names = list(batch)
+                for values in zip(*batch.values()):
+                    f.write(json.dumps(dict(zip(names, values)), ensure_ascii=False) + "\n")
+                    count += 1
+        return count
+
+    def export_parquet(self, path: Union[str, Path], schema_hash: Optional[str] = None) -> int:
+        """
+        Writes the results as a Parquet file with one typed column per field
+        path. Requires the optional `pyarrow` package. Returns the row count.
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet export requires pyarrow: pip install pyarrow") from e
+
+        columns = self.columns(schema_hash)
+        fields = [
+            pa.field("doc_hash", pa.string()),
+            pa.field("schema_hash", pa.string()),
+            pa.field("created_at", pa.float64()),
+            pa.field("attempts", pa.int64()),
+            pa.field("elapsed_s", pa.float64()),
+            pa.field("errors", pa.string()),
+        ]
+        for field_path, field_type in columns.items():
+            fields.append(pa.field(field_path, getattr(pa, _ARROW_TYPES.get(field_type, "string"))()))
+            fields.append(pa.field(f"{field_path}#confidence", pa.float64()))
+        arrow_schema = pa.schema(fields)
+
+        count = 0
+        with pq.ParquetWriter(str(path), arrow_schema) as writer:
+            for _, batch in self.iter_batches(schema_hash):
+                writer.write_table(pa.Table.from_pydict(batch, schema=arrow_schema))
+                count += len(batch["doc_hash"])
+        return count
+
+
+def load_result_store_from_env() -> Optional[ResultStore]:
+    """
+    Opens the result store at HASTD_RESULT_STORE, if persistence is enabled.
+    """
+    path = os.getenv("HASTD_RESULT_STORE")
+    return ResultStore(path) if path else None
+
+
+# Export CLI, e.g. python -m hastd.core.result_store results.db results.parquet
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export stored extraction results as a flat table.")
+    parser.add_argument("store", help="Path of the sqlite result store.")
+    parser.add_argument("output", help="Output file (.parquet or .jsonl).")
+    parser.add_argument("--schema-hash", help="Only export results for this schema.")
+    args = parser.parse_args()
+
+    store = ResultStore(args.store)
+    if args.output.endswith(".parquet"):
+        rows = store.export_parquet(args.output, args.schema_hash)
+    else:
+        rows = store.export_jsonl(args.output, args.schema_hash)
+    print(f"📤 Exported {rows} results to {args.output}")
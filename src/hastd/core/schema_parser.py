@@ -1,7 +1,26 @@
 import json
-from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
 from pathlib import Path
 
+from hastd.core.coalescing import fingerprint_schema
+
+# Nesting depth (in properties/items) after which sub-schemas become opaque leaf tasks.
+DEFAULT_MAX_DEPTH = 32
+
+# Keys that may sit next to a "$ref" without changing what it compiles to.
+_REF_ANNOTATIONS = {"$ref", "description", "title", "$comment"}
+
+_ENUM_TYPES = {bool: "boolean", int: "integer", float: "number", str: "string"}
+
+
+class SchemaResolutionError(ValueError):
+    """
+    Raised when a schema cannot be resolved (unknown or remote $ref,
+    or a reference/allOf chain that only refers to itself).
+    """
+
+
 class ExtractionTask:
     def __init__(
         self,
@@ -26,61 +45,377 @@ class ExtractionTask:
             "description": self.description,
         }
 
+    def __getitem__(self, key: str) -> Any:
+        # Allows tasks to be used wherever a task dict is expected.
+        return self.to_dict()[key]
+
     def __repr__(self):
         return f"<Task: {self.field_path} ({self.field_type}){' [required]' if self.required else ''}>"
 
+
+# A leaf task relative to the schema node it was compiled from:
+# (relative path, type, required, enum, description). `required` is None
+# when it is inherited from the site that references the node.
+_TaskTemplate = Tuple[str, str, Optional[bool], Optional[List[Any]], str]
+
+
+def _join(prefix: str, relative: str) -> str:
+    if not relative:
+        return prefix
+    if not prefix or relative.startswith("[]"):
+        return prefix + relative
+    return f"{prefix}.{relative}"
+
+
+class _CompiledRef:
+    def __init__(self, templates: Tuple[_TaskTemplate, ...], entered: FrozenSet[str], depth: int):
+        self.templates = templates
+        self.entered = entered
+        self.depth = depth
+
+
+class _Scope:
+    """
+    Collects the tasks produced while expanding one referenced definition.
+    """
+
+    def __init__(self, ref, parent, site_path, site_required, site_description, depth, stack_refs):
+        self.ref = ref
+        self.parent = parent
+        self.site_path = site_path
+        self.site_required = site_required
+        self.site_description = site_description
+        self.base_depth = depth
+        self.max_depth = depth
+        self.stack_refs = stack_refs
+        self.templates: List[_TaskTemplate] = []
+        self.entered = {ref}
+        self.cuts = set()
+        self.hit_depth_limit = False
+
+
+class SchemaCompiler:
+    """
+    Compiles a JSON schema into extraction tasks.
+
+    Understands local `$ref`s (`#/$defs/...`, `#/definitions/...`, `#`),
+    `allOf` composition and `oneOf`/`anyOf` alternatives. Each referenced
+    definition is compiled once into relative task templates that are reused
+    wherever it is referenced. A reference back into a definition that is
+    already being expanded on the current path becomes a single opaque leaf
+    task, as does anything nested deeper than `max_depth`. Traversal uses an
+    explicit stack, so deep schemas do not hit Python's recursion limit.
+    """
+
+    def __init__(self, root: Dict[str, Any], max_depth: int = DEFAULT_MAX_DEPTH):
+        self.root = root
+        self.max_depth = max_depth
+        self._pointers: Dict[str, Dict[str, Any]] = {}
+        self._normalized: Dict[int, Tuple[Dict[str, Any], Dict[str, Any]]] = {}
+        self._normalizing = set()
+        self._compiled: Dict[str, _CompiledRef] = {}
+        self.stats = {"refs_compiled": 0, "refs_reused": 0, "cycles_cut": 0, "depth_cut": 0}
+
+    # ---- Resolution --------------------------------------------------------
+
+    def resolve_pointer(self, ref: str) -> Dict[str, Any]:
+        if ref in self._pointers:
+            return self._pointers[ref]
+        if not ref.startswith("#"):
+            raise SchemaResolutionError(f"Only local references are supported, got '{ref}'.")
+
+        node: Any = self.root
+        for part in ref[1:].lstrip("/").split("/") if ref != "#" else []:
+            part = part.replace("~1", "/").replace("~0", "~")
+            if isinstance(node, list) and part.isdigit():
+                node = node[int(part)]
+            elif isinstance(node, dict) and part in node:
+                node = node[part]
+            else:
+                raise SchemaResolutionError(f"Unresolvable reference '{ref}'.")
+        self._pointers[ref] = node
+        return node
+
+    def normalize(self, node: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Returns `node` with top-level `$ref`, `allOf`, `oneOf` and `anyOf`
+        folded into a single plain schema. Nested properties are left as-is.
+        Boolean schemas (`true`/`false`) and other non-object nodes are untyped.
+        """
+        if not isinstance(node, dict):
+            return {"type": "any"}
+        key = id(node)
+        if key in self._normalized:
+            return self._normalized[key][1]
+        if key in self._normalizing:
+            raise SchemaResolutionError("Schema composition refers to itself without nesting.")
+
+        self._normalizing.add(key)
+        try:
+            result = self._normalize_uncached(node)
+        finally:
+            self._normalizing.discard(key)
+        # Keep `node` alive alongside its id so the id cannot be reused.
+        self._normalized[key] = (node, result)
+        return result
+
+    def _normalize_uncached(self, node: Dict[str, Any]) -> Dict[str, Any]:
+        own = {k: v for k, v in node.items() if k not in ("$ref", "allOf", "oneOf", "anyOf")}
+        parts = []
+        if "$ref" in node:
+            parts.append(self.normalize(self.resolve_pointer(node["$ref"])))
+        for member in node.get("allOf", []):
+            parts.append(self.normalize(member))
+        if not parts and "oneOf" not in node and "anyOf" not in node:
+            return self._with_type(own)
+
+        merged = self._merge(parts + [own]) if parts else own
+        alternatives = node.get("oneOf") or node.get("anyOf")
+        if alternatives:
+            merged = self._merge([merged, self._union([self.normalize(a) for a in alternatives])])
+        return self._with_type(merged)
+
+    @staticmethod
+    def _with_type(node: Dict[str, Any]) -> Dict[str, Any]:
+        declared = node.get("type")
+        if isinstance(declared, list):
+            non_null = [t for t in declared if t != "null"]
+            declared = non_null[0] if non_null else "null"
+        if declared is None:
+            if "properties" in node:
+                declared = "object"
+            elif "items" in node:
+                declared = "array"
+            elif node.get("enum"):
+                declared = _ENUM_TYPES.get(type(node["enum"][0]), "any")
+            elif "const" in node:
+                declared = _ENUM_TYPES.get(type(node["const"]), "any")
+            else:
+                declared = "any"
+        if node.get("type") == declared:
+            return node
+        return {**node, "type": declared}
+
+    @staticmethod
+    def _merge(schemas: List[Dict[str, Any]]) -> Dict[str, Any]:
+        merged: Dict[str, Any] = {}
+        properties: Dict[str, Any] = {}
+        required: List[str] = []
+        for schema in schemas:
+            for name, prop in schema.get("properties", {}).items():
+                properties[name] = {"allOf": [properties[name], prop]} if name in properties else prop
+            required.extend(r for r in schema.get("required", []) if r not in required)
+            for k, v in schema.items():
+                if k not in ("properties", "required") and v is not None:
+                    merged.setdefault(k, v)
+        if properties:
+            merged["properties"] = properties
+        if required:
+            merged["required"] = required
+        return merged
+
+    @staticmethod
+    def _union(alternatives: List[Dict[str, Any]]) -> Dict[str, Any]:
+        types = {a.get("type") for a in alternatives if a.get("type") not in (None, "null", "any")}
+        union: Dict[str, Any] = {}
+        properties: Dict[str, Any] = {}
+        for alternative in alternatives:
+            for name, prop in alternative.get("properties", {}).items():
+                properties.setdefault(name, prop)
+        if properties:
+            union["properties"] = properties
+            # Only fields every alternative requires are required.
+            required = set(alternatives[0].get("required", []))
+            for alternative in alternatives[1:]:
+                required &= set(alternative.get("required", []))
+            if required:
+                union["required"] = [r for r in alternatives[0].get("required", []) if r in required]
+        union["type"] = types.pop() if len(types) == 1 else ("object" if properties else "any")
+        return union
+
+    # ---- Compilation -------------------------------------------------------
+
+    def compile(
+        self,
+        path_prefix: str = "",
+        required_fields: Optional[List[str]] = None,
+        schema: Optional[Dict[str, Any]] = None,
+    ) -> List[ExtractionTask]:
+        node = schema if schema is not None else self.root
+        root = self.normalize(node)
+        if required_fields is not None:
+            root = {**root, "required": required_fields}
+
+        # The root and any definitions it is an alias of are already "being expanded".
+        root_refs = ["#"]
+        while isinstance(node, dict) and "$ref" in node and node["$ref"] not in root_refs:
+            root_refs.append(node["$ref"])
+            node = self.resolve_pointer(node["$ref"])
+
+        scope = _Scope("#", None, "", False, None, 0, tuple(root_refs))
+        stack: List[tuple] = [("node", root, "", False, 0, scope)]
+        while stack:
+            item = stack.pop()
+            if item[0] == "close":
+                self._close(item[1])
+            else:
+                self._visit(stack, *item[1:])
+
+        return [
+            ExtractionTask(
+                field_path=_join(path_prefix, relative),
+                field_type=field_type,
+                required=bool(required),
+                enum=enum,
+                description=description,
+            )
+            for relative, field_type, required, enum, description in scope.templates
+        ]
+
+    def _visit(self, stack, node, relative, required, depth, scope: _Scope):
+        scope.max_depth = max(scope.max_depth, depth)
+
+        if isinstance(node, dict) and "$ref" in node and set(node) <= _REF_ANNOTATIONS:
+            self._visit_ref(stack, node, relative, required, depth, scope)
+            return
+
+        schema = self.normalize(node)
+        field_type = schema["type"]
+        description = schema.get("description", "")
+
+        if depth >= self.max_depth and field_type in ("object", "array"):
+            scope.hit_depth_limit = True
+            self.stats["depth_cut"] += 1
+            scope.templates.append((relative, field_type, required, schema.get("enum"), description))
+            return
+
+        if field_type == "object" and schema.get("properties"):
+            required_names = set(schema.get("required", []))
+            # Push in reverse so properties come off the stack in schema order.
+            for name, child in reversed(list(schema["properties"].items())):
+                stack.append(("node", child, _join(relative, name), name in required_names, depth + 1, scope))
+        elif field_type == "array":
+            items = schema.get("items")
+            if isinstance(items, list) or (items is None and schema.get("prefixItems")):
+                # Tuple-form arrays: each item may match any of the positional schemas.
+                items = {"anyOf": list(items if items is not None else schema["prefixItems"])}
+            items = {} if items is None else items
+            item_schema = self.normalize(items)
+            if item_schema["type"] in ("object", "array"):
+                stack.append(("node", items, relative + "[]", required, depth + 1, scope))
+            else:
+                scope.templates.append((
+                    relative + "[]",
+                    item_schema["type"],
+                    required,
+                    schema.get("enum") or item_schema.get("enum"),
+                    description or item_schema.get("description", ""),
+                ))
+        else:
+            scope.templates.append((relative, field_type, required, schema.get("enum"), description))
+
+    def _visit_ref(self, stack, node, relative, required, depth, scope: _Scope):
+        ref = node["$ref"]
+        description = node.get("description")
+
+        if ref in scope.stack_refs:
+            # Recursive definition: stop here and extract the sub-tree as a whole.
+            target = self.normalize(self.resolve_pointer(ref))
+            scope.cuts.add(ref)
+            self.stats["cycles_cut"] += 1
+            scope.templates.append(
+                (relative, target["type"], required, target.get("enum"), description or target.get("description", ""))
+            )
+            return
+
+        compiled = self._compiled.get(ref)
+        if (
+            compiled is not None
+            and not (compiled.entered & set(scope.stack_refs))
+            and depth + compiled.depth < self.max_depth
+        ):
+            self.stats["refs_reused"] += 1
+            self._splice(scope, compiled.templates, relative, required, description)
+            scope.entered |= compiled.entered
+            scope.max_depth = max(scope.max_depth, depth + compiled.depth)
+            return
+
+        child = _Scope(ref, scope, relative, required, description, depth, scope.stack_refs + (ref,))
+        stack.append(("close", child))
+        stack.append(("node", self.resolve_pointer(ref), "", None, depth, child))
+
+    def _close(self, child: _Scope):
+        templates = tuple(child.templates)
+        self.stats["refs_compiled"] += 1
+        # Only cache expansions that do not depend on where they were reached.
+        if not child.hit_depth_limit and child.cuts <= child.entered:
+            self._compiled[child.ref] = _CompiledRef(
+                templates, frozenset(child.entered), child.max_depth - child.base_depth
+            )
+
+        parent = child.parent
+        self._splice(parent, templates, child.site_path, child.site_required, child.site_description)
+        parent.entered |= child.entered
+        parent.cuts |= child.cuts
+        parent.hit_depth_limit |= child.hit_depth_limit
+        parent.max_depth = max(parent.max_depth, child.max_depth)
+
+    @staticmethod
+    def _splice(scope: _Scope, templates, site_path, site_required, site_description):
+        for relative, field_type, required, enum, description in templates:
+            if not relative.replace("[]", ""):
+                # The referenced node itself is the leaf: the site decides.
+                required = site_required if required is None else required
+                description = site_description or description
+            scope.templates.append((_join(site_path, relative), field_type, required, enum, description))
+
+
 def parse_json_schema(
     schema: Dict[str, Any],
     path_prefix: str = "",
     required_fields: Optional[List[str]] = None,
+    max_depth: int = DEFAULT_MAX_DEPTH,
 ) -> List[ExtractionTask]:
-    tasks = []
+    return SchemaCompiler(schema, max_depth=max_depth).compile(path_prefix, required_fields)
 
-    if required_fields is None:
-        required_fields = schema.get("required", [])
 
-    properties = schema.get("properties", {})
+class CompiledSchema:
+    """
+    A schema together with its content hash and compiled task list.
+    """
 
-    for field_name, field_schema in properties.items():
-        full_path = f"{path_prefix}.{field_name}" if path_prefix else field_name
-        field_type = field_schema.get("type", "object")
-        enum_values = field_schema.get("enum")
-        description = field_schema.get("description", "")
-        is_required = field_name in required_fields
+    def __init__(self, schema: Dict[str, Any], schema_hash: str, tasks: List[ExtractionTask]):
+        self.schema = schema
+        self.schema_hash = schema_hash
+        self.tasks = tasks
+
+
+_COMPILED_CACHE_SIZE = 128
+_compiled_schemas: "OrderedDict[str, CompiledSchema]" = OrderedDict()
+
+
+def compile_schema(schema: Dict[str, Any], max_depth: int = DEFAULT_MAX_DEPTH) -> CompiledSchema:
+    """
+    Compiles a schema, reusing earlier compilations of identical schemas.
+    """
+    schema_hash = fingerprint_schema(schema)
+    key = f"{schema_hash}:{max_depth}"
+    if key in _compiled_schemas:
+        _compiled_schemas.move_to_end(key)
+        return _compiled_schemas[key]
+
+    compiled = CompiledSchema(schema, schema_hash, parse_json_schema(schema, max_depth=max_depth))
+    _compiled_schemas[key] = compiled
+    while len(_compiled_schemas) > _COMPILED_CACHE_SIZE:
+        _compiled_schemas.popitem(last=False)
+    return compiled
+
+
+def parse_schema_into_tasks(schema: Dict[str, Any]) -> List[ExtractionTask]:
+    return list(compile_schema(schema).tasks)
 
-        if field_type == "object":
-            # Recurse into nested object
-            child_required = field_schema.get("required", [])
-            tasks.extend(parse_json_schema(field_schema, full_path, child_required))
-        elif field_type == "array":
-            # Recurse into array items if they are objects
-            item_schema = field_schema.get("items", {})
-            item_type = item_schema.get("type", "object")
-            if item_type == "object":
-                child_required = item_schema.get("required", [])
-                tasks.extend(parse_json_schema(item_schema, full_path + "[]", child_required))
-            else:
-                tasks.append(
-                    ExtractionTask(
-                        field_path=full_path + "[]",
-                        field_type=item_type,
-                        required=is_required,
-                        enum=enum_values,
-                        description=description,
-                    )
-                )
-        else:
-            tasks.append(
-                ExtractionTask(
-                    field_path=full_path,
-                    field_type=field_type,
-                    required=is_required,
-                    enum=enum_values,
-                    description=description,
-                )
-            )
 
-    return tasks
+parse_schema_to_tasks = parse_schema_into_tasks
 
 # --- Example CLI runner for quick testing ---
 if __name__ == "__main__":
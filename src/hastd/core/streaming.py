@@ -0,0 +1,260 @@
+import json
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+class IncrementalJSONObjectParser:
+    """
+    An incremental parser for a single top-level JSON object arriving in pieces
+    (e.g. from an LLM token stream).
+
+    Each top-level key/value pair is emitted as soon as its value is closed, so
+    callers can act on a field long before the whole object has been generated.
+    Any text before the opening brace (markdown fences, chatter) is ignored.
+    """
+
+    _WHITESPACE = " \t\r\n"
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._state = "seek_object"
+        self._key: Optional[str] = None
+        self._token_start = 0
+        self._in_string = False
+        self._escaped = False
+        self._depth = 0
+        self.done = False
+        self.malformed: List[str] = []
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        """
+        Append a piece of text and return the key/value pairs it completed.
+        """
+        if self.done or not text:
+            return []
+        self._buffer += text
+        completed = []
+
+        while self._pos < len(self._buffer) and not self.done:
+            char = self._buffer[self._pos]
+            state = self._state
+
+            if state == "seek_object":
+                if char == "{":
+                    self._state = "expect_key"
+
+            elif state == "expect_key":
+                if char == '"':
+                    self._token_start = self._pos
+                    self._state = "key"
+                elif char == "}":
+                    self.done = True
+
+            elif state == "key":
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._key = json.loads(self._buffer[self._token_start:self._pos + 1])
+                    self._state = "expect_colon"
+
+            elif state == "expect_colon":
+                if char == ":":
+                    self._state = "expect_value"
+
+            elif state == "expect_value":
+                if char not in self._WHITESPACE:
+                    self._token_start = self._pos
+                    if char == '"':
+                        self._state = "string_value"
+                    elif char in "{[":
+                        self._depth = 1
+                        self._in_string = False
+                        self._state = "container_value"
+                    else:
+                        self._state = "scalar_value"
+
+            elif state == "string_value":
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._emit(self._pos + 1, completed)
+
+            elif state == "container_value":
+                if self._in_string:
+                    if self._escaped:
+                        self._escaped = False
+                    elif char == "\\":
+                        self._escaped = True
+                    elif char == '"':
+                        self._in_string = False
+                elif char == '"':
+                    self._in_string = True
+                elif char in "{[":
+                    self._depth += 1
+                elif char in "}]":
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._emit(self._pos + 1, completed)
+
+            elif state == "scalar_value":
+                if char in ",}" or char in self._WHITESPACE:
+                    self._emit(self._pos, completed)
+                    # Re-read the terminator so a closing brace ends the object.
+                    continue
+
+            self._pos += 1
+
+        return completed
+
+    def _emit(self, end: int, completed: List[Tuple[str, Any]]):
+        raw = self._buffer[self._token_start:end]
+        try:
+            completed.append((self._key, json.loads(raw)))
+        except json.JSONDecodeError:
+            self.malformed.append(self._key)
+        self._key = None
+        self._state = "expect_key"
+
+
+class StreamedExtraction:
+    """
+    The outcome of a streamed multi-field extraction.
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.committed: Dict[str, Any] = {}
+        self.errors: Dict[str, str] = {}
+        self.raw_text = ""
+        self.message = None
+        self.cancelled_early = False
+        self.time_to_first_field: Optional[float] = None
+        self.elapsed: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "fields": self.fields,
+            "committed": sorted(self.committed),
+            "errors": self.errors,
+            "cancelled_early": self.cancelled_early,
+            "time_to_first_field": self.time_to_first_field,
+            "elapsed": self.elapsed,
+        }
+
+
+def _chunk_text(chunk: Any) -> str:
+    content = getattr(chunk, "content", chunk)
+    if isinstance(content, str):
+        return content
+    # Some providers stream content as a list of typed blocks.
+    return "".join(
+        block.get("text", "") if isinstance(block, dict) else str(block)
+        for block in content or []
+    )
+
+
+def consume_field_stream(
+    chunks: Iterable[Any],
+    field_names: Iterable[str],
+    validate_field: Optional[Callable[[str, Any], Optional[str]]] = None,
+    on_field: Optional[Callable[[str, Any], None]] = None,
+    wait_for_usage: bool = False,
+) -> StreamedExtraction:
+    """
+    Consumes an LLM token stream, committing each requested field as soon as
+    its key/value pair closes and stopping once every field has arrived.
+
+    Args:
+        chunks: An iterable of message chunks (or plain strings), e.g. ``llm.stream(...)``.
+        field_names: The top-level keys the model was asked to return.
+        validate_field: Optional callback returning an error message for an
+            invalid value, or None when the value is acceptable.
+        on_field: Optional callback invoked for every committed (valid) field.
+        wait_for_usage: Keep reading (and discarding content) after the last
+            requested field until a chunk carrying `usage_metadata` arrives,
+            instead of cancelling the stream. Providers such as OpenAI only
+            report token usage, including cached prompt tokens, in that
+            trailing chunk. Streams of messages whose JSON object has already
+            closed are always read on to it.
+
+    Returns:
+        A StreamedExtraction holding every received value, the subset that
+        passed validation and per-field errors.
+    """
+    wanted = set(field_names)
+    parser = IncrementalJSONObjectParser()
+    result = StreamedExtraction()
+    started = time.perf_counter()
+
+    iterator = iter(chunks)
+    complete = False
+    try:
+        for chunk in iterator:
+            if complete:
+                # Fields are all in; only the usage report is still wanted.
+                if getattr(chunk, "usage_metadata", None):
+                    result.message = chunk if result.message is None else result.message + chunk
+                    break
+                continue
+            if hasattr(chunk, "content"):
+                result.message = chunk if result.message is None else result.message + chunk
+            text = _chunk_text(chunk)
+            result.raw_text += text
+
+            for key, value in parser.feed(text):
+                if key in result.fields:
+                    continue
+                result.fields[key] = value
+                if result.time_to_first_field is None:
+                    result.time_to_first_field = time.perf_counter() - started
+
+                error = validate_field(key, value) if validate_field else None
+                if error:
+                    result.errors[key] = error
+                    continue
+                result.committed[key] = value
+                if on_field:
+                    on_field(key, value)
+
+            finished = parser.done or (wanted and wanted.issubset(result.fields))
+            if not finished:
+                continue
+            # Once the object has closed generation is over, so waiting for the
+            # usage chunk is free; otherwise only wait when asked to.
+            drain = wait_for_usage or (parser.done and result.message is not None)
+            if drain and not getattr(result.message, "usage_metadata", None):
+                complete = True
+                continue
+            if not parser.done:
+                # Everything we asked for is in; stop paying for the rest.
+                result.cancelled_early = True
+            break
+    finally:
+        # Closing the generator tears down the provider's streaming request.
+        close = getattr(iterator, "close", None)
+        if close:
+            close()
+
+    if not result.fields:
+        # The model may have produced something the incremental parser could
+        # not follow; give the complete text one last chance.
+        try:
+            parsed = json.loads(result.raw_text)
+        except json.JSONDecodeError:
+            parsed = None
+        if isinstance(parsed, dict):
+            for key, value in parsed.items():
+                result.fields[key] = value
+                error = validate_field(key, value) if validate_field else None
+                if error:
+                    result.errors[key] = error
+                else:
+                    result.committed[key] = value
+
+    result.elapsed = time.perf_counter() - started
+    return result
@@ -1,5 +1,7 @@
-from typing import List, Dict, Tuple
-import networkx as nx
+from typing import TYPE_CHECKING, List, Dict, Tuple
+
+if TYPE_CHECKING:
+    import networkx as nx
 
 
 class TaskDAGBuilder:
@@ -12,10 +14,13 @@ class TaskDAGBuilder:
         """
         :param tasks: List of tasks returned by the schema parser. Each task must have a 'field_path'.
         """
+        # networkx is imported on first use rather than when hastd.core is imported.
+        import networkx as nx
+
         self.tasks = tasks
         self.graph = nx.DiGraph()
 
-    def build(self) -> nx.DiGraph:
+    def build(self) -> "nx.DiGraph":
         """
         Constructs a DAG where each node is a field path, and edges represent parent-child nesting.
         """
@@ -41,6 +46,8 @@ class TaskDAGBuilder:
         """
         Returns an ordered list of task keys based on topological sort of the DAG.
         """
+        import networkx as nx
+
         return list(nx.topological_sort(self.graph))
 
 
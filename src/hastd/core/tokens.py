@@ -0,0 +1,27 @@
+import re
+from typing import Any
+
+# Rough characters-per-token ratio for English text on GPT/Claude tokenizers.
+CHARS_PER_TOKEN = 4
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: Any) -> int:
+    """
+    Cheaply estimate the number of tokens in a prompt without loading a tokenizer.
+    Accepts a string, a LangChain message, or a list of either.
+    """
+    if text is None:
+        return 0
+    if isinstance(text, (list, tuple)):
+        return sum(estimate_tokens(item) for item in text)
+    if not isinstance(text, str):
+        text = getattr(text, "content", str(text))
+        if not isinstance(text, str):
+            text = str(text)
+    if not text:
+        return 0
+    # Word-piece count underestimates long words, char ratio underestimates
+    # punctuation-heavy text; the larger of the two is a safe budget.
+    return max(len(text) // CHARS_PER_TOKEN, len(_WORD_RE.findall(text)))
@@ -0,0 +1,88 @@
+import json
+import re
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.messages import AIMessage  # noqa: E402
+
+import run_poc  # noqa: E402
+from hastd.core.assembly import group_array_tasks  # noqa: E402
+from hastd.core.schema_parser import parse_schema_into_tasks  # noqa: E402
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "lines": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"name": {"type": "string"}, "price": {"type": "number"}},
+                "required": ["name", "price"],
+            },
+        }
+    },
+}
+
+DOCUMENT = "Order lines:\nAlpha widget, price 3.5\nBeta gadget, price 7\nGamma gizmo, price 12\nThanks!"
+PRICES = {"Alpha": 3.5, "Beta": 7, "Gamma": 12}
+
+
+class ItemsLLM:
+    """
+    Enumerates the three order lines and extracts each excerpt's item. Beta's
+    price comes back invalid unless the prompt carries its validation error;
+    the batch holding Alpha answers last.
+    """
+
+    model_name = "fake-items"
+    rate_limited = False
+
+    def __init__(self):
+        self.prompts = []
+        self.lock = threading.Lock()
+
+    def invoke(self, messages, **kwargs):
+        text = messages[-1].content
+        with self.lock:
+            self.prompts.append(text)
+        if "<opening words>" in text:
+            return AIMessage(content=json.dumps({"items": ["Alpha widget", "Beta gadget", "Gamma gizmo"]}))
+
+        names = re.findall(r"^\[\d+\] (\w+)", text.split("EXCERPTS")[1], re.MULTILINE)
+        if "Alpha" in names:
+            time.sleep(0.05)
+        items = []
+        for name in names:
+            fixed = "VALIDATION ERRORS" in text and "cheap" in text
+            price = "cheap" if name == "Beta" and not fixed else PRICES[name]
+            items.append({"name": name, "price": price})
+        return AIMessage(content=json.dumps({"items": items}))
+
+
+def test_array_group_enumerates_batches_and_corrects_failed_items(monkeypatch):
+    llm = ItemsLLM()
+    monkeypatch.setattr(run_poc, "get_extractor_llm", lambda: llm)
+    monkeypatch.setattr(run_poc, "ITEM_BATCH_SIZE", 2)
+    _, (group,) = group_array_tasks(parse_schema_into_tasks(SCHEMA))
+
+    items, usage = run_poc.extract_array_group(run_poc.prepare_document(DOCUMENT), group)
+
+    # Items come back in document order, whichever batch finished first.
+    assert items == [
+        {"name": "Alpha", "price": 3.5},
+        {"name": "Beta", "price": 7},
+        {"name": "Gamma", "price": 12},
+    ]
+    assert [record["template"] for record in usage] == [
+        "enumerate_items@v1", "extract_items@v1", "extract_items@v1", "correct_items@v1",
+    ]
+    # Only the failed item is retried, with its previous output and error.
+    retry = llm.prompts[-1]
+    excerpts = retry.split("EXCERPTS")[1]
+    assert re.findall(r"^\[\d+\] (\w+)", excerpts, re.MULTILINE) == ["Beta"]
+    assert 'PREVIOUS OUTPUT: {"name": "Beta", "price": "cheap"}' in excerpts
+    assert "Input should be a valid number" in excerpts
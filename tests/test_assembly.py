@@ -0,0 +1,60 @@
+from hastd.core.assembly import AssemblyPlan, group_array_tasks, locate_item_spans
+from hastd.core.schema_parser import parse_json_schema
+
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "author": {"type": "object", "properties": {"name": {"type": "string"}}},
+        "tags": {"type": "array", "items": {"type": "string"}},
+        "references": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["title"],
+                "properties": {"title": {"type": "string"}, "year": {"type": "integer"}},
+            },
+        },
+    },
+}
+
+
+def test_groups_array_of_object_fields_into_items():
+    field_tasks, groups = group_array_tasks(parse_json_schema(SCHEMA))
+
+    assert sorted(task.field_path for task in field_tasks) == ["author.name", "tags[]", "title"]
+    assert [group.path for group in groups] == ["references"]
+    assert sorted(groups[0].item_fields) == ["title", "year"]
+
+    item_schema = groups[0].item_schema
+    assert item_schema["properties"]["year"]["type"] == "integer"
+    assert item_schema["required"] == ["title"]
+
+
+def test_assembly_plan_builds_nested_output():
+    plan = AssemblyPlan(["title", "author.name", "tags[]", "references"])
+
+    output = plan.assemble({
+        "title": "Doc",
+        "author.name": "Jane",
+        "tags[]": ["a", "b"],
+        "references": [{"title": "R1", "year": 2001}, {"title": "R2", "year": 2002}],
+    })
+
+    assert output == {
+        "title": "Doc",
+        "author": {"name": "Jane"},
+        "tags": ["a", "b"],
+        "references": [{"title": "R1", "year": 2001}, {"title": "R2", "year": 2002}],
+    }
+
+
+def test_locates_item_spans_from_opening_words():
+    text = "References: Smith J. Deep things. 2001. Doe A.   Shallow things. 2002. The end."
+
+    spans = locate_item_spans(text, ["Smith J. Deep", "doe a. shallow", "not in the text"])
+
+    assert [text[start:end] for start, end in spans][0] == "Smith J. Deep things. 2001. "
+    assert text[spans[1][0]:].startswith("Doe A.")
+    assert len(spans) == 2
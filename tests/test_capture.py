@@ -0,0 +1,155 @@
+import pytest
+
+from hastd.core.capture import (
+    RecordingLLM,
+    ReplayLLM,
+    ReplayMiss,
+    StageProfile,
+    TrafficRecorder,
+    capture_request,
+    instrument_node,
+    load_capture,
+    set_stage_profile,
+)
+from hastd.core.governor import LLMGovernor
+from hastd.core.streaming import consume_field_stream
+
+
+class FakeMessage:
+    def __init__(self, content, usage_metadata=None):
+        self.content = content
+        self.usage_metadata = usage_metadata
+        self.response_metadata = {}
+
+    def __add__(self, other):
+        return FakeMessage(self.content + other.content, other.usage_metadata or self.usage_metadata)
+
+
+class FakeLLM:
+    model_name = "fake-model"
+
+    def invoke(self, prompt):
+        return FakeMessage('{"fixed": true}', {"input_tokens": 10, "output_tokens": 3})
+
+    def stream(self, prompt):
+        yield FakeMessage('{"name": "Ja')
+        yield FakeMessage('ne", "age": 41, ')
+        yield FakeMessage('"notes": "not requested"}', {"input_tokens": 20, "output_tokens": 8})
+
+
+def run_request(llm, prompt="extract", document="doc"):
+    extract = instrument_node("extract", lambda: consume_field_stream(llm.stream(prompt), ["name", "age"]))
+    correct = instrument_node("correct", lambda: llm.invoke(prompt + " correct"))
+    with capture_request(document, {"type": "object"}, f"hash-{document}", "schema") as context:
+        return extract(), correct(), context
+
+
+@pytest.fixture
+def capture(tmp_path, monkeypatch):
+    path = tmp_path / "capture.jsonl"
+    recorder = TrafficRecorder(path)
+    monkeypatch.setattr("hastd.core.capture.get_recorder", lambda: recorder)
+    run_request(RecordingLLM(FakeLLM(), recorder))
+    recorder.close()
+    monkeypatch.setattr("hastd.core.capture.get_recorder", lambda: None)
+    return load_capture(path)
+
+
+def test_records_requests_llm_calls_and_stages(capture):
+    (request,) = capture["request"]
+    (response,) = capture["response"]
+    streamed, invoked = capture["llm"]
+
+    assert request["document_text"] == "doc" and request["schema_hash"] == "schema"
+    assert [stage["node"] for stage in response["stages"]] == ["extract", "correct"]
+    # The stream was closed as soon as both fields had arrived.
+    assert streamed["node"] == "extract" and streamed["closed_early"]
+    assert streamed["chunks"] == ['{"name": "Ja', 'ne", "age": 41, ']
+    assert invoked["node"] == "correct" and invoked["usage_metadata"]["output_tokens"] == 3
+
+
+def test_replays_recorded_responses_by_prompt_then_position(capture):
+    replay = ReplayLLM(capture["llm"])
+    profile = StageProfile()
+    set_stage_profile(profile)
+    try:
+        streamed, corrected, _ = run_request(replay)
+        # A changed prompt still finds the call recorded at the same position.
+        _, changed, _ = run_request(replay, prompt="extract v2")
+    finally:
+        set_stage_profile(None)
+
+    assert streamed.fields == {"name": "Jane", "age": 41}
+    assert corrected.content == changed.content == '{"fixed": true}'
+    assert replay.stats == {"prompt_hits": 2, "position_hits": 2, "misses": 0}
+    assert profile.summary()["extract"]["count"] == 2
+
+    with pytest.raises(ReplayMiss):
+        run_request(replay, prompt="other", document="unknown")
+
+
+def test_realtime_replay_reproduces_recorded_latency(capture):
+    sleeps = []
+    replay = ReplayLLM(capture["llm"], realtime=True, sleep=sleeps.append)
+
+    run_request(replay)
+
+    recorded = sum(record["elapsed_s"] for record in capture["llm"])
+    assert sum(sleeps) == pytest.approx(recorded)
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class FlakyLLM(FakeLLM):
+    """
+    Rate limits the first call it gets.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def invoke(self, prompt):
+        self.calls += 1
+        if self.calls == 1:
+            raise RateLimitError()
+        return super().invoke(prompt)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_governor_queueing_is_recorded_and_replayed(tmp_path, monkeypatch):
+    path = tmp_path / "capture.jsonl"
+    recorder = TrafficRecorder(path)
+    monkeypatch.setattr("hastd.core.capture.get_recorder", lambda: recorder)
+    clock = FakeClock()
+    governor = LLMGovernor(clock=clock, sleep=clock.sleep, rng=lambda: 1.0, base_delay=2.0)
+    llm = RecordingLLM(FlakyLLM(), recorder)
+
+    with capture_request("doc", {"type": "object"}, "hash-doc", "schema"):
+        governor.invoke(llm, "extract")
+        list(governor.stream(llm, "extract"))
+    llm.invoke("ungoverned")
+    recorder.close()
+    monkeypatch.setattr("hastd.core.capture.get_recorder", lambda: None)
+    backed_off, streamed, ungoverned = load_capture(path)["llm"]
+
+    # The retry backoff counts as queueing of the call that was finally sent.
+    assert backed_off["queued_s"] == 2.0
+    assert streamed["queued_s"] == 0.0
+    assert ungoverned["queued_s"] is None
+
+    sleeps = []
+    replay = ReplayLLM([backed_off], realtime=True, sleep=sleeps.append)
+    replay.invoke("extract")
+    assert sum(sleeps) == pytest.approx(2.0 + backed_off["elapsed_s"])
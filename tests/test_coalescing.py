@@ -0,0 +1,52 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from hastd.core.coalescing import InFlightCoalescer, fingerprint_schema
+
+
+def test_concurrent_identical_work_runs_once():
+    coalescer = InFlightCoalescer()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        release.wait(timeout=5)
+        return {"name": "Jane"}
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(coalescer.run, "doc", work) for _ in range(4)]
+        deadline = time.monotonic() + 5
+        try:
+            while coalescer.followers < 3:
+                assert time.monotonic() < deadline, f"only {coalescer.followers} followers joined"
+                assert not any(f.done() for f in futures), "a worker finished before release"
+                time.sleep(0.001)
+        finally:
+            release.set()
+        results = [f.result(timeout=5) for f in futures]
+
+    assert len(calls) == 1
+    assert all(r == {"name": "Jane"} for r in results)
+    assert coalescer.in_flight() == 0
+
+
+def test_failures_are_shared_and_not_cached():
+    coalescer = InFlightCoalescer()
+
+    def boom():
+        raise ValueError("provider down")
+
+    with pytest.raises(ValueError):
+        coalescer.run("doc", boom)
+    assert coalescer.run("doc", lambda: "ok") == "ok"
+
+
+def test_schema_fingerprint_ignores_key_order():
+    a = {"type": "object", "properties": {"name": {"type": "string"}}}
+    b = {"properties": {"name": {"type": "string"}}, "type": "object"}
+
+    assert fingerprint_schema(a) == fingerprint_schema(b)
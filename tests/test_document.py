@@ -0,0 +1,51 @@
+import pytest
+
+from hastd.core.chunker import TextChunker
+from hastd.core.document import PreparedDocument, _locate_chunks, prepare_document
+
+sample_text = """
+Invoice INV-001 was issued to Acme Corp.   The total due is $1,200.
+Payment is expected by 2024-05-01. Contact billing@acme.com with questions!
+"""
+
+
+def test_prepare_document_offsets_and_sentences():
+    document = prepare_document(sample_text, chunker=TextChunker(chunk_size=60, chunk_overlap=10))
+
+    assert document.text.startswith("Invoice INV-001")
+    assert len(document.chunks) > 1
+    for chunk in document.chunks:
+        assert document.text[chunk.start:chunk.end] == chunk.text
+    assert document.sentence_texts()[-1] == "Contact billing@acme.com with questions!"
+    assert document.token_count > 0
+
+
+def test_prepare_document_keeps_line_structure():
+    document = prepare_document("Name:\u00a0 Jane\tDoe  \n\n\n\nAddress:  1 Main St\r\nSpringfield\n")
+
+    assert document.text == "Name: Jane Doe\n\nAddress: 1 Main St\nSpringfield"
+
+
+def test_locate_chunks_rejects_pieces_missing_from_the_text():
+    chunks = _locate_chunks("alpha beta gamma", ["alpha beta", "beta gamma"])
+    assert [(chunk.start, chunk.end) for chunk in chunks] == [(0, 10), (6, 16)]
+
+    with pytest.raises(ValueError):
+        _locate_chunks("alpha beta gamma", ["alpha", "delta"])
+
+
+def test_search_builds_index_lazily():
+    document = prepare_document(sample_text, chunker=TextChunker(chunk_size=60, chunk_overlap=10))
+
+    assert "term_index" not in document.__dict__
+    best = document.search("when is payment expected", k=1)[0]
+    assert "Payment is expected" in best.text
+
+
+def test_prepared_document_round_trips_through_disk_cache(tmp_path):
+    first = prepare_document(sample_text, cache_dir=tmp_path)
+    cached = list(tmp_path.iterdir())
+
+    assert len(cached) == 1
+    assert PreparedDocument.load(cached[0]) == first
+    assert prepare_document(sample_text, cache_dir=tmp_path) == first
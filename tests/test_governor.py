@@ -0,0 +1,176 @@
+import json
+import threading
+import time
+
+import pytest
+
+import hastd.core.governor as governor_module
+from hastd.core.governor import (
+    LLMGovernor,
+    ModelLimits,
+    Priority,
+    RateLimitExceeded,
+    TokenBucket,
+    get_governor,
+    load_model_limits_from_env,
+)
+from hastd.core.tokens import estimate_tokens
+
+
+# ----- A local fake provider that rate limits its first calls -----
+class FakeRateLimitError(Exception):
+    status_code = 429
+
+
+class FakeMessage:
+    def __init__(self, content):
+        self.content = content
+        self.usage_metadata = {"total_tokens": 10}
+
+
+class FakeProvider:
+    model_name = "fake-model"
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.calls = 0
+
+    def invoke(self, prompt, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise FakeRateLimitError("slow down")
+        return FakeMessage(f"echo: {prompt}")
+
+    def stream(self, prompt, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise FakeRateLimitError("slow down")
+        for piece in ["a", "b", "c"]:
+            yield piece
+
+
+def make_governor(**kwargs):
+    sleeps = []
+    governor = LLMGovernor(sleep=sleeps.append, rng=lambda: 1.0, **kwargs)
+    return governor, sleeps
+
+
+def test_retries_rate_limits_with_backoff():
+    governor, sleeps = make_governor(base_delay=0.5)
+    provider = FakeProvider(failures=2)
+
+    result = governor.invoke(provider, "hello")
+
+    assert result.content == "echo: hello"
+    assert provider.calls == 3
+    assert sleeps == [0.5, 1.0]
+
+
+def test_rate_limits_halve_concurrency():
+    governor, _ = make_governor(default_limits=ModelLimits(max_concurrency=8))
+
+    governor.invoke(FakeProvider(failures=2), "hello")
+
+    assert governor.concurrency_limit("fake-model") == 2
+
+
+def test_raises_after_exhausting_retries():
+    governor, sleeps = make_governor(max_retries=2)
+
+    with pytest.raises(RateLimitExceeded):
+        governor.invoke(FakeProvider(failures=10), "hello")
+    assert len(sleeps) == 2
+
+
+def test_stream_retries_before_first_chunk():
+    governor, _ = make_governor()
+
+    assert list(governor.stream(FakeProvider(failures=1), "hello")) == ["a", "b", "c"]
+
+
+class FakeChunk:
+    def __init__(self, content, usage_metadata=None):
+        self.content = content
+        self.usage_metadata = usage_metadata
+
+
+class UsageStreamProvider:
+    model_name = "fake-model"
+
+    def stream(self, prompt, **kwargs):
+        yield FakeChunk('{"name": "Jane"}')
+        yield FakeChunk("", {"input_tokens": 900, "output_tokens": 100, "total_tokens": 1000})
+
+
+def test_stream_corrects_token_estimate_from_reported_usage():
+    prompt = "extract the name " * 20
+    governor, _ = make_governor(clock=lambda: 0.0, default_limits=ModelLimits(tokens_per_minute=30_000))
+
+    list(governor.stream(UsageStreamProvider(), prompt))
+    assert governor._state("fake-model").tokens.level == 30_000 - 1000
+
+    # A stream closed before its usage chunk keeps the estimate.
+    governor, _ = make_governor(clock=lambda: 0.0, default_limits=ModelLimits(tokens_per_minute=30_000))
+    stream = governor.stream(UsageStreamProvider(), prompt)
+    next(stream)
+    stream.close()
+    assert governor._state("fake-model").tokens.level == 30_000 - estimate_tokens(prompt)
+    assert governor._state("fake-model").in_flight == 0
+
+
+def test_limits_are_read_from_env_json_or_file(monkeypatch, tmp_path):
+    config = {"gpt-4o": {"requests_per_minute": 5000, "tokens_per_minute": 800_000},
+              "default": {"tokens_per_minute": 60_000}}
+    monkeypatch.setenv("HASTD_MODEL_LIMITS", json.dumps(config))
+    limits, default = load_model_limits_from_env()
+    assert limits["gpt-4o"].tokens_per_minute == 800_000 and default.tokens_per_minute == 60_000
+
+    path = tmp_path / "limits.json"
+    path.write_text(json.dumps(config))
+    monkeypatch.setenv("HASTD_MODEL_LIMITS", str(path))
+    monkeypatch.setattr(governor_module, "_default_governor", None)
+    governor = get_governor()
+    assert governor.limits["gpt-4o"].requests_per_minute == 5000
+    assert governor._state("other-model").limits.tokens_per_minute == 60_000
+
+    monkeypatch.setenv("HASTD_MODEL_LIMITS", '{"gpt-4o": {"rpm": 5}}')
+    with pytest.raises(ValueError):
+        load_model_limits_from_env()
+
+
+def test_token_bucket_refills_over_time():
+    now = [0.0]
+    bucket = TokenBucket(rate_per_minute=60, clock=lambda: now[0])
+
+    bucket.take(60)
+    assert bucket.wait_time(6) == pytest.approx(6.0)
+
+    now[0] = 6.0
+    assert bucket.wait_time(6) == 0.0
+
+
+def test_interactive_calls_jump_the_batch_queue():
+    governor = LLMGovernor(default_limits=ModelLimits(max_concurrency=1, min_concurrency=1))
+    order = []
+
+    governor.acquire("m")
+
+    def worker(priority, label):
+        governor.acquire("m", priority)
+        order.append(label)
+        governor.release("m", latency=0.01)
+
+    batch = threading.Thread(target=worker, args=(Priority.BATCH, "batch"))
+    batch.start()
+    while len(governor._state("m").waiters) < 1:
+        time.sleep(0.001)
+    interactive = threading.Thread(target=worker, args=(Priority.INTERACTIVE, "interactive"))
+    interactive.start()
+    while len(governor._state("m").waiters) < 2:
+        time.sleep(0.001)
+
+    governor.release("m", latency=0.01)
+    batch.join(timeout=5)
+    interactive.join(timeout=5)
+
+    assert order == ["interactive", "batch"]
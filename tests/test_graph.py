@@ -0,0 +1,196 @@
+import json
+
+import pytest
+
+pytest.importorskip("langgraph")
+pytest.importorskip("fastapi")
+
+from langchain_core.messages import AIMessage, AIMessageChunk  # noqa: E402
+
+import api.main as api  # noqa: E402
+import run_poc  # noqa: E402
+
+SCHEMA = {
+    "type": "object",
+    "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
+    "required": ["name"],
+}
+
+
+class FakeChatModel:
+    """
+    Streams a fixed JSON completion in small chunks, followed by a usage-only
+    chunk like OpenAI's `stream_usage`, and answers `invoke` with `reply`.
+    """
+
+    model_name = "fake-chat"
+
+    def __init__(self, completion, reply=None, usage=None):
+        self.completion = completion
+        self.reply = reply
+        self.usage = usage or {"input_tokens": 1200, "output_tokens": 20, "total_tokens": 1220,
+                               "input_token_details": {"cache_read": 1024}}
+        self.prompts = []
+        self.streamed_to_end = False
+
+    def stream(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        for start in range(0, len(self.completion), 7):
+            yield AIMessageChunk(content=self.completion[start:start + 7])
+        yield AIMessageChunk(content="", usage_metadata=self.usage)
+        self.streamed_to_end = True
+
+    def invoke(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        return AIMessage(content=self.reply or self.completion, usage_metadata=self.usage)
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    def install(llm):
+        monkeypatch.setattr(api, "get_llm", lambda: llm)
+        monkeypatch.setattr(api, "get_extractor_llm", lambda: llm)
+        monkeypatch.setattr(api, "get_layout_index", lambda: None)
+        monkeypatch.setattr(api, "get_result_store", lambda: None)
+        return llm
+
+    return install
+
+
+class FakeLayoutIndex:
+    """
+    Prefills fixed field paths and records what the run taught it.
+    """
+
+    def __init__(self, prefilled):
+        self.prefilled = prefilled
+        self.updates = []
+
+    def signature(self, document):
+        return None
+
+    def prefill(self, document, schema_hash, tasks, signature=None):
+        return dict(self.prefilled)
+
+    def update(self, document, schema_hash, values, prefilled=None, signature=None):
+        self.updates.append((values, prefilled))
+
+
+def test_api_graph_runs_end_to_end(fake_api):
+    fake_api(FakeChatModel(json.dumps({"name": "Jane Doe", "age": 41})))
+
+    result = api.run_extraction("Jane Doe is 41 years old.", SCHEMA)
+
+    assert result["errors"] is None
+    assert result["extracted_data"] == {"name": "Jane Doe", "age": 41}
+    assert set(result["confidence_scores"]) == {"name", "age"}
+    # The object closed, so the trailing usage chunk was read for free.
+    (extract,) = result["prompt_cache"]["by_template"].values()
+    assert extract["input_tokens"] == 1200 and extract["cached_tokens"] == 1024
+    assert extract["estimated_calls"] == 0
+
+
+RAMBLING = json.dumps({"name": "Jane Doe", "age": 41, "notes": "The model keeps generating " * 20})
+
+
+def test_api_graph_cancels_the_stream_after_the_last_field(fake_api):
+    llm = fake_api(FakeChatModel(RAMBLING))
+
+    result = api.run_extraction("Jane Doe is 41 years old.", SCHEMA)
+
+    assert result["extracted_data"] == {"name": "Jane Doe", "age": 41}
+    assert result["stream_stats"]["cancelled_early"]
+    assert not llm.streamed_to_end
+    # Usage never arrived, so input tokens are estimated and cache hits unknown.
+    report = result["prompt_cache"]
+    assert report["estimated_calls"] == 1 and report["input_tokens"] > 0
+    assert report["cached_tokens"] == 0 and report["cached_ratio"] == 0.0
+
+
+def test_api_graph_reads_stream_usage_when_asked(fake_api, monkeypatch):
+    monkeypatch.setenv("HASTD_STREAM_USAGE", "1")
+    fake_api(FakeChatModel(RAMBLING))
+
+    result = api.run_extraction("Jane Doe is 41 years old.", SCHEMA)
+
+    assert not result["stream_stats"]["cancelled_early"]
+    assert result["prompt_cache"]["cached_tokens"] == 1024
+
+
+def test_api_graph_corrects_invalid_output(fake_api):
+    llm = fake_api(FakeChatModel(json.dumps({"name": "Jane Doe", "age": "forty-one"}),
+                                 reply=json.dumps({"name": "Jane Doe", "age": 41})))
+
+    result = api.run_extraction("Jane Doe is 41 years old.", SCHEMA)
+
+    assert result["errors"] is None
+    assert result["extracted_data"] == {"name": "Jane Doe", "age": 41}
+    assert len(llm.prompts) == 2
+
+
+NESTED_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "author": {
+            "type": "object",
+            "properties": {"id": {"type": "integer"}, "email": {"type": "string"}},
+            "required": ["id", "email"],
+        },
+        "age": {"type": "integer"},
+    },
+    "required": ["author"],
+}
+
+
+def test_api_graph_merges_nested_prefill_by_path(fake_api, monkeypatch):
+    llm = fake_api(FakeChatModel(json.dumps({"author": {"id": 7}, "age": 41})))
+    index = FakeLayoutIndex({"author.email": "jane@example.com"})
+    monkeypatch.setattr(api, "get_layout_index", lambda: index)
+
+    result = api.run_extraction("Author 7 (jane@example.com), aged 41.", NESTED_SCHEMA)
+
+    assert result["errors"] is None
+    assert result["extracted_data"] == {"author": {"id": 7, "email": "jane@example.com"}, "age": 41}
+    assert result["template_fields"] == ["author.email"]
+    # The anchored value reaches the index as the final value, not as a miss.
+    ((values, prefilled),) = index.updates
+    assert values["author.email"] == prefilled["author.email"] == "jane@example.com"
+    assert len(llm.prompts) == 1
+
+
+def test_api_graph_corrects_only_failing_prefilled_paths(fake_api, monkeypatch):
+    llm = fake_api(FakeChatModel("", reply=json.dumps({"age": 41})))
+    index = FakeLayoutIndex({"author.id": 7, "author.email": "jane@example.com", "age": "forty-one"})
+    monkeypatch.setattr(api, "get_layout_index", lambda: index)
+
+    result = api.run_extraction("Author 7 (jane@example.com), aged 41.", NESTED_SCHEMA)
+
+    assert result["errors"] is None
+    assert result["extracted_data"] == {"author": {"id": 7, "email": "jane@example.com"}, "age": 41}
+    (correction,) = llm.prompts
+    sent = correction[-1].content.split("Extracted:")[1].split("Errors:")[0]
+    assert json.loads(sent) == {"age": "forty-one"}
+
+
+def test_poc_graph_runs_end_to_end(monkeypatch):
+    llm = FakeChatModel("", reply=json.dumps({"name": "Jane Doe"}))
+    monkeypatch.setattr(run_poc, "get_llm", lambda: llm)
+    monkeypatch.setattr(run_poc, "get_extractor_llm", lambda: llm)
+    task = {"field_path": "author.name", "field_type": "string", "description": "Author", "required": True,
+            "enum": None}
+
+    state = run_poc.build_agentic_loop().invoke(
+        {
+            "document": run_poc.prepare_document("Written by Jane Doe."),
+            "task": task,
+            "final_json": {},
+            "max_attempts": 3,
+            "current_attempt": 0,
+            "prompt_usage": [],
+        },
+        config={"configurable": {"priority": run_poc.Priority.BATCH}},
+    )
+
+    assert state["errors"] is None
+    assert state["extracted_data"] == {"name": "Jane Doe"}
+    assert state["prompt_usage"][0]["cached_tokens"] == 1024
@@ -0,0 +1,106 @@
+from hastd.core.document import prepare_document
+from hastd.core.layout_index import _MAX_HASH, _MERSENNE_PRIME, LayoutIndex, MinHasher
+from hastd.core.schema_parser import parse_json_schema
+
+BOILERPLATE = (
+    "ACME Supplies Ltd. 12 Harbour Road, Springfield. Thank you for your business. "
+    "Payment is due within thirty days of the invoice date. Late payments incur a fee of two percent "
+    "per month. Please include the invoice number with your payment. Questions about this invoice "
+    "can be sent to billing at acme supplies. Goods remain our property until paid in full. "
+)
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "invoice_number": {"type": "string"},
+        "customer": {"type": "string"},
+        "total": {"type": "integer"},
+    },
+}
+
+
+def invoice(number, customer, total):
+    return prepare_document(
+        f"INVOICE Invoice number: {number} Bill to: {customer} Total due: {total} EUR. " + BOILERPLATE
+    )
+
+
+def values(number, customer, total):
+    return {"invoice_number": number, "customer": customer, "total": total}
+
+
+def test_minhash_signatures_match_the_reference_formula():
+    # Signatures are persisted, so the vectorized hashing must stay bit-identical.
+    hasher = MinHasher(num_perm=16)
+    hashes = [0, 1, 12345, 2 ** 31, _MAX_HASH] + list(range(7, 7 * MinHasher.BLOCK_SIZE, 7))
+
+    expected = tuple(
+        min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes) for a, b in hasher.permutations
+    )
+
+    assert hasher.signature(hashes) == expected
+    assert hasher.signature([]) == (_MAX_HASH,) * 16
+
+
+def test_matches_near_duplicate_layouts_only():
+    index = LayoutIndex()
+    layout_id = index.register(invoice("INV-001", "Globex", 120))
+
+    match = index.match(invoice("INV-002", "Initech", 75))
+    unrelated = prepare_document(
+        "Minutes of the board meeting. The board discussed the quarterly roadmap, hiring plans "
+        "and the budget for the new office. Action items were assigned to each department lead."
+    )
+
+    assert match is not None and match.layout_id == layout_id
+    assert match.similarity >= index.threshold
+    assert index.match(unrelated) is None
+
+
+def test_prefills_fields_from_anchors_learned_on_earlier_documents():
+    index = LayoutIndex()
+    tasks = parse_json_schema(SCHEMA)
+    index.update(invoice("INV-001", "Globex", 120), "schema", values("INV-001", "Globex", 120))
+
+    # A single document is not enough support to trust its anchors.
+    assert index.prefill(invoice("INV-002", "Initech", 75), "schema", tasks) == {}
+
+    index.update(invoice("INV-002", "Initech", 75), "schema", values("INV-002", "Initech", 75))
+
+    assert index.prefill(invoice("INV-003", "Umbrella Corp", 9400), "schema", tasks) == {
+        "invoice_number": "INV-003",
+        "customer": "Umbrella Corp",
+        "total": 9400,
+    }
+    assert index.prefill(invoice("INV-003", "Umbrella Corp", 9400), "other-schema", tasks) == {}
+
+
+def test_rejected_anchor_values_stop_being_applied():
+    index = LayoutIndex()
+    tasks = parse_json_schema(SCHEMA)
+    for number, customer, total in [("INV-001", "Globex", 120), ("INV-002", "Initech", 75)]:
+        index.update(invoice(number, customer, total), "schema", values(number, customer, total))
+
+    document = invoice("INV-003", "Hooli", 10)
+    prefilled = index.prefill(document, "schema", tasks)
+    for _ in range(3):
+        index.update(document, "schema", {**prefilled, "customer": "Hooli Inc."}, prefilled)
+
+    assert "customer" not in index.prefill(invoice("INV-004", "Stark", 5), "schema", tasks)
+
+
+def test_anchors_are_only_learned_from_unique_whole_token_values():
+    index = LayoutIndex()
+    document = prepare_document(
+        "ORDER 2024-0419 placed 2024-03-14. Quantity ordered: 4 units. Currency: EUR. "
+        "Ship to: Globex. Bill to: Globex. " + BOILERPLATE
+    )
+    layout_id = index.register(document)
+
+    index.learn(layout_id, "schema", document, {"quantity": 4, "currency": "EUR", "customer": "Globex"})
+
+    anchors = dict(index._db.execute("SELECT field_path, prefix FROM anchors").fetchall())
+    # "4" is anchored at the quantity, not inside "2024"; "Globex" occurs twice.
+    assert anchors["quantity"].endswith("Quantity ordered: ")
+    assert anchors["currency"].endswith("Currency: ")
+    assert "customer" not in anchors
@@ -0,0 +1,53 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+
+CORE_MODULES = [
+    "hastd.core.assembly",
+    "hastd.core.capture",
+    "hastd.core.chunker",
+    "hastd.core.coalescing",
+    "hastd.core.confidence",
+    "hastd.core.document",
+    "hastd.core.governor",
+    "hastd.core.layout_index",
+    "hastd.core.local_backend",
+    "hastd.core.models",
+    "hastd.core.prompts",
+    "hastd.core.result_store",
+    "hastd.core.schema_parser",
+    "hastd.core.streaming",
+    "hastd.core.task_dag",
+]
+
+HEAVY_MODULES = [
+    "langchain_core",
+    "langchain_text_splitters",
+    "langgraph",
+    "networkx",
+    "pydantic",
+    "torch",
+    "transformers",
+]
+
+
+def test_core_modules_defer_heavy_imports():
+    script = (
+        "import importlib, json, sys\n"
+        f"for name in {CORE_MODULES!r}:\n"
+        "    importlib.import_module(name)\n"
+        f"print(json.dumps(sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules)))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONPATH": str(SRC)},
+        check=True,
+    )
+
+    assert json.loads(result.stdout) == []
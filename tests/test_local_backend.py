@@ -0,0 +1,228 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from hastd.core.local_backend import LocalSLMExtractor, PrefixKVCache
+from hastd.core.prompts import get_template
+
+DOCUMENT = "DOCUMENT:\nJane Doe, 41, jane@example.com\n---\n"
+
+
+class CharTokenizer:
+    """
+    One token per character; id 0 is padding.
+    """
+
+    pad_token_id = 0
+
+    def __call__(self, text, add_special_tokens=True):
+        return {"input_ids": [ord(char) for char in text]}
+
+    def decode(self, tokens, skip_special_tokens=True):
+        return "".join(chr(int(token)) for token in tokens if int(token) != self.pad_token_id)
+
+
+class ChatTokenizer(CharTokenizer):
+    """
+    A CharTokenizer with a chat template; plain encoding adds a BOS token.
+    """
+
+    chat_template = "<fake>"
+
+    def __call__(self, text, add_special_tokens=True):
+        ids = super().__call__(text)["input_ids"]
+        return {"input_ids": ([1] if add_special_tokens else []) + ids}
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=False):
+        text = "\x01" + "".join(f"<|{m['role']}|>{m['content']}<|end|>" for m in messages)
+        return text + ("<|assistant|>" if add_generation_prompt else "")
+
+
+class FakeCache:
+    def __init__(self, length):
+        self.length = length
+        self.batch_size = 1
+
+    def batch_repeat_interleave(self, repeats):
+        self.batch_size *= repeats
+
+
+class FakeModel:
+    """
+    Answers every prompt with `reply` and records each generate call.
+    """
+
+    def __init__(self, torch, reply='{"ok": 1}'):
+        self.torch = torch
+        self.reply = reply
+        self.calls = []
+
+    def to(self, device):
+        return self
+
+    def eval(self):
+        return self
+
+    def __call__(self, input_ids, use_cache=True):
+        return SimpleNamespace(past_key_values=FakeCache(input_ids.shape[1]))
+
+    def generate(self, input_ids, attention_mask, max_new_tokens, past_key_values=None, **kwargs):
+        self.calls.append({"input_ids": input_ids.tolist(), "past_key_values": past_key_values})
+        reply = self.torch.tensor([ord(char) for char in self.reply][:max_new_tokens])
+        return self.torch.cat([input_ids, reply.repeat(input_ids.shape[0], 1)], dim=1)
+
+
+@pytest.fixture
+def make_extractor():
+    torch = pytest.importorskip("torch")
+    extractors = []
+
+    def make(tokenizer=None, **kwargs):
+        model = FakeModel(torch)
+        extractor = LocalSLMExtractor("fake-slm", tokenizer=tokenizer or CharTokenizer(), model=model, **kwargs)
+        extractors.append(extractor)
+        return extractor, model
+
+    yield make
+    for extractor in extractors:
+        extractor.close()
+
+
+def test_batch_closes_once_full(make_extractor):
+    extractor, model = make_extractor(max_batch_size=3, max_wait_ms=10_000)
+
+    started = time.monotonic()
+    messages = extractor.batch(["a", "b", "c"])
+
+    assert time.monotonic() - started < 5
+    assert len(model.calls) == 1
+    assert [m.response_metadata["batch_size"] for m in messages] == [3, 3, 3]
+    assert [m.content for m in messages] == ['{"ok": 1}'] * 3
+
+
+def test_batch_closes_after_max_wait(make_extractor):
+    extractor, model = make_extractor(max_batch_size=8, max_wait_ms=50)
+
+    started = time.monotonic()
+    message = extractor.invoke("alone")
+
+    assert time.monotonic() - started >= 0.05
+    assert message.response_metadata["batch_size"] == 1
+    assert message.usage_metadata["input_tokens"] == len("alone")
+    assert message.usage_metadata["output_tokens"] == len('{"ok": 1}')
+
+
+def test_longest_match_prefers_the_longest_shared_prefix():
+    cache = PrefixKVCache()
+    cache.put((1, 2), "short")
+    cache.put((1, 2, 3, 4), "long")
+    cache.put((9,), "other")
+
+    assert cache.longest_match([[1, 2, 3, 4, 5], [1, 2, 3, 4, 6]]) == (1, 2, 3, 4)
+    assert cache.longest_match([[1, 2, 3, 7], [1, 2, 5]]) == (1, 2)
+    # A prefix must leave at least one token of every sequence uncached.
+    assert cache.longest_match([[1, 2]]) is None
+    assert cache.longest_match([[5, 6]]) is None
+
+
+def test_prefix_cache_evicts_least_recently_used():
+    cache = PrefixKVCache(max_entries=2)
+    cache.put((1,), "a")
+    cache.put((2,), "b")
+    cache.get((1,))
+    cache.put((3,), "c")
+
+    assert (1,) in cache and (3,) in cache
+    assert (2,) not in cache
+    assert len(cache) == 2
+
+
+def test_shared_prefix_is_computed_once_and_reported_as_cache_read(make_extractor):
+    extractor, model = make_extractor(max_batch_size=2, max_wait_ms=10_000, min_prefix_tokens=8)
+
+    first = extractor.batch([DOCUMENT + "Extract: name", DOCUMENT + "Extract: email"])
+    shared = len(DOCUMENT + "Extract: ")
+    assert [m.usage_metadata["input_token_details"]["cache_read"] for m in first] == [shared, shared]
+    assert extractor.prefix_cache.misses == 1
+    # The cached prefix is copied and repeated for every row of the batch.
+    (call,) = model.calls
+    assert call["past_key_values"].length == shared and call["past_key_values"].batch_size == 2
+    assert all(row[:shared] == [ord(char) for char in DOCUMENT + "Extract: "] for row in call["input_ids"])
+
+    extractor.max_wait = 0.0
+    again = extractor.invoke(DOCUMENT + "Extract: age")
+    assert again.usage_metadata["input_token_details"]["cache_read"] == shared
+    assert again.usage_metadata["input_tokens"] == len(DOCUMENT + "Extract: age")
+    assert extractor.prefix_cache.hits == 1
+
+    cold = extractor.invoke("Unrelated prompt")
+    assert cold.usage_metadata["input_token_details"]["cache_read"] == 0
+    assert model.calls[-1]["past_key_values"] is None
+
+
+def test_chat_prompts_use_the_tokenizer_chat_template(make_extractor):
+    extractor, model = make_extractor(tokenizer=ChatTokenizer(), max_wait_ms=0)
+    prompt = get_template("extract_field").render(DOCUMENT, field_path="name", description="", field_name="name")
+
+    extractor.invoke(prompt.messages)
+
+    sent = "".join(chr(token) for token in model.calls[0]["input_ids"][0])
+    assert sent.startswith("\x01<|system|>You are a precise data extraction agent.")
+    assert sent.endswith("<|end|><|assistant|>")
+    # The template's own BOS is not doubled by the tokenizer.
+    assert not sent.startswith("\x01\x01")
+
+
+def test_warmed_document_prefix_is_reused_by_field_prompts(make_extractor):
+    extractor, model = make_extractor(tokenizer=ChatTokenizer(), max_wait_ms=0, min_prefix_tokens=8)
+    template = get_template("extract_field")
+
+    extractor.warm_prefix(template.render_prefix(DOCUMENT).messages)
+    message = extractor.invoke(
+        template.render(DOCUMENT, field_path="name", description="", field_name="name").messages
+    )
+
+    (key,) = extractor.prefix_cache._entries
+    assert "".join(chr(token) for token in key).endswith("DOCUMENT:\n---\n" + DOCUMENT + "\n---\n")
+    assert extractor.prefix_cache.hits == 1 and extractor.prefix_cache.misses == 0
+    assert message.usage_metadata["input_token_details"]["cache_read"] == len(key)
+
+
+def test_tiny_model_outputs_match_unbatched_uncached_generation():
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+
+    torch.manual_seed(0)
+    config = transformers.GPT2Config(vocab_size=128, n_positions=256, n_embd=32, n_layer=2, n_head=2,
+                                     bos_token_id=1, eos_token_id=2)
+    model = transformers.GPT2LMHeadModel(config).eval()
+    tokenizer = CharTokenizer()
+    prompts = [DOCUMENT + "Extract: name", DOCUMENT + "Extract: email address", DOCUMENT + "Extract: age"]
+
+    expected = []
+    for prompt in prompts:
+        ids = torch.tensor([tokenizer(prompt)["input_ids"]])
+        with torch.no_grad():
+            output = model.generate(
+                input_ids=ids,
+                attention_mask=torch.ones_like(ids),
+                max_new_tokens=8,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+            )
+        expected.append(tokenizer.decode(output[0, ids.shape[1]:]).strip())
+
+    extractor = LocalSLMExtractor(
+        "tiny-gpt2", tokenizer=tokenizer, model=model, max_batch_size=2, max_wait_ms=10_000,
+        max_new_tokens=8, min_prefix_tokens=8,
+    )
+    try:
+        batched = extractor.batch(prompts[:2])
+        extractor.max_wait = 0.0
+        cached = extractor.invoke(prompts[2])
+    finally:
+        extractor.close()
+
+    assert [m.content for m in batched + [cached]] == expected
+    assert cached.usage_metadata["input_token_details"]["cache_read"] > 0
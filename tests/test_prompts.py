@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+from hastd.core.prompts import (
+    estimated_usage_record,
+    get_template,
+    read_prompt_usage,
+    summarize_prompt_usage,
+    usage_record,
+)
+
+
+def test_field_prompts_share_a_byte_identical_prefix():
+    template = get_template("extract_field")
+    first = template.render("Jane Doe, jane@example.com", field_path="name", description="Name", field_name="name")
+    second = template.render("Jane Doe, jane@example.com", field_path="email", description="Email", field_name="email")
+
+    assert first.prefix == second.prefix
+    assert first.messages[0].content == second.messages[0].content
+    assert first.messages[1].content.startswith(first.prefix)
+    assert "'name'" in first.suffix and "'email'" in second.suffix
+    assert first.template_id == "extract_field@v1"
+
+
+def test_reads_cached_tokens_from_usage_metadata_and_raw_payloads():
+    normalized = SimpleNamespace(
+        usage_metadata={"input_tokens": 1200, "output_tokens": 10, "input_token_details": {"cache_read": 1024}}
+    )
+    openai_raw = SimpleNamespace(
+        usage_metadata=None,
+        response_metadata={"token_usage": {"prompt_tokens": 2000, "completion_tokens": 5,
+                                           "prompt_tokens_details": {"cached_tokens": 1536}}},
+    )
+
+    assert read_prompt_usage(normalized) == {"input_tokens": 1200, "cached_tokens": 1024, "output_tokens": 10}
+    assert read_prompt_usage(openai_raw)["cached_tokens"] == 1536
+    assert read_prompt_usage(None) == {"input_tokens": 0, "cached_tokens": 0, "output_tokens": 0}
+
+
+def test_summarizes_cached_ratio_per_template():
+    prompt = get_template("extract_field").render("doc", field_path="a", description="", field_name="a")
+    message = SimpleNamespace(usage_metadata={"input_tokens": 1000, "output_tokens": 5,
+                                              "input_token_details": {"cache_read": 750}})
+
+    report = summarize_prompt_usage([usage_record(prompt, message), usage_record(prompt, message)])
+
+    assert report["calls"] == 2
+    assert report["cached_ratio"] == 0.75
+    assert report["by_template"]["extract_field@v1"]["cached_tokens"] == 1500
+
+
+def test_estimated_records_do_not_skew_the_cached_ratio():
+    prompt = get_template("extract_field").render("doc", field_path="a", description="", field_name="a")
+    message = SimpleNamespace(usage_metadata={"input_tokens": 1000, "output_tokens": 5,
+                                              "input_token_details": {"cache_read": 750}})
+
+    report = summarize_prompt_usage([usage_record(prompt, message), estimated_usage_record(prompt, '{"a": 1}')])
+
+    assert report["calls"] == 2 and report["estimated_calls"] == 1
+    assert report["input_tokens"] > 1000
+    assert report["cached_ratio"] == 0.75
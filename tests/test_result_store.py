@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+from hastd.core.result_store import ResultStore
+
+COLUMNS = {"title": "string", "author.email": "string", "year": "integer", "tags[]": "array"}
+
+
+def store_result(store, doc_hash, values, **kwargs):
+    store.put(doc_hash, "schema", COLUMNS, values, {"final_json": values}, **kwargs)
+
+
+def test_point_lookup_returns_values_confidence_and_response():
+    store = ResultStore()
+    store_result(
+        store, "doc-1", {"title": "Deep Things", "author.email": "jane@example.com", "year": 2001},
+        attempts={"title": 1, "author.email": 2, "year": 1}, timings={"total": 1.5},
+    )
+
+    stored = store.get("doc-1", "schema")
+
+    assert store.get("doc-1", "other-schema") is None
+    assert stored["response"] == {"final_json": {"title": "Deep Things", "author.email": "jane@example.com",
+                                                 "year": 2001}}
+    assert stored["values"]["year"] == 2001
+    assert stored["confidence"]["author.email"] == 1.0
+    assert stored["attempts"] == 4
+    assert stored["timings"] == {"total": 1.5}
+
+
+def test_request_level_attempts_leave_per_field_attempts_null():
+    store = ResultStore()
+    store_result(store, "doc-1", {"title": "A", "year": 2001}, attempts={"title": 1, "year": 3})
+    store_result(store, "doc-2", {"title": "B", "year": 2002}, attempts=2)
+
+    rows = dict(
+        ((doc_hash, path), attempts)
+        for doc_hash, path, attempts in store._db.execute("SELECT doc_hash, field_path, attempts FROM field_values")
+    )
+
+    assert rows[("doc-1", "year")] == 3 and rows[("doc-1", "author.email")] is None
+    assert rows[("doc-2", "title")] is None and rows[("doc-2", "year")] is None
+    assert store.get("doc-2", "schema")["attempts"] == 2
+
+
+def test_exports_flat_columns_per_field_path(tmp_path):
+    store = ResultStore()
+    store_result(store, "doc-1", {"title": "A", "year": 2001, "tags[]": ["x", "y"]})
+    store_result(store, "doc-2", {"title": "B", "year": "not a year"}, errors="year: invalid")
+    store_result(store, "doc-1", {"title": "A2", "year": 2002})  # Replaces the first result
+
+    path = tmp_path / "results.jsonl"
+    assert store.export_jsonl(path) == 2
+    rows = [json.loads(line) for line in path.read_text().splitlines()]
+
+    assert [row["doc_hash"] for row in rows] == ["doc-2", "doc-1"]
+    assert rows[0]["year"] is None and rows[0]["errors"] == "year: invalid"
+    assert rows[1]["title"] == "A2" and rows[1]["year"] == 2002 and rows[1]["tags[]"] is None
+    assert set(rows[1]) >= {"title#confidence", "author.email", "elapsed_s", "attempts"}
+
+
+def test_batches_cover_every_result_once():
+    store = ResultStore()
+    for index in range(25):
+        store_result(store, f"doc-{index}", {"title": f"T{index}", "tags[]": [index]})
+
+    batches = [batch for _, batch in store.iter_batches("schema", batch_size=10)]
+
+    assert [len(batch["doc_hash"]) for batch in batches] == [10, 10, 5]
+    assert batches[2]["tags[]"][-1] == "[24]"
+
+
+def test_parquet_export_roundtrips_typed_columns(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    store = ResultStore()
+    store_result(store, "doc-1", {"title": "A", "year": 2001})
+
+    assert store.export_parquet(tmp_path / "results.parquet") == 1
+    table = pq.read_table(tmp_path / "results.parquet")
+
+    assert table.column("year").to_pylist() == [2001]
+    assert str(table.schema.field("year").type) == "int64"
@@ -1,5 +1,6 @@
 import pytest
-from hastd.core.schema_parser import parse_schema_to_tasks
+from hastd.core.schema_parser import SchemaCompiler, parse_json_schema, parse_schema_to_tasks
+from hastd.core.models import DynamicPydanticFactory
 
 
 def test_flat_schema_parsing():
@@ -94,3 +95,121 @@ def test_complex_mixed_schema():
     assert "metadata.doi" in paths
     assert "metadata.published" in paths
     assert "tags[]" in paths
+
+
+def test_refs_and_all_of_are_resolved():
+    schema = {
+        "$defs": {
+            "Address": {
+                "allOf": [
+                    {"properties": {"city": {"type": "string"}}},
+                    {"properties": {"zip": {"type": "string"}}, "required": ["zip"]},
+                ]
+            },
+            "Money": {"type": "number", "description": "Amount in USD"},
+        },
+        "type": "object",
+        "properties": {
+            "billing": {"$ref": "#/$defs/Address"},
+            "shipping": {"$ref": "#/$defs/Address"},
+            "total": {"$ref": "#/$defs/Money"},
+        },
+        "required": ["total"],
+    }
+
+    tasks = {task.field_path: task for task in parse_json_schema(schema)}
+
+    assert set(tasks) == {"billing.city", "billing.zip", "shipping.city", "shipping.zip", "total"}
+    assert tasks["billing.zip"].required and not tasks["billing.city"].required
+    assert tasks["total"].field_type == "number"
+    assert tasks["total"].required
+    assert tasks["total"].description == "Amount in USD"
+
+
+def test_shared_definitions_are_compiled_once():
+    schema = {
+        "$defs": {"Party": {"type": "object", "properties": {"name": {"type": "string"}}}},
+        "type": "object",
+        "properties": {name: {"$ref": "#/$defs/Party"} for name in ["buyer", "seller", "agent"]},
+    }
+
+    compiler = SchemaCompiler(schema)
+    paths = [task.field_path for task in compiler.compile()]
+
+    assert paths == ["buyer.name", "seller.name", "agent.name"]
+    assert compiler.stats["refs_compiled"] == 1
+    assert compiler.stats["refs_reused"] == 2
+
+
+def test_recursive_definitions_are_cut_into_leaf_tasks():
+    schema = {
+        "$defs": {
+            "Node": {
+                "type": "object",
+                "properties": {
+                    "label": {"type": "string"},
+                    "children": {"type": "array", "items": {"$ref": "#/$defs/Node"}},
+                },
+            }
+        },
+        "$ref": "#/$defs/Node",
+    }
+
+    tasks = {task.field_path: task.field_type for task in parse_json_schema(schema)}
+
+    assert tasks == {"label": "string", "children[]": "object"}
+
+
+def test_deep_schemas_do_not_recurse():
+    schema = {"type": "string"}
+    for _ in range(3000):
+        schema = {"type": "object", "properties": {"child": schema}}
+
+    tasks = parse_json_schema(schema, max_depth=5000)
+
+    assert len(tasks) == 1
+    assert tasks[0].field_path.count("child") == 3000
+
+
+def test_untyped_and_alternative_schemas():
+    schema = {
+        "properties": {
+            "status": {"enum": ["open", "closed"]},
+            "payment": {
+                "oneOf": [
+                    {"properties": {"card": {"type": "string"}}, "required": ["card"]},
+                    {"properties": {"iban": {"type": "string"}}},
+                ]
+            },
+            "notes": {"type": ["string", "null"]},
+        }
+    }
+
+    tasks = {task.field_path: task for task in parse_json_schema(schema)}
+
+    assert tasks["status"].field_type == "string"
+    assert tasks["status"].enum == ["open", "closed"]
+    assert set(tasks) == {"status", "payment.card", "payment.iban", "notes"}
+    assert not tasks["payment.card"].required
+    assert tasks["notes"].field_type == "string"
+
+
+def test_boolean_and_tuple_form_sub_schemas():
+    schema = {
+        "properties": {
+            "extra": True,
+            "point": {"type": "array", "items": [{"type": "number"}, {"type": "number"}]},
+            "pair": {"type": "array", "prefixItems": [{"type": "string"}, {"type": "string"}]},
+            "rows": {"type": "array", "items": [{"type": "object", "properties": {"id": {"type": "integer"}}}]},
+        }
+    }
+
+    tasks = {task.field_path: task for task in parse_json_schema(schema)}
+
+    assert tasks["extra"].field_type == "any"
+    assert tasks["point[]"].field_type == "number"
+    assert tasks["pair[]"].field_type == "string"
+    assert tasks["rows[].id"].field_type == "integer"
+    # The validation model accepts any value for a boolean sub-schema.
+    model = DynamicPydanticFactory.create_model_from_schema(schema)
+    assert model(extra={"anything": 1}).extra == {"anything": 1}
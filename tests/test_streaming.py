@@ -0,0 +1,70 @@
+from hastd.core.streaming import IncrementalJSONObjectParser, consume_field_stream
+
+
+def test_parser_emits_fields_as_they_close():
+    parser = IncrementalJSONObjectParser()
+
+    assert parser.feed('```json\n{"name": "Jane') == []
+    assert parser.feed(' Doe", "user_id": 123') == [("name", "Jane Doe")]
+    assert parser.feed('45, "tags": ["a", "b}"]') == [("user_id", 12345), ("tags", ["a", "b}"])]
+    assert parser.feed(', "author": {"email": "j@x.com"}}') == [("author", {"email": "j@x.com"})]
+    assert parser.done
+
+
+def test_parser_handles_escapes_and_literals():
+    parser = IncrementalJSONObjectParser()
+    pairs = []
+    for char in '{"quote": "say \\"hi\\"", "ok": true, "missing": null}':
+        pairs.extend(parser.feed(char))
+
+    assert pairs == [("quote", 'say "hi"'), ("ok", True), ("missing", None)]
+
+
+def test_stream_cancels_once_all_fields_arrive():
+    pulled = []
+
+    def token_stream():
+        for piece in ['{"name": "Jane",', ' "email": "jane@example.com"', ', "extra": "', "never", ' needed"}']:
+            pulled.append(piece)
+            yield piece
+
+    result = consume_field_stream(token_stream(), field_names=["name", "email"])
+
+    assert result.committed == {"name": "Jane", "email": "jane@example.com"}
+    assert result.cancelled_early
+    assert len(pulled) == 2
+
+
+class Chunk:
+    def __init__(self, content, usage_metadata=None):
+        self.content = content
+        self.usage_metadata = usage_metadata
+
+    def __add__(self, other):
+        return Chunk(self.content + other.content, other.usage_metadata or self.usage_metadata)
+
+
+def test_stream_reads_on_to_the_usage_chunk_when_asked():
+    chunks = [
+        Chunk('{"name": "Jane"'),
+        Chunk(', "note": "ignored"}'),
+        Chunk("", {"input_tokens": 90, "output_tokens": 9, "total_tokens": 99}),
+    ]
+
+    result = consume_field_stream(iter(chunks), field_names=["name"], wait_for_usage=True)
+
+    assert result.fields == {"name": "Jane"}
+    assert not result.cancelled_early
+    assert '"note"' not in result.raw_text
+    assert result.message.usage_metadata["total_tokens"] == 99
+
+
+def test_stream_keeps_invalid_fields_uncommitted():
+    def validate(name, value):
+        return None if isinstance(value, int) else "not an integer"
+
+    result = consume_field_stream(['{"user_id": "abc", "age": 3}'], ["user_id", "age"], validate_field=validate)
+
+    assert result.fields == {"user_id": "abc", "age": 3}
+    assert result.committed == {"age": 3}
+    assert "user_id" in result.errors